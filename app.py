@@ -1,14 +1,66 @@
-from flask import Flask
+import os
+import time
+
+_imports_started = time.perf_counter()
+
+from flask import Flask, jsonify
 from routes.extract_routes import extract_bp
 from routes.history_routes import history_bp
 from routes.auth_routes import auth_bp
+from routes.metrics_routes import metrics_bp
+from routes.pattern_routes import patterns_bp
+from services.upload_service import MAX_UPLOAD_BYTES, UploadRequest
+from utils.startup import STARTUP_TIMINGS, prewarm_in_background, record_timing
+
+# PyMuPDF, Pillow and pytesseract are not among these: they load on first use
+record_timing('imports', time.perf_counter() - _imports_started)
+
+DEFAULT_CONFIG = {
+    'UPLOAD_FOLDER': 'uploads',
+    'MAX_CONTENT_LENGTH': MAX_UPLOAD_BYTES,
+    # Load the extraction backends in a background thread right after startup
+    'PREWARM': os.getenv('PREWARM', 'false').lower() in ('1', 'true', 'yes'),
+}
+
+def create_app(config=None):
+    """
+    Build the Flask app
+
+    Args:
+        config: Settings applied over DEFAULT_CONFIG, e.g. {'PREWARM': True}
+
+    Returns:
+        The app; its startup timings are in app.extensions['startup_timings']
+    """
+    started = time.perf_counter()
+    app = Flask(__name__)
+    app.request_class = UploadRequest
+    app.config.update(DEFAULT_CONFIG)
+    app.config.update(config or {})
+
+    app.register_blueprint(extract_bp)
+    app.register_blueprint(history_bp)
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(metrics_bp)
+    app.register_blueprint(patterns_bp)
+
+    @app.errorhandler(413)
+    def request_too_large(e):
+        return jsonify({"error": f"Upload is larger than {app.config['MAX_CONTENT_LENGTH']} bytes"}), 413
 
-app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = 'uploads'
+    record_timing('create_app', time.perf_counter() - started)
+    app.extensions['startup_timings'] = STARTUP_TIMINGS
+    if app.config['PREWARM']:
+        prewarm_in_background()
+    return app
 
-app.register_blueprint(extract_bp)
-app.register_blueprint(history_bp)
-app.register_blueprint(auth_bp)
+def __getattr__(name):
+    # `from app import app` builds the default app on first use, so importing
+    # create_app alone doesn't create one
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
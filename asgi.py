@@ -0,0 +1,283 @@
+"""
+ASGI entry point for production serving
+
+    uvicorn asgi:application --workers 4
+    python asgi.py
+
+Request bodies are received and responses sent on the event loop, so slow
+clients never hold a thread; the Flask app (extraction, OCR, history I/O)
+runs in a bounded thread pool per process.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app import create_app
+from services.job_service import get_job_manager
+from services.upload_service import UPLOAD_SPOOL_BYTES, UPLOAD_TMP_DIR
+from utils.startup import format_timings
+
+# Threads running request handlers, per process
+ASGI_WORKERS = int(os.getenv('ASGI_WORKERS', 8))
+# Requests allowed to wait for a handler thread; more are answered 503
+ASGI_MAX_PENDING = int(os.getenv('ASGI_MAX_PENDING', 64))
+# Seconds shutdown waits for in-flight requests and extraction jobs
+ASGI_SHUTDOWN_TIMEOUT = float(os.getenv('ASGI_SHUTDOWN_TIMEOUT', 30))
+# Served processes load the extraction backends right away unless PREWARM=false
+PREWARM = os.getenv('PREWARM', 'true').lower() in ('1', 'true', 'yes')
+
+class BodyTooLarge(Exception):
+    """Raised when a request body exceeds MAX_CONTENT_LENGTH"""
+
+class ClientDisconnected(Exception):
+    """Raised when the client goes away before its request body arrived"""
+
+def build_environ(scope, body, length: int) -> dict:
+    """The WSGI environ of an ASGI HTTP scope, reading its body from the file body"""
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        # WSGI carries paths as latin-1 decoded bytes
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': str(length),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_LENGTH':
+            continue
+        key = name if name == 'CONTENT_TYPE' else f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+async def send_json(send, status: int, body: str, headers=()):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), *headers]})
+    await send({'type': 'http.response.body', 'body': body.encode()})
+
+class ASGIAdapter:
+    """
+    Serves a WSGI app over ASGI with a bounded handler pool
+
+    Unlike a generic WSGI-to-ASGI bridge, the body is read on the event loop
+    (kept in memory up to UPLOAD_SPOOL_BYTES, then spooled to a temp file
+    from the default executor, so disk writes don't stall other
+    connections) and only then handed to a handler thread, and oversized bodies are
+    rejected from their Content-Length before anything is read. Response
+    chunks are sent one at a time, so streamed results keep streaming, and a
+    client that disconnects stops its stream. When all workers are busy and
+    max_pending requests already wait (or are still sending their bodies),
+    new requests get a 503, before their body is read, instead of piling up.
+
+    On lifespan shutdown new requests get 503, in-flight ones and queued
+    extraction jobs are given shutdown_timeout seconds to finish.
+    """
+
+    def __init__(self, wsgi_app, workers: int = ASGI_WORKERS, max_pending: int = ASGI_MAX_PENDING,
+                 shutdown_timeout: float = ASGI_SHUTDOWN_TIMEOUT):
+        self.wsgi_app = wsgi_app
+        self.workers = workers
+        self.max_pending = max_pending
+        self.shutdown_timeout = shutdown_timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='asgi-handler')
+        self._dispatched = 0
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._closing = False
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        else:
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                print(f"Startup: {format_timings()}")
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.drain()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def drain(self):
+        """Stop taking requests and wait for in-flight requests and extraction jobs"""
+        self._closing = True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.shutdown_timeout
+        try:
+            await asyncio.wait_for(self._idle.wait(), self.shutdown_timeout)
+        except asyncio.TimeoutError:
+            print(f"Warning: Shutting down with {self._in_flight} requests still running")
+        # Only a manager some request created has jobs to wait for
+        if hasattr(get_job_manager, "instance"):
+            try:
+                await asyncio.wait_for(loop.run_in_executor(None, get_job_manager.instance.shutdown, True),
+                                       max(0.0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                print("Warning: Extraction jobs still running at shutdown timeout")
+        self._executor.shutdown(wait=False)
+
+    async def _http(self, scope, receive, send):
+        if self._closing:
+            await send_json(send, 503, '{"error": "Server is shutting down"}', [(b'connection', b'close')])
+            return
+        self._in_flight += 1
+        self._idle.clear()
+        try:
+            await self._handle(scope, receive, send)
+        finally:
+            self._in_flight -= 1
+            if not self._in_flight:
+                self._idle.set()
+
+    async def _read_body(self, receive, limit):
+        loop = asyncio.get_running_loop()
+        body = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES, dir=UPLOAD_TMP_DIR)
+        size = 0
+        try:
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    raise ClientDisconnected()
+                chunk = message.get('body', b'')
+                size += len(chunk)
+                if limit is not None and size > limit:
+                    raise BodyTooLarge()
+                if size > UPLOAD_SPOOL_BYTES:
+                    # Past the spool size writes go to disk (this one rolls the
+                    # spool over), so they are kept off the event loop
+                    await loop.run_in_executor(None, body.write, chunk)
+                else:
+                    body.write(chunk)
+                if not message.get('more_body'):
+                    break
+        except Exception:
+            body.close()
+            raise
+        body.seek(0)
+        return body, size
+
+    async def _handle(self, scope, receive, send):
+        limit = self.wsgi_app.config.get('MAX_CONTENT_LENGTH') if hasattr(self.wsgi_app, 'config') else None
+        too_large = f'{{"error": "Upload is larger than {limit} bytes"}}'
+        declared = dict(scope.get('headers', [])).get(b'content-length')
+        if limit is not None and declared is not None and declared.isdigit() and int(declared) > limit:
+            await send_json(send, 413, too_large, [(b'connection', b'close')])
+            return
+        # Capacity is taken before the body is read, so an overloaded server
+        # doesn't receive (and spool) uploads it is only going to refuse
+        if self._dispatched >= self.workers + self.max_pending:
+            await send_json(send, 503, '{"error": "Server is busy, retry later"}',
+                            [(b'retry-after', b'1'), (b'connection', b'close')])
+            return
+        self._dispatched += 1
+        try:
+            try:
+                body, size = await self._read_body(receive, limit)
+            except BodyTooLarge:
+                await send_json(send, 413, too_large, [(b'connection', b'close')])
+                return
+            except ClientDisconnected:
+                return
+            try:
+                await self._dispatch(scope, receive, send, body, size)
+            finally:
+                body.close()
+        finally:
+            self._dispatched -= 1
+
+    async def _dispatch(self, scope, receive, send, body, size: int):
+        loop = asyncio.get_running_loop()
+        disconnected = threading.Event()
+        state = {'started': False}
+
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            disconnected.set()
+
+        watcher = loop.create_task(watch_disconnect())
+        try:
+            await loop.run_in_executor(self._executor, self._run, build_environ(scope, body, size),
+                                       loop, send, disconnected, state)
+        except Exception as e:
+            print(f"Error handling {scope['method']} {scope['path']}: {str(e)}")
+            if not state['started']:
+                await send_json(send, 500, '{"error": "Internal server error"}')
+        finally:
+            watcher.cancel()
+
+    def _run(self, environ, loop, send, disconnected, state):
+        """Run the WSGI app in a handler thread, sending its response through the event loop"""
+        response = {}
+
+        def emit(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and state['started']:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'], response['headers'] = status, headers
+            return write
+
+        def start():
+            if not state['started']:
+                state['started'] = True
+                emit({'type': 'http.response.start', 'status': int(response['status'].split(' ', 1)[0]),
+                      'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                  for name, value in response['headers']]})
+
+        def write(chunk):
+            start()
+            emit({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+        body = self.wsgi_app(environ, start_response)
+        try:
+            for chunk in body:
+                if disconnected.is_set():
+                    return
+                if chunk:
+                    write(chunk)
+            start()
+            emit({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+
+application = ASGIAdapter(create_app({'PREWARM': PREWARM}))
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit("uvicorn is required to serve the ASGI app: pip install uvicorn")
+    uvicorn.run('asgi:application', host=os.getenv('HOST', '127.0.0.1'), port=int(os.getenv('PORT', 8000)),
+                workers=int(os.getenv('WEB_CONCURRENCY', 1)), lifespan='on',
+                timeout_graceful_shutdown=int(ASGI_SHUTDOWN_TIMEOUT))
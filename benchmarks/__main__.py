@@ -0,0 +1,367 @@
+"""
+Benchmark suite: field guessing, layout fields, PDF extraction and extraction policies, uploads, history I/O, search and stats, CSV export, startup and auth
+
+Every scenario runs the real code paths and reports throughput, p50/p95
+latency and peak memory. The JSON report can be saved and passed back as
+--baseline to compare runs. Tesseract is replaced by a mock backend when
+the binary is missing (or with --ocr mock), so the suite runs anywhere.
+
+Usage:
+    python -m benchmarks [--only history] [--quick] [--output report.json] [--baseline old.json]
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+from benchmarks.field_guesser import sample_texts, synthetic_page
+from benchmarks.harness import compare, measure
+from services import extract_service, history_service
+from services.extract_service import OCRBackend, extract_fields, extract_pages
+from services.history_backends import create_backend
+from utils import auth
+from utils.csv_export import BASE_COLUMNS, stream_csv
+from utils.extraction_policy import ExtractionPolicy, get_extraction_profiles
+from utils.field_guesser import get_field_guesser
+from utils.layout_fields import LayoutExtractor
+
+INVOICE_TEXT = """ACME Supplies Ltd.
+Invoice No: INV-20931
+Date: 12/03/2024
+Bill To: Jane Doe, 42 Main Street
+Description            Qty   Amount
+Paper A4 box             3   $ 45.00
+Toner cartridge          1   $ 129.99
+Subtotal: $ 174.99
+Tax: $ 14.00
+Total: $ 188.99
+"""
+
+class MockOCRBackend(OCRBackend):
+    """Stands in for Tesseract: returns canned invoice text after an optional delay"""
+
+    name = 'mock'
+
+    def __init__(self, delay_ms=0.0):
+        super().__init__()
+        self.delay = delay_ms / 1000.0
+
+    def image_to_string(self, img):
+        if self.delay:
+            time.sleep(self.delay)
+        return INVOICE_TEXT
+
+def tesseract_available():
+    try:
+        extract_service.create_ocr_backend('auto').image_to_string(Image.new('L', (32, 32), 255))
+        return True
+    except Exception:
+        return False
+
+def setup_ocr(mode, delay_ms):
+    """Install the OCR backend for the run; returns the name used"""
+    if mode == 'auto':
+        mode = 'real' if tesseract_available() else 'mock'
+    if mode == 'mock':
+        extract_service.get_ocr_backend.instance = MockOCRBackend(delay_ms)
+    return mode
+
+def make_pdf(pages, scanned=False):
+    """A generated invoice-like PDF; scanned pages carry only an image of the text"""
+    doc = fitz.open()
+    stamp = None
+    if scanned:
+        source = fitz.open()
+        source.new_page().insert_text((50, 72), INVOICE_TEXT, fontsize=11)
+        stamp = source[0].get_pixmap(dpi=100)
+    for number in range(pages):
+        page = doc.new_page()
+        if scanned:
+            page.insert_image(page.rect, pixmap=stamp)
+        else:
+            page.insert_text((50, 72), f"Page {number + 1}\n{INVOICE_TEXT}", fontsize=11)
+    return doc.tobytes()
+
+def selected(args, *names):
+    """Whether any of the scenario names passes the --only filter"""
+    return not args.only or any(part in name for name in names for part in args.only)
+
+def field_scenarios(args):
+    guesser = get_field_guesser()
+    suites = {
+        'invoice': [INVOICE_TEXT],
+        'history_samples': sample_texts(),
+        'large_ocr_page': [synthetic_page(seed=seed) for seed in range(3)],
+    }
+    for suite, texts in suites.items():
+        if not texts:
+            continue
+        for label, func in (('guess_fields', guesser.guess_fields), ('extract_fields', extract_fields)):
+            texts_cycle = itertools.cycle(texts)
+            repeat = args.repeat * (20 if suite == 'invoice' else 4)
+            yield f"{label}/{suite}", lambda func=func, texts_cycle=texts_cycle: func(next(texts_cycle)), repeat, 1
+
+def pdf_scenarios(args):
+    for pages in args.pdf_pages:
+        if not selected(args, f"pdf_extract/text/{pages}"):
+            continue
+        content = make_pdf(pages)
+        repeat = max(1, args.repeat if pages < 1000 else args.repeat // 2)
+        yield f"pdf_extract/text/{pages}", lambda content=content: extract_pages(content, 'pdf'), repeat, pages
+    if not selected(args, f"pdf_extract/scanned/{args.scanned_pages}"):
+        return
+    content = make_pdf(args.scanned_pages, scanned=True)
+    yield (f"pdf_extract/scanned/{args.scanned_pages}", lambda: extract_pages(content, 'pdf'),
+           args.repeat, args.scanned_pages)
+
+def policy_scenarios(args):
+    """Extraction policies on the longest text PDF and the scanned one; compare with pdf_extract/*"""
+    invoice = get_extraction_profiles()['invoice']
+    policies = {
+        'invoice': invoice,
+        'invoice_deferred': ExtractionPolicy(**{**invoice.as_dict(), 'skipped_text': 'defer'}),
+        'ocr_budget_1s': ExtractionPolicy(ocr_budget=1.0),
+    }
+    documents = {
+        f"text/{max(args.pdf_pages)}": (max(args.pdf_pages), False),
+        f"scanned/{args.scanned_pages}": (args.scanned_pages, True),
+    }
+    for document, (pages, scanned) in documents.items():
+        names = [f"pdf_policy/{name}/{document}" for name in policies]
+        if not selected(args, *names):
+            continue
+        content = make_pdf(pages, scanned=scanned)
+        for name, policy in policies.items():
+            yield (f"pdf_policy/{name}/{document}",
+                   lambda content=content, policy=policy: extract_pages(content, 'pdf', policy=policy),
+                   args.repeat, pages)
+
+def layout_scenarios(args):
+    """Label/value lookup from word positions on a generated invoice and the uploads/ PDFs"""
+    extractor = LayoutExtractor()
+    pages = {'invoice': fitz.open(stream=make_pdf(1), filetype='pdf')[0].get_text('words')}
+    if os.path.isdir('uploads'):
+        for name in sorted(os.listdir('uploads')):
+            if name.lower().endswith('.pdf'):
+                with fitz.open(os.path.join('uploads', name)) as doc:
+                    pages[name] = doc[0].get_text('words')
+    for name, words in pages.items():
+        yield f"layout_fields/{name}", lambda words=words: extractor.extract(words), args.repeat * 100, 1
+
+def upload_scenarios(args):
+    """Receiving and hashing an upload: whole-body read (the old way) vs spooled and memory-mapped"""
+    from io import BytesIO
+
+    from app import app
+    from services.cache_service import ExtractionCache
+    from services.upload_service import open_upload
+
+    size_mb = 4 if args.quick else 32
+    body = os.urandom(size_mb * 1024 * 1024)
+
+    def receive(spooled):
+        with app.test_request_context('/extract/', method='POST', data={'file': (BytesIO(body), 'scan.pdf')}):
+            from flask import request
+            file = request.files['file']
+            if spooled:
+                with open_upload(file) as upload:
+                    ExtractionCache.content_hash(upload.buffer())
+            else:
+                ExtractionCache.content_hash(file.read())
+
+    for label, spooled in (('read_into_memory', False), ('spooled', True)):
+        yield f"upload/{label}/{size_mb}MB", lambda spooled=spooled: receive(spooled), args.repeat, 1
+
+def history_entries(count):
+    """Synthetic history entries shaped like real extraction results"""
+    started = datetime(2024, 1, 1)
+    for index in range(count):
+        page = {'page': 1, 'text': INVOICE_TEXT, 'source': 'text', 'elapsed_ms': 1.0,
+                'fields': {'invoice_number': f"INV-{index}", 'total': '188.99', 'date': '2024-03-12'}}
+        result = {'file': f"invoice_{index}.pdf", 'pages': [page],
+                  'processed_at': (started + timedelta(seconds=index)).isoformat()}
+        entry = history_service.build_history_entry(result['file'], result)
+        entry['processed_at'] = result['processed_at']
+        yield entry
+
+def history_scenarios(args):
+    for kind in args.history_backends:
+        for size in args.history_sizes:
+            if not selected(args, *(f"{name}/{kind}/{size}" for name in ('save_history', 'load_history', 'csv_export'))):
+                continue
+            with tempfile.TemporaryDirectory() as directory:
+                backend = create_backend(kind, os.path.join(directory, 'history.json' if kind == 'json' else 'history.db'))
+                backend.append_many(history_entries(size))
+                history_service.get_history_backend.instance = backend
+                result = {'file': 'bench.pdf', 'pages': [{'page': 1, 'text': INVOICE_TEXT,
+                                                          'fields': {'total': '188.99'}}]}
+                try:
+                    yield (f"save_history/{kind}/{size}", lambda: history_service.save_history('bench.pdf', result),
+                           args.save_samples, 1)
+                    # Saves above grew the store a little; loads report the actual size
+                    current = backend.count()
+                    yield (f"load_history/{kind}/{size}", history_service.load_history,
+                           max(1, args.repeat // 2), current)
+
+                    def export():
+                        header = sorted(set(BASE_COLUMNS) | history_service.history_field_names())
+                        for _ in stream_csv(history_service.iter_history(), header):
+                            pass
+                    yield f"csv_export/{kind}/{size}", export, max(1, args.repeat // 2), current
+                finally:
+                    del history_service.get_history_backend.instance
+                    backend.close()
+
+def search_scenarios(args):
+    """Full-text search vs the LIKE scan it replaces, on needle and common-word queries"""
+    for size in args.history_sizes:
+        names = [f"history_search/{kind}/{query}/{size}" for kind in ('fts', 'like_scan') for query in ('needle', 'common')]
+        if not selected(args, *names):
+            continue
+        with tempfile.TemporaryDirectory() as directory:
+            backend = create_backend('sqlite', os.path.join(directory, 'history.db'))
+            backend.append_many(history_entries(size))
+            needle = f"INV-{size // 2}"
+            try:
+                for query, text in (('needle', needle), ('common', 'toner cartridge')):
+                    yield (f"history_search/fts/{query}/{size}", lambda text=text: backend.search(text, 20),
+                           args.repeat, 1)
+
+                    def scan(text=text):
+                        # Roughly what clients did before: every page checked for the words
+                        return backend.conn.execute(
+                            "SELECT entry_id, page FROM history_pages WHERE text LIKE ?",
+                            (f"%{text}%",)).fetchall()
+                    yield f"history_search/like_scan/{query}/{size}", scan, max(1, args.repeat // 2), 1
+            finally:
+                backend.close()
+
+def stats_scenarios(args):
+    """/history/stats from the incremental aggregates vs recomputing them from every entry"""
+    from services.history_backends import HistoryBackend
+    from services.history_stats import summarize
+
+    for size in args.history_sizes:
+        if not selected(args, *(f"history_stats/{kind}/{size}" for kind in ('aggregates', 'full_scan'))):
+            continue
+        with tempfile.TemporaryDirectory() as directory:
+            backend = create_backend('sqlite', os.path.join(directory, 'history.db'))
+            backend.append_many(history_entries(size))
+            group_by = ['month', 'file_type']
+            try:
+                yield (f"history_stats/aggregates/{size}", lambda: summarize(backend.stats_rows(), group_by),
+                       args.repeat, size)
+                # The generic implementation walks every entry, as clients summing exports did
+                yield (f"history_stats/full_scan/{size}",
+                       lambda: summarize(HistoryBackend.stats_rows(backend), group_by), max(1, args.repeat // 2), size)
+            finally:
+                backend.close()
+
+def startup_scenarios(args):
+    """Cold start of a process that builds the app, with lazy vs eagerly imported extraction backends"""
+    import subprocess
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    programs = {
+        'lazy': "from app import create_app; create_app()",
+        # What every process paid before the backends were loaded on first use
+        'eager': "import fitz, pytesseract; from PIL import Image; from app import create_app; create_app()",
+    }
+    for name, program in programs.items():
+        yield (f"startup/{name}",
+               lambda program=program: subprocess.run([sys.executable, '-c', program], cwd=root, check=True),
+               args.repeat, 1)
+
+def auth_scenarios(args):
+    from app import app
+
+    if not auth.get_auth_config().keys:
+        os.environ.setdefault('JWT_SECRET', 'benchmark-secret')
+        auth.reload_auth_config()
+    config = auth.get_auth_config()
+    token = auth.generate_token()
+    endpoint = auth.require_token(lambda: None)
+
+    def guarded_request():
+        with app.test_request_context('/history/', headers={'Authorization': f'Bearer {token}'}):
+            endpoint()
+
+    repeat = args.repeat * 200
+    # A zero-sized cache forces a full decode every time, as before the cache existed
+    auth.get_token_cache.instance = auth.TokenCache(max_items=0)
+    yield 'auth/verify_token/uncached', lambda: auth.verify_token(token), repeat, 1
+    yield 'auth/require_token/uncached', guarded_request, repeat, 1
+    auth.get_token_cache.instance = auth.TokenCache(config.cache_size, config.cache_ttl)
+    yield 'auth/verify_token/cached', lambda: auth.verify_token(token), repeat, 1
+    yield 'auth/require_token/cached', guarded_request, repeat, 1
+
+SCENARIOS = {
+    'fields': field_scenarios,
+    'pdf': pdf_scenarios,
+    'policy': policy_scenarios,
+    'layout': layout_scenarios,
+    'upload': upload_scenarios,
+    'history': history_scenarios,
+    'search': search_scenarios,
+    'stats': stats_scenarios,
+    'startup': startup_scenarios,
+    'auth': auth_scenarios,
+}
+
+def run(args):
+    report = {
+        'started_at': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'pdf_workers': extract_service.PDF_WORKERS,
+        'ocr': setup_ocr(args.ocr, args.mock_ocr_ms),
+        'scenarios': {},
+    }
+    for scenarios in SCENARIOS.values():
+        for name, func, repeat, items in scenarios(args):
+            if not selected(args, name):
+                continue
+            print(f"running {name}", file=sys.stderr)
+            report['scenarios'][name] = measure(func, repeat=repeat, warmup=1, items=items)
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--only', action='append', help='Run scenarios whose name contains this (repeatable)')
+    parser.add_argument('--quick', action='store_true', help='Small sizes, for a smoke run')
+    parser.add_argument('--repeat', type=int, default=5, help='Base number of timed runs per scenario')
+    parser.add_argument('--ocr', choices=['auto', 'real', 'mock'], default='auto')
+    parser.add_argument('--mock-ocr-ms', type=float, default=0.0, help='Simulated latency of the mock OCR')
+    parser.add_argument('--history-backends', default='sqlite,json')
+    parser.add_argument('--output', help='Also write the JSON report to this file')
+    parser.add_argument('--baseline', help='Previous report to compare against')
+    args = parser.parse_args(argv)
+
+    args.history_backends = [kind.strip() for kind in args.history_backends.split(',') if kind.strip()]
+    if args.quick:
+        args.pdf_pages, args.scanned_pages, args.history_sizes, args.save_samples = [1, 20], 2, [100, 1000], 5
+        args.repeat = min(args.repeat, 3)
+    else:
+        args.pdf_pages, args.scanned_pages, args.history_sizes, args.save_samples = [1, 100, 1000], 10, [1000, 10000, 100000], 20
+
+    report = run(args)
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['vs_baseline'] = compare(report, json.load(f))
+    output = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Per-page cost of FieldGuesser.guess_fields before and after pattern compilation
+
+Usage:
+    python -m benchmarks.field_guesser [--pages 20] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import random
+import re
+import time
+
+from utils.field_guesser import FieldGuesser
+
+SAMPLE_HISTORY = os.path.join('storage', 'history.json')
+
+def legacy_guess_fields(patterns, text):
+    """The original uncompiled implementation, kept as the baseline"""
+    results = {}
+    for field_name, field_patterns in patterns.items():
+        matches = []
+        for pattern in field_patterns:
+            for match in re.finditer(pattern, text, re.IGNORECASE):
+                value = match.group(0).strip()
+                value = re.sub(r'[\s,]+', '', value)
+                if value not in matches:
+                    matches.append(value)
+        if matches:
+            results[field_name] = matches
+    return results
+
+def sample_texts():
+    """Page texts from the stored history, used as realistic OCR samples"""
+    texts = []
+    if os.path.exists(SAMPLE_HISTORY):
+        with open(SAMPLE_HISTORY) as f:
+            for entry in json.load(f):
+                for page in (entry.get('result') or {}).get('pages', []):
+                    if page.get('text'):
+                        texts.append(page['text'])
+    return texts
+
+def synthetic_page(lines=800, seed=0):
+    """A long OCR-like statement page full of numbers, dates and amounts"""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(lines):
+        rows.append(
+            f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/20{rng.randint(10, 25)} "
+            f"Item {rng.randint(1000, 99999)} Qty {rng.randint(1, 9)} "
+            f"${rng.randint(1, 9999):,}.{rng.randint(0, 99):02d} "
+            f"Ref inv #{rng.randint(100, 999999)} call +1 555-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}"
+        )
+    rows.append("Total: $ 12,345.67")
+    return '\n'.join(rows)
+
+def measure(func, texts, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            func(text)
+        timings.append((time.perf_counter() - start) / len(texts))
+    return min(timings) * 1000
+
+def run(pages=20, repeat=5):
+    guesser = FieldGuesser()
+    suites = {
+        'sample_pages': sample_texts(),
+        'synthetic_large_pages': [synthetic_page(seed=i) for i in range(pages)],
+    }
+    report = {}
+    for name, texts in suites.items():
+        if not texts:
+            continue
+        # Both implementations must agree before their timings mean anything
+        for text in texts:
+            assert legacy_guess_fields(guesser.patterns, text) == guesser.guess_fields(text)
+        before = measure(lambda text: legacy_guess_fields(guesser.patterns, text), texts, repeat)
+        after = measure(guesser.guess_fields, texts, repeat)
+        report[name] = {
+            'pages': len(texts),
+            'avg_chars_per_page': sum(map(len, texts)) // len(texts),
+            'legacy_ms_per_page': round(before, 3),
+            'compiled_ms_per_page': round(after, 3),
+            'speedup': round(before / after, 2) if after else None,
+        }
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps(run(args.pages, args.repeat), indent=4))
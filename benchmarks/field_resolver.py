@@ -0,0 +1,194 @@
+"""
+Speed and accuracy of amount/date resolution, original heuristics vs the resolver
+
+Accuracy is measured on the sample documents (uploads/ PDFs and the OCR
+text of the sample images stored in history) and on generated invoices full
+of distractors (phone numbers, invoice IDs, due dates) with known answers.
+
+Usage:
+    python -m benchmarks.field_resolver [--invoices 200] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import random
+import re
+import time
+from datetime import date, timedelta
+
+import fitz  # PyMuPDF
+
+from benchmarks.field_guesser import SAMPLE_HISTORY
+from services.extract_service import extract_fields
+from utils.field_guesser import get_field_guesser
+from utils.field_resolver import parse_date
+
+# Expected values for the bundled samples; None means the field is not on the document
+SAMPLE_LABELS = {
+    'invoice1.pdf': {'amount': 0.0, 'date': None},
+    'Pament Receipt.pdf': {'amount': 2550000.0, 'date': date(2030, 4, 25)},
+    'Form1.pdf': {'amount': None, 'date': None},
+    'modern.png': {'amount': 901.80, 'date': date(2011, 12, 8)},
+    'sample_invoice_image.png': {'amount': 17550.0, 'date': date(2025, 8, 8)},
+    'formImage.png': {'amount': None, 'date': None},
+}
+
+def legacy_extract_fields(text):
+    """The original max()/dateutil heuristics, kept as the baseline"""
+    matches = get_field_guesser().guess_fields(text)
+    fields = {}
+    for field_name, values in matches.items():
+        if not values:
+            continue
+        if field_name in ['amount', 'total', 'invoice_number']:
+            try:
+                numeric_values = [float(re.sub(r'[^0-9.]', '', v)) for v in values if v]
+                if numeric_values:
+                    fields[field_name] = str(max(numeric_values))
+            except:
+                fields[field_name] = values[0]
+        elif field_name == 'date':
+            try:
+                from dateutil import parser
+                dates = []
+                for v in values:
+                    try:
+                        dates.append((parser.parse(v), v))
+                    except:
+                        continue
+                if dates:
+                    fields[field_name] = max(dates)[1]
+            except:
+                fields[field_name] = values[0]
+        else:
+            fields[field_name] = values[0]
+    return fields
+
+def sample_documents():
+    """(name, text, labels) for every labelled sample that is available"""
+    documents = {}
+    for name in SAMPLE_LABELS:
+        path = os.path.join('uploads', name)
+        if name.endswith('.pdf') and os.path.exists(path):
+            with fitz.open(path) as doc:
+                documents[name] = ''.join(page.get_text() for page in doc)
+    if os.path.exists(SAMPLE_HISTORY):
+        with open(SAMPLE_HISTORY) as f:
+            for entry in json.load(f):
+                pages = (entry.get('result') or {}).get('pages', [])
+                if entry.get('filename') in SAMPLE_LABELS and pages:
+                    documents.setdefault(entry['filename'], ''.join(page.get('text', '') for page in pages))
+    return [(name, text, SAMPLE_LABELS[name]) for name, text in documents.items()]
+
+def synthetic_invoice(rng):
+    """An OCR-like invoice whose total is not its largest number"""
+    issued = date(2020, 1, 1) + timedelta(days=rng.randint(0, 1800))
+    due = issued + timedelta(days=rng.choice([14, 30, 60]))
+    items = [(rng.randint(1, 5), rng.randint(500, 20000) / 100.0) for _ in range(rng.randint(2, 6))]
+    subtotal = sum(qty * price for qty, price in items)
+    tax = round(subtotal * 0.08, 2)
+    total = round(subtotal + tax, 2)
+    lines = [
+        f"Invoice #{rng.randint(100000, 9999999)}",
+        f"Phone: +1 {rng.randint(200, 999)}-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}",
+        f"Invoice date: {issued.strftime(rng.choice(['%m/%d/%Y', '%Y-%m-%d', '%d %b %Y']))}",
+        f"Due date: {due.strftime('%m/%d/%Y')}",
+        f"Account No: {rng.randint(10 ** 7, 10 ** 9)}",
+        "Description Qty Price",
+    ]
+    lines += [f"Item {index + 1} {qty} $ {price:,.2f}" for index, (qty, price) in enumerate(items)]
+    lines += [f"Subtotal: $ {subtotal:,.2f}", f"Tax: $ {tax:,.2f}", f"Total: $ {total:,.2f}"]
+    return '\n'.join(lines), {'amount': total, 'date': issued}
+
+def is_correct(field, value, expected):
+    if expected is None:
+        return value is None
+    if value is None:
+        return False
+    if field == 'amount':
+        return abs(float(value) - expected) < 0.005
+    parsed = parse_date(value)
+    return parsed is not None and parsed.date() == expected
+
+def accuracy(func, documents):
+    report = {}
+    for field in ('amount', 'date'):
+        correct = sum(is_correct(field, func(text).get(field), labels[field]) for _, text, labels in documents)
+        report[field] = round(correct / len(documents), 3) if documents else None
+    return report
+
+def measure(func, texts, repeat):
+    timings = []
+    for _ in range(repeat):
+        parse_date.cache_clear()
+        start = time.perf_counter()
+        for text in texts:
+            func(text)
+        timings.append((time.perf_counter() - start) / len(texts))
+    return min(timings) * 1000
+
+def date_parsing(texts, repeat):
+    """Per-candidate cost of dateutil vs the resolver's format parsers (cold and memoized)"""
+    from dateutil import parser
+
+    guesser = get_field_guesser()
+    candidates = [value for text in texts for value in guesser.guess_fields(text).get('date', [])]
+    if not candidates:
+        return None
+
+    def with_dateutil():
+        for value in candidates:
+            try:
+                parser.parse(value)
+            except (ValueError, OverflowError):
+                pass
+
+    def cold():
+        parse_date.cache_clear()
+        for value in candidates:
+            parse_date(value)
+
+    def warm():
+        for value in candidates:
+            parse_date(value)
+
+    report = {'candidates': len(candidates)}
+    for name, func in (('dateutil_us', with_dateutil), ('resolver_cold_us', cold), ('resolver_memoized_us', warm)):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) / len(candidates))
+        report[name] = round(min(timings) * 1e6, 2)
+    return report
+
+def run(invoices=200, repeat=5, seed=0):
+    rng = random.Random(seed)
+    suites = {
+        'samples': sample_documents(),
+        'synthetic_invoices': [(f"invoice_{i}", *synthetic_invoice(rng)) for i in range(invoices)],
+    }
+    report = {}
+    for name, documents in suites.items():
+        if not documents:
+            continue
+        texts = [text for _, text, _ in documents]
+        before = measure(legacy_extract_fields, texts, repeat)
+        after = measure(extract_fields, texts, repeat)
+        report[name] = {
+            'documents': len(documents),
+            'legacy_ms_per_doc': round(before, 3),
+            'resolver_ms_per_doc': round(after, 3),
+            'speedup': round(before / after, 2) if after else None,
+            'legacy_accuracy': accuracy(legacy_extract_fields, documents),
+            'resolver_accuracy': accuracy(extract_fields, documents),
+        }
+    report['date_parsing'] = date_parsing([text for documents in suites.values() for _, text, _ in documents], repeat)
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--invoices', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps(run(args.invoices, args.repeat), indent=4))
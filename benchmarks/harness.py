@@ -0,0 +1,77 @@
+"""
+Timing and memory measurement shared by the benchmark scenarios
+"""
+import gc
+import math
+import time
+import tracemalloc
+from typing import Callable, Dict
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+def measure(func: Callable[[], object], repeat: int = 5, warmup: int = 1, items: int = 1) -> Dict:
+    """
+    Run func repeatedly and summarise its latency, throughput and peak memory
+
+    Timings are taken without tracing; peak memory comes from one extra
+    traced run so tracemalloc's overhead does not skew the latencies.
+
+    Args:
+        func: The operation, called with no arguments
+        repeat: Timed runs
+        warmup: Untimed runs before timing
+        items: Units of work (pages, entries, ...) done by one call
+
+    Returns:
+        Dict with ops, items_per_op, throughput_per_s (items), mean/p50/p95/min/max in ms
+        and peak_memory_kb
+    """
+    for _ in range(warmup):
+        func()
+
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    total_ms = sum(timings)
+    return {
+        'ops': repeat,
+        'items_per_op': items,
+        'throughput_per_s': round(items * repeat / (total_ms / 1000), 2) if total_ms else None,
+        'mean_ms': round(total_ms / repeat, 3),
+        'p50_ms': round(percentile(timings, 0.50), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'min_ms': round(timings[0], 3),
+        'max_ms': round(timings[-1], 3),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+def compare(report: Dict, baseline: Dict) -> Dict:
+    """Throughput and p95 of every scenario relative to a previous report"""
+    previous = baseline.get('scenarios', {})
+    changes = {}
+    for name, result in report['scenarios'].items():
+        before = previous.get(name)
+        if not before or not before.get('throughput_per_s') or not result.get('throughput_per_s'):
+            continue
+        changes[name] = {
+            'throughput_ratio': round(result['throughput_per_s'] / before['throughput_per_s'], 3),
+            'p95_ratio': round(result['p95_ms'] / before['p95_ms'], 3) if before.get('p95_ms') else None,
+        }
+    return changes
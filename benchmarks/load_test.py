@@ -0,0 +1,178 @@
+"""
+Throughput of POST /extract under many concurrent uploads: Flask dev server vs the ASGI mode
+
+Each server is started in a subprocess on a free port, with its own
+temporary history and cache. The script then sends uploads of a generated
+PDF from many client threads and reports requests/s, latency percentiles
+and status counts. Every upload is made unique, so the extraction cache
+can't answer it.
+
+Usage:
+    python -m benchmarks.load_test [--servers wsgi,asgi] [--concurrency 32] [--requests 200] [--pages 5]
+    python -m benchmarks.load_test --url http://127.0.0.1:8000   # a server that is already running
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+
+from benchmarks.harness import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    # What `python app.py` runs, minus the debugger and reloader
+    'wsgi': lambda port, args: [sys.executable, '-c',
+                                f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True)"],
+    'asgi': lambda port, args: [sys.executable, '-m', 'uvicorn', 'asgi:application', '--host', '127.0.0.1',
+                                '--port', str(port), '--workers', str(args.processes), '--log-level', 'warning'],
+}
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def multipart(filename: str, content: bytes):
+    boundary = uuid.uuid4().hex
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{filename}\"\r\n"
+            f"Content-Type: application/pdf\r\n\r\n").encode() + content + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+def upload(url, token: str, content: bytes, chunk_delay: float):
+    """POST one document; returns (status, seconds)"""
+    # Trailing bytes after %%EOF are ignored by PDF readers but change the content hash
+    body, content_type = multipart('load.pdf', content + f"\n%{uuid.uuid4().hex}\n".encode())
+    started = time.perf_counter()
+    connection = http.client.HTTPConnection(url.hostname, url.port, timeout=300)
+    try:
+        connection.putrequest('POST', '/extract/')
+        connection.putheader('Authorization', f"Bearer {token}")
+        connection.putheader('Content-Type', content_type)
+        connection.putheader('Content-Length', str(len(body)))
+        connection.endheaders()
+        if chunk_delay:
+            # A slow client: the body trickles in 64KB at a time
+            for offset in range(0, len(body), 65536):
+                connection.send(body[offset:offset + 65536])
+                time.sleep(chunk_delay)
+        else:
+            connection.send(body)
+        response = connection.getresponse()
+        response.read()
+        status = response.status
+    except OSError:
+        status = 'error'
+    finally:
+        connection.close()
+    return status, time.perf_counter() - started
+
+def run_load(url, token: str, content: bytes, requests: int, concurrency: int, chunk_delay: float):
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    remaining = iter(range(requests))
+
+    def client():
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            status, seconds = upload(url, token, content, chunk_delay)
+            with lock:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                if status == 200:
+                    latencies.append(seconds * 1000)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'statuses': statuses,
+        'throughput_per_s': round(statuses.get('200', 0) / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 0.50), 1) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95), 1) if latencies else None,
+        'max_ms': round(latencies[-1], 1) if latencies else None,
+        'elapsed_s': round(elapsed, 2),
+    }
+
+def wait_ready(url, process, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            connection = http.client.HTTPConnection(url.hostname, url.port, timeout=2)
+            connection.request('GET', '/metrics')
+            connection.getresponse().read()
+            connection.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("Server did not start in time")
+
+def serve_and_load(kind: str, args, token: str, content: bytes):
+    port = free_port()
+    url = urlparse(f"http://127.0.0.1:{port}")
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ,
+                   HISTORY_DB_PATH=os.path.join(directory, 'history.db'),
+                   EXTRACT_CACHE_DIR=os.path.join(directory, 'cache'))
+        process = subprocess.Popen(SERVERS[kind](port, args), cwd=ROOT, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_ready(url, process)
+            run_load(url, token, content, min(args.concurrency, args.requests), args.concurrency, 0)  # warm up
+            return run_load(url, token, content, args.requests, args.concurrency, args.chunk_delay_ms / 1000)
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+def main(argv=None):
+    from benchmarks.__main__ import make_pdf
+    from utils import auth
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--servers', default='wsgi,asgi', help='Servers to start and compare')
+    parser.add_argument('--url', help='Load an already running server instead (needs its JWT_SECRET)')
+    parser.add_argument('--concurrency', type=int, default=32, help='Client threads')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--pages', type=int, default=5, help='Pages of the uploaded PDF')
+    parser.add_argument('--chunk-delay-ms', type=float, default=0.0,
+                        help='Pause between 64KB body chunks, to simulate slow clients')
+    parser.add_argument('--processes', type=int, default=1, help='uvicorn worker processes for asgi')
+    args = parser.parse_args(argv)
+
+    if not args.url:
+        os.environ.setdefault('JWT_SECRET', 'load-test-secret')
+    auth.reload_auth_config()
+    token = auth.generate_token()
+    content = make_pdf(args.pages)
+
+    if args.url:
+        report = {args.url: run_load(urlparse(args.url), token, content, args.requests, args.concurrency,
+                                     args.chunk_delay_ms / 1000)}
+    else:
+        report = {kind: serve_and_load(kind, args, token, content)
+                  for kind in (kind.strip() for kind in args.servers.split(',')) if kind}
+    print(json.dumps(report, indent=4))
+
+if __name__ == '__main__':
+    main()
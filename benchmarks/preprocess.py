@@ -0,0 +1,97 @@
+"""
+OCR latency of the sample images in uploads/ with and without preprocessing
+
+Each image is measured as uploaded and, with --photo-side, upscaled to a
+phone-camera sized colour image. OCR timings need Tesseract; without it
+only preprocessing cost and pixel reduction are reported.
+
+Usage:
+    python -m benchmarks.preprocess [--steps grayscale,downscale,deskew] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import time
+
+from PIL import Image
+
+from services.extract_service import ocr_image
+from utils.image_preprocess import PREPROCESS_STEPS, ImagePreprocessor
+
+SAMPLE_DIR = 'uploads'
+SAMPLE_EXTENSIONS = ('png', 'jpg', 'jpeg', 'tiff', 'webp')
+
+def sample_images(directory=SAMPLE_DIR):
+    for name in sorted(os.listdir(directory)):
+        if name.lower().split('.')[-1] in SAMPLE_EXTENSIONS:
+            with Image.open(os.path.join(directory, name)) as img:
+                img.load()
+                yield name, img.copy()
+
+def as_photo(img, side):
+    """Upscale to a phone-camera sized colour image"""
+    scale = side / float(max(img.size))
+    return img.convert('RGB').resize((round(img.width * scale), round(img.height * scale)),
+                                     Image.Resampling.BICUBIC)
+
+def best_of(func, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000, result
+
+def ocr_available():
+    try:
+        ocr_image(Image.new('L', (32, 32), 255))
+        return True
+    except Exception:
+        return False
+
+def measure(img, preprocessor, repeat, with_ocr):
+    preprocess_ms, processed = best_of(lambda: preprocessor.process(img), repeat)
+    report = {
+        'input': {'size': list(img.size), 'mode': img.mode},
+        'output': {'size': list(processed.size), 'mode': processed.mode},
+        'pixel_ratio': round(processed.width * processed.height / float(img.width * img.height), 3),
+        'preprocess_ms': round(preprocess_ms, 1),
+    }
+    if with_ocr:
+        raw_ms, raw_text = best_of(lambda: ocr_image(img), repeat)
+        ocr_ms, text = best_of(lambda: ocr_image(processed), repeat)
+        report.update({
+            'ocr_raw_ms': round(raw_ms, 1),
+            'ocr_preprocessed_ms': round(ocr_ms, 1),
+            'total_preprocessed_ms': round(preprocess_ms + ocr_ms, 1),
+            'speedup': round(raw_ms / (preprocess_ms + ocr_ms), 2),
+            'raw_chars': len(raw_text.strip()),
+            'preprocessed_chars': len(text.strip()),
+        })
+    return report
+
+def run(steps=None, repeat=3, photo_side=4032):
+    preprocessor = ImagePreprocessor(steps=steps)
+    with_ocr = ocr_available()
+    report = {'steps': preprocessor.steps, 'ocr': with_ocr, 'images': {}}
+    for name, img in sample_images():
+        variants = {'uploaded': img}
+        if photo_side:
+            variants['photo'] = as_photo(img, photo_side)
+        report['images'][name] = {
+            variant: measure(source, preprocessor, repeat, with_ocr)
+            for variant, source in variants.items()
+        }
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--steps', default=','.join(PREPROCESS_STEPS),
+                        help='Comma-separated preprocessing steps')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--photo-side', type=int, default=4032,
+                        help='Longest side of the simulated phone photo (0 to skip)')
+    args = parser.parse_args()
+    steps = [step.strip() for step in args.steps.split(',') if step.strip()]
+    print(json.dumps(run(steps, args.repeat, args.photo_side), indent=4))
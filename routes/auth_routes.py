@@ -1,5 +1,5 @@
 from flask import Blueprint, request, jsonify
-from utils.auth import generate_token, verify_token
+from utils.auth import generate_token, get_auth_config, verify_token
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -21,7 +21,7 @@ def generate_token_endpoint():
         token = generate_token()
         return jsonify({
             'token': token,
-            'expires_in': 86400  # 1 day in seconds
+            'expires_in': get_auth_config().token_ttl
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1,24 +1,62 @@
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context, url_for
 from services.history_service import save_history
-from PIL import Image
-from io import BytesIO
-from services.extract_service import extract_fields
-import pytesseract
-from datetime import datetime
-import fitz  # PyMuPDF
+from services.extract_service import SUPPORTED_EXTENSIONS, extract_document, stream_document
+from services.cache_service import get_extraction_cache
+from services.job_service import QueueFullError, get_job_manager
+from services.batch_service import BatchError, collect_batch, iter_batch_results
+from services.upload_service import UPLOAD_KEEP_COPIES, open_upload, save_upload_copy
 from utils.auth import require_token
-from utils.csv_export import export_to_csv
-
-# Set Tesseract path for Windows
-tesseract_path = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
-pytesseract.pytesseract.tesseract_cmd = tesseract_path
+from utils.extraction_policy import parse_policy_params
+from utils.metrics import StageTimer
+import json
 
 extract_bp = Blueprint('extract', __name__, url_prefix='/extract')
 
+def _wants_stream():
+    """Streaming is opt-in via ?stream=ndjson or an Accept: application/x-ndjson header"""
+    if request.args.get('stream', '').lower() in ('1', 'true', 'ndjson'):
+        return True
+    return request.accept_mimetypes.best == 'application/x-ndjson'
+
+def _stream_extraction(upload, filename, timer, policy):
+    def generate():
+        try:
+            for record in stream_document(upload, filename, policy=policy):
+                yield json.dumps(record) + '\n'
+        except Exception as e:
+            yield json.dumps({"error": str(e)}) + '\n'
+        finally:
+            upload.close()
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    # The generator never runs if the client goes away before the body is sent
+    response.call_on_close(upload.close)
+    # Headers go out before the body, so only the upload can be reported
+    response.headers['Server-Timing'] = timer.server_timing()
+    return response
+
 @extract_bp.route('/', methods=['POST'])
 @require_token
 def extract_file():
-    if 'file' not in request.files:
+    """
+    Extract text and fields from an uploaded PDF or image
+
+    With ?stream=ndjson (or Accept: application/x-ndjson) the response is
+    streamed: one {"page", "text", "fields", ...} line per page as soon as it
+    is extracted, then a {"summary": {...}} line.
+
+    Time spent per stage (upload, cache, load, preprocess, ocr, fields,
+    history) is reported in the Server-Timing header, and in a "timings"
+    field of the body with ?timings=1.
+
+    ?profile= and the policy parameters (first_pages, last_pages,
+    required_fields, min_confidence, ocr_budget, skipped_text) limit which
+    pages are searched for fields and how much OCR the document gets.
+    """
+    timer = StageTimer()
+    with timer.stage('upload'):
+        has_file = 'file' in request.files
+    if not has_file:
         return jsonify({"error": "No file uploaded"}), 400
 
     file = request.files['file']
@@ -26,70 +64,172 @@ def extract_file():
         return jsonify({"error": "No file selected"}), 400
 
     try:
-        # Read file content directly from request
-        file_content = file.read()
-        
+        policy = parse_policy_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
         # Get file extension
         file_extension = file.filename.lower().split('.')[-1]
-        
-        # Process PDF directly from memory
-        if file_extension == 'pdf':
-            try:
-                doc = fitz.open(stream=file_content, filetype="pdf")
-                pages = []
-                
-                for page_num, page in enumerate(doc):
-                    text = page.get_text()
-                    fields = extract_fields(text)
-                    pages.append({
-                        'page': page_num + 1,
-                        'text': text,
-                        'fields': fields
-                    })
-                
-                doc.close()
-                
-                result = {
-                    'file': file.filename,
-                    'pages': pages,
-                    'processed_at': datetime.now().isoformat()
-                }
-                
-                save_history(file.filename, result)
-                return jsonify(result), 200
-                
-            except Exception as e:
-                return jsonify({"error": f"Failed to process PDF: {str(e)}"}), 500
-        
-        # Process image using PIL
-        elif file_extension in ['png', 'jpg', 'jpeg', 'tiff']:
-            try:
-                from io import BytesIO
-                img = Image.open(BytesIO(file_content))
-                text = pytesseract.image_to_string(img)
-                fields = extract_fields(text)
-                pages = [{
-                    'page': 1,
-                    'text': text,
-                    'fields': fields
-                }]
-                
-                result = {
-                    'file': file.filename,
-                    'pages': pages,
-                    'processed_at': datetime.now().isoformat()
-                }
-                
-                save_history(file.filename, result)
-                return jsonify(result), 200
-                
-            except Exception as e:
-                return jsonify({"error": f"Failed to process image: {str(e)}"}), 500
-        
-        else:
+        if file_extension not in SUPPORTED_EXTENSIONS:
             return jsonify({"error": "Unsupported file type"}), 400
-            
+
+        # Large uploads stay in the temp file the request spooled them to
+        with timer.stage('upload'):
+            upload = open_upload(file)
+        try:
+            if UPLOAD_KEEP_COPIES:
+                with timer.stage('upload'):
+                    save_upload_copy(upload, current_app.config['UPLOAD_FOLDER'])
+            if _wants_stream():
+                return _stream_extraction(upload, file.filename, timer, policy)
+        except Exception:
+            upload.close()
+            raise
+
+        try:
+            result = extract_document(upload, file.filename, timer=timer, policy=policy)
+        except Exception as e:
+            kind = 'PDF' if file_extension == 'pdf' else 'image'
+            return jsonify({"error": f"Failed to process {kind}: {str(e)}"}), 500
+        finally:
+            upload.close()
+
+        with timer.stage('history'):
+            save_history(file.filename, result)
+        if request.args.get('timings', '').lower() in ('1', 'true'):
+            result = {**result, 'timings': timer.as_dict()}
+        response = jsonify(result)
+        response.headers['X-Cache'] = result['cache'].upper()
+        response.headers['Server-Timing'] = timer.server_timing()
+        return response, 200
+
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@extract_bp.route('/batch', methods=['POST'])
+@require_token
+def extract_batch():
+    """
+    Extract many files in one request
+
+    Request:
+    - form-data: one or more "files" (or "file") parts; zip archives are
+      expanded and every supported document inside is processed
+
+    Response (application/x-ndjson), one line per file as it completes:
+    {"index": 0, "file": "a.pdf", "status": "completed", "result": {...}}
+    {"index": 1, "file": "b.png", "status": "failed", "error": "..."}
+    followed by {"summary": {"files": 2, "completed": 1, "failed": 1, "history_saved": 1}}
+
+    Takes the same extraction policy parameters as POST /extract/.
+    """
+    try:
+        policy = parse_policy_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    files = request.files.getlist('files') + request.files.getlist('file')
+    try:
+        documents = collect_batch(files)
+    except BatchError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def generate():
+        for record in iter_batch_results(documents, policy):
+            yield json.dumps(record) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@extract_bp.route('/jobs', methods=['POST'])
+@require_token
+def create_job():
+    """
+    Queue a file for asynchronous extraction
+
+    Request:
+    - form-data: file
+    - query: the extraction policy parameters of POST /extract/ (optional)
+
+    Response (202):
+    {
+        "id": "<job id>",
+        "status": "queued",
+        "status_url": "/extract/jobs/<job id>",
+        ...
+    }
+
+    Returns 429 with a Retry-After header when the queue is full.
+    """
+    if 'file' not in request.files:
+        return jsonify({"error": "No file uploaded"}), 400
+
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({"error": "No file selected"}), 400
+
+    if file.filename.lower().split('.')[-1] not in SUPPORTED_EXTENSIONS:
+        return jsonify({"error": "Unsupported file type"}), 400
+
+    try:
+        policy = parse_policy_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        job = get_job_manager().submit(open_upload(file), file.filename, policy)
+    except QueueFullError as e:
+        response = jsonify({"error": str(e)})
+        response.headers['Retry-After'] = '5'
+        return response, 429
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    job['status_url'] = url_for('extract.get_job', job_id=job['id'])
+    response = jsonify(job)
+    response.headers['Location'] = job['status_url']
+    return response, 202
+
+@extract_bp.route('/jobs/<job_id>', methods=['GET'])
+@require_token
+def get_job(job_id):
+    """
+    Get the status of an extraction job
+
+    Response:
+    {
+        "id": "<job id>",
+        "status": "queued" | "running" | "completed" | "failed",
+        "progress": {"pages_done": 3, "pages_total": 10},
+        "result": {...},  # once completed
+        "error": "..."    # if failed
+    }
+    """
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
+@extract_bp.route('/cache', methods=['GET'])
+@require_token
+def cache_stats():
+    """Get extraction cache statistics"""
+    cache = get_extraction_cache()
+    if cache is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify({"enabled": True, **cache.stats()}), 200
+
+@extract_bp.route('/cache', methods=['DELETE'])
+@require_token
+def purge_cache():
+    """
+    Purge cached extraction results
 
+    Query parameters:
+    - hash: Only purge entries for this content hash (as returned in content_hash)
+    """
+    cache = get_extraction_cache()
+    if cache is None:
+        return jsonify({"enabled": False, "removed": 0}), 200
+    removed = cache.purge(request.args.get('hash') or None)
+    return jsonify({"enabled": True, "removed": removed}), 200
@@ -1,69 +1,169 @@
-from flask import Blueprint, jsonify, send_file, make_response, request
-from services.history_service import load_history
+from flask import Blueprint, jsonify, Response, request, stream_with_context
+from services.history_service import (
+    history_field_names, history_stats, iter_history, parse_history_filters, parse_history_query,
+    parse_search_params, parse_stats_params, query_history, search_history
+)
+from services.history_backends import FULL_PROJECTION, parse_projection
 from utils.auth import require_token
-from utils.csv_export import export_to_csv
-from io import StringIO
-import os
+from utils.csv_export import BASE_COLUMNS, stream_csv
+from itertools import chain
+import json
 
 history_bp = Blueprint('history', __name__, url_prefix='/history')
 
+# Exports include page text by default but not the duplicated result payload
+EXPORT_PROJECTION = FULL_PROJECTION - {'result'}
+
 @history_bp.route('/', methods=['GET'])
 @require_token
 def get_history():
-    """Get processing history in JSON format"""
+    """
+    Get processing history in JSON format, newest first
+
+    Query parameters:
+    - limit: Entries per page (default 50, max 500)
+    - after: Cursor from the previous page's next_cursor
+    - since / until: Only entries processed after / before an ISO timestamp
+    - file_type: e.g. pdf, png
+    - invoice_number, date, total, amount, vendor, description: Exact field values
+    - fields: Comma-separated keys to return. Page text ("pages.text") and the
+      raw "result" payload are only included when listed; "*" returns everything.
+
+    Response:
+    {
+        "items": [...],
+        "next_cursor": "..."  # null on the last page
+    }
+    """
+    try:
+        limit, after, filters, projection = parse_history_query(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        items, next_cursor = query_history(limit, after, filters, projection)
+        return jsonify({'items': items, 'next_cursor': next_cursor}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@history_bp.route('/search', methods=['GET'])
+@require_token
+def search():
+    """
+    Full-text search over the extracted text and fields of every page in the history
+
+    Query parameters:
+    - q: Words (all must match), "quoted phrases", prefix* terms, -excluded terms,
+      OR between alternatives and field:term to search one field only, e.g.
+      q=acme "office supplies" or q=invoice_number:INV-20931
+    - limit: Hits per page (default 20, max 100)
+    - offset: Hits to skip
+    - since / until, file_type, invoice_number, ...: Same filters as /history
+
+    Response:
+    {
+        "items": [{"id": 9, "filename": "invoice1.pdf", "page": 1, "score": 7.2,
+                   "snippet": "...<mark>ACME</mark> Supplies...", ...}],
+        "has_more": false
+    }
+    """
     try:
-        return jsonify(load_history()), 200
+        query, limit, offset, filters = parse_search_params(request.args)
+        items, has_more = search_history(query, limit, offset, filters)
+        return jsonify({'items': items, 'has_more': has_more}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except NotImplementedError as e:
+        return jsonify({"error": str(e)}), 501
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@history_bp.route('/stats', methods=['GET'])
+@require_token
+def stats():
+    """
+    Summary of the history for dashboards
+
+    Query parameters:
+    - group_by: day (default), week or month, and/or file_type, comma-separated,
+      e.g. group_by=month,file_type
+    - since / until: Only days from / up to the day of an ISO timestamp
+    - file_type: Only this file type
+
+    Response:
+    {
+        "group_by": ["month"],
+        "buckets": [{"period": "2025-08", "documents": 12, "pages": 40, "text_length": 51234,
+                     "total": {"count": 10, "sum": 1520.5, "min": 12.0, "max": 640.0, "avg": 152.05},
+                     "amount": {...}}],
+        "totals": {...}
+    }
+    """
+    try:
+        group_by, filters = parse_stats_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        return jsonify(history_stats(group_by, filters)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def _stream_json_array(entries):
+    yield '['
+    for index, entry in enumerate(entries):
+        yield (',\n' if index else '\n') + json.dumps(entry)
+    yield '\n]\n'
+
+def _stream_ndjson(entries):
+    for entry in entries:
+        yield json.dumps(entry) + '\n'
+
 @history_bp.route('/export', methods=['GET'])
 @require_token
 def export_history():
-    """Export processing history to CSV or JSON"""
+    """
+    Export processing history to CSV, JSON or NDJSON
+
+    The export is streamed entry by entry, so memory stays flat whatever the
+    size of the history.
+
+    Query parameters:
+    - format: csv (default), json or ndjson
+    - since / until, file_type, invoice_number, ...: Same filters as /history,
+      e.g. since=<last processed_at seen> for incremental exports
+    - fields: Projection for json/ndjson exports (default: everything except "result")
+    """
     try:
-        history = load_history()
-        if not history:
-            return jsonify({"error": "No history to export"}), 404
-            
-        # Check if format parameter is provided
-        format = request.args.get('format', 'csv')
-        
-        if format.lower() == 'json':
-            # Return JSON response
-            return jsonify(history)
+        format = request.args.get('format', 'csv').lower()
+        if format not in ('csv', 'json', 'ndjson'):
+            return jsonify({"error": "format must be one of csv, json, ndjson"}), 400
+        filters = parse_history_filters(request.args)
+        if format == 'csv' or not request.args.get('fields'):
+            projection = EXPORT_PROJECTION
         else:
-            # Generate CSV content in memory
-            output = StringIO()
-            writer = csv.DictWriter(output, fieldnames=export_to_csv(history, write_to_file=False))
-            writer.writeheader()
-            
-            # Write data to CSV
-            for item in history:
-                base_row = {
-                    'filename': item.get('filename'),
-                    'processed_at': item.get('processed_at'),
-                    'file_type': item.get('file_type'),
-                    'page_count': item.get('page_count'),
-                    'text_length': item.get('text_length'),
-                    **item.get('extracted_fields', {})
-                }
-                
-                for page in item.get('pages', []):
-                    row = base_row.copy()
-                    row.update({
-                        'page': page.get('page'),
-                        'text': page.get('text', '')[:1000],
-                        **page.get('fields', {})
-                    })
-                    writer.writerow(row)
-            
-            # Get the CSV content
-            csv_content = output.getvalue()
-            
-            # Create response with CSV content
-            response = make_response(csv_content)
-            response.headers['Content-Type'] = 'text/csv'
-            response.headers['Content-Disposition'] = 'attachment; filename=extracted_data.csv'
-            return response
+            projection = parse_projection(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        entries = iter_history(filters, projection)
+        first = next(entries, None)
+        if first is None:
+            return jsonify({"error": "No history to export"}), 404
+        entries = chain([first], entries)
+
+        if format == 'json':
+            return Response(stream_with_context(_stream_json_array(entries)),
+                            mimetype='application/json')
+        if format == 'ndjson':
+            return Response(stream_with_context(_stream_ndjson(entries)),
+                            mimetype='application/x-ndjson')
+
+        # Header comes from a cheap pass over field names only
+        field_names = sorted(set(BASE_COLUMNS) | history_field_names(filters))
+        response = Response(stream_with_context(stream_csv(entries, field_names)), mimetype='text/csv')
+        response.headers['Content-Disposition'] = 'attachment; filename=extracted_data.csv'
+        return response
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -0,0 +1,33 @@
+import time
+
+from flask import Blueprint, Response, g, request
+
+from utils.metrics import get_metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@metrics_bp.after_app_request
+def record_request(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics = get_metrics()
+        metrics.get('http_requests_total').inc(method=request.method, endpoint=endpoint,
+                                               status=response.status_code)
+        metrics.get('http_request_duration_seconds').observe(time.perf_counter() - started,
+                                                             method=request.method, endpoint=endpoint)
+    return response
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Request, extraction, cache and history metrics in the Prometheus text format
+
+    Values are kept in the memory of the serving process; each worker
+    process reports its own.
+    """
+    return Response(get_metrics().render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,114 @@
+from flask import Blueprint, request, jsonify
+from utils.auth import require_token
+from utils.field_guesser import DEFAULT_PATTERNS, get_field_guesser
+from utils.pattern_registry import get_pattern_registry
+
+patterns_bp = Blueprint('patterns', __name__, url_prefix='/patterns')
+
+def _describe(field_name, guesser):
+    return {
+        'field': field_name,
+        'patterns': guesser.patterns[field_name],
+        'custom': field_name in get_pattern_registry().patterns,
+        'default': DEFAULT_PATTERNS.get(field_name, [])
+    }
+
+def _registry_state(guesser):
+    return {'pattern_version': guesser.version, 'revision': guesser.revision}
+
+def _after_change(field_name):
+    guesser = get_field_guesser()
+    body = _registry_state(guesser)
+    if field_name in guesser.patterns:
+        body.update(_describe(field_name, guesser))
+    return body
+
+@patterns_bp.route('/', methods=['GET'])
+@require_token
+def list_patterns():
+    """
+    List the active patterns of every field
+
+    Response:
+    {
+        "pattern_version": "3f2a...",  # stamped on extraction results as pattern_version
+        "revision": 4,                 # bumped on every change to the registry
+        "fields": {"date": {"patterns": [...], "custom": false, "default": [...]}, ...}
+    }
+    """
+    guesser = get_field_guesser()
+    fields = {}
+    for field_name in guesser.patterns:
+        description = _describe(field_name, guesser)
+        del description['field']
+        fields[field_name] = description
+    return jsonify({**_registry_state(guesser), 'fields': fields}), 200
+
+@patterns_bp.route('/<field_name>', methods=['GET'])
+@require_token
+def get_patterns(field_name):
+    """Get the active patterns of one field"""
+    guesser = get_field_guesser()
+    if field_name not in guesser.patterns:
+        return jsonify({"error": "Field not found"}), 404
+    return jsonify({**_registry_state(guesser), **_describe(field_name, guesser)}), 200
+
+@patterns_bp.route('/<field_name>', methods=['POST'])
+@require_token
+def add_pattern(field_name):
+    """
+    Add a pattern to a field, creating the field if needed
+
+    Request:
+    {"pattern": "total\\s*due\\s*:?\\s*\\$?\\s*([\\d,]+\\.\\d{2})"}
+
+    The pattern is compiled before it is stored; invalid ones are rejected
+    with a 400. Other workers pick the change up within PATTERNS_CHECK_INTERVAL.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        get_pattern_registry().add_pattern(field_name, data.get('pattern'),
+                                           defaults=DEFAULT_PATTERNS.get(field_name))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    return jsonify(_after_change(field_name)), 201
+
+@patterns_bp.route('/<field_name>', methods=['PUT'])
+@require_token
+def replace_patterns(field_name):
+    """
+    Replace all patterns of a field
+
+    Request:
+    {"patterns": ["pattern 1", "pattern 2"]}
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        get_pattern_registry().set_field(field_name, data.get('patterns'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    return jsonify(_after_change(field_name)), 200
+
+@patterns_bp.route('/<field_name>', methods=['DELETE'])
+@require_token
+def delete_patterns(field_name):
+    """
+    Remove one pattern of a field, or its customization
+
+    Query parameters:
+    - pattern: Only remove this pattern. Without it the field's custom
+      patterns are dropped: built-in fields go back to their defaults,
+      custom fields disappear.
+    """
+    try:
+        removed = get_pattern_registry().remove(field_name, request.args.get('pattern'),
+                                                defaults=DEFAULT_PATTERNS.get(field_name))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    if not removed:
+        return jsonify({"error": "Pattern not found"}), 404
+    return jsonify(_after_change(field_name)), 200
@@ -0,0 +1,153 @@
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import BytesIO
+from typing import Iterator, List, Tuple, Union
+
+from services.extract_service import SUPPORTED_EXTENSIONS, extract_document
+from services.history_service import save_history_many
+from services.upload_service import Upload, open_upload
+
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', 4))
+BATCH_MAX_FILES = int(os.getenv('BATCH_MAX_FILES', 100))
+BATCH_MAX_BYTES = int(os.getenv('BATCH_MAX_BYTES', 200 * 1024 * 1024))
+
+class BatchError(ValueError):
+    """Raised when a batch upload is malformed or over its limits"""
+
+def get_batch_pool():
+    """Singleton pattern to get the thread pool shared by all batch requests"""
+    if not hasattr(get_batch_pool, "instance"):
+        get_batch_pool.instance = ThreadPoolExecutor(max_workers=BATCH_WORKERS,
+                                                     thread_name_prefix='extract-batch')
+    return get_batch_pool.instance
+
+def expand_zip(file_content, max_files: int = BATCH_MAX_FILES,
+               max_bytes: int = BATCH_MAX_BYTES) -> List[Tuple[str, bytes]]:
+    """
+    Read the supported documents out of a zip archive (bytes or an Upload)
+
+    Args:
+        file_content: The archive
+        max_files / max_bytes: What is left of the batch limits for this archive
+
+    Raises:
+        BatchError: If the archive is invalid or would exceed the batch limits
+    """
+    if isinstance(file_content, Upload):
+        file_content = file_content.path or file_content.content
+    try:
+        archive = zipfile.ZipFile(file_content if isinstance(file_content, str) else BytesIO(file_content))
+    except zipfile.BadZipFile:
+        raise BatchError("Invalid zip archive")
+
+    members = [
+        info for info in archive.infolist()
+        if not info.is_dir()
+        and not os.path.basename(info.filename).startswith('.')
+        and not info.filename.startswith('__MACOSX/')
+        and info.filename.lower().split('.')[-1] in SUPPORTED_EXTENSIONS
+    ]
+    # Check the member count and declared sizes before decompressing anything
+    if len(members) > max_files:
+        raise BatchError(f"At most {BATCH_MAX_FILES} files per batch")
+    if sum(info.file_size for info in members) > max_bytes:
+        raise BatchError(f"Archive would take the batch over {BATCH_MAX_BYTES} bytes")
+    return [(os.path.basename(info.filename), archive.read(info)) for info in members]
+
+def collect_batch(files) -> List[Tuple[str, Union[bytes, Upload]]]:
+    """
+    Turn uploaded files (documents and/or zip archives) into (filename, content) pairs
+
+    Uploaded documents are passed on as Uploads, so large ones stay in their
+    spool files; documents from archives are read out as bytes.
+
+    Raises:
+        BatchError: If nothing usable was uploaded or limits are exceeded
+    """
+    documents = []
+    try:
+        for file in files:
+            if not file.filename:
+                continue
+            upload = open_upload(file)
+            if file.filename.lower().endswith('.zip'):
+                with upload:
+                    documents.extend(expand_zip(
+                        upload, BATCH_MAX_FILES - len(documents),
+                        BATCH_MAX_BYTES - sum(len(content) for _, content in documents)
+                    ))
+            else:
+                documents.append((file.filename, upload))
+
+        if not documents:
+            raise BatchError("No files uploaded")
+        if len(documents) > BATCH_MAX_FILES:
+            raise BatchError(f"At most {BATCH_MAX_FILES} files per batch")
+        if sum(len(content) for _, content in documents) > BATCH_MAX_BYTES:
+            raise BatchError(f"Batch is larger than {BATCH_MAX_BYTES} bytes")
+    except Exception:
+        # The batch is refused; release the uploads opened so far
+        for _, content in documents:
+            if isinstance(content, Upload):
+                content.close()
+        raise
+    return documents
+
+def _process(filename: str, content, policy=None):
+    if filename.lower().split('.')[-1] not in SUPPORTED_EXTENSIONS:
+        raise ValueError("Unsupported file type")
+    return extract_document(content, filename, policy=policy)
+
+def _close_upload(content):
+    """Close an Upload without letting a failure stop the caller"""
+    if isinstance(content, Upload):
+        try:
+            content.close()
+        except Exception as e:
+            print(f"Warning: Failed to close batch upload: {str(e)}")
+
+def iter_batch_results(documents: List[Tuple[str, Union[bytes, Upload]]], policy=None) -> Iterator[dict]:
+    """
+    Extract documents concurrently, yielding one record per file as it completes
+
+    Successful results are written to history in a single bulk write once
+    every file is done, followed by a final summary record. Every file is
+    extracted with policy, an optional ExtractionPolicy.
+    """
+    pool = get_batch_pool()
+    futures = {}
+    for index, (filename, content) in enumerate(documents):
+        future = pool.submit(_process, filename, content, policy)
+        # Each upload is closed once its own extraction is over (or cancelled),
+        # never while a worker may still be reading it
+        future.add_done_callback(lambda _, content=content: _close_upload(content))
+        futures[future] = (index, filename)
+    completed = []
+    summary = {'files': len(documents), 'completed': 0, 'failed': 0, 'history_saved': 0}
+    try:
+        for future in as_completed(futures):
+            index, filename = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                summary['failed'] += 1
+                yield {'index': index, 'file': filename, 'status': 'failed', 'error': str(e)}
+                continue
+            completed.append((index, filename, result))
+            summary['completed'] += 1
+            yield {'index': index, 'file': filename, 'status': 'completed', 'result': result}
+    finally:
+        # Runs even if the client disconnects mid-stream, so finished work is
+        # kept; files not started yet are dropped (running ones finish and
+        # close their uploads). History keeps upload order regardless of
+        # completion order.
+        for future in futures:
+            future.cancel()
+        completed.sort(key=lambda item: item[0])
+        try:
+            save_history_many((filename, result) for _, filename, result in completed)
+            summary['history_saved'] = len(completed)
+        except Exception as e:
+            summary['history_error'] = str(e)
+    yield {'summary': summary}
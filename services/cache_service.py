@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+CACHE_DIR = os.path.join('storage', 'cache')
+
+class ExtractionCache:
+    """
+    Two-tier cache of extraction results keyed by upload content
+
+    Keys combine a SHA-256 of the uploaded bytes with the pattern-set version,
+    so a changed pattern set never serves stale fields. Recently used entries
+    live in an in-process LRU; every entry is also written to disk so other
+    workers and restarts can reuse it. The disk tier is trimmed, least
+    recently used first, once it grows past max_bytes.
+
+    The memory tier holds entries as JSON text, so every get returns a copy
+    callers can change without altering what later hits see.
+    """
+
+    def __init__(self, directory: str = CACHE_DIR, memory_items: int = 128,
+                 max_bytes: int = 256 * 1024 * 1024):
+        self.directory = directory
+        self.memory_items = memory_items
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+        os.makedirs(directory, exist_ok=True)
+        self._disk_bytes = sum(size for _, size, _ in self._scan())
+
+    @staticmethod
+    def content_hash(content: bytes) -> str:
+        return hashlib.sha256(content).hexdigest()
+
+    @staticmethod
+    def make_key(content_hash: str, pattern_version: str) -> str:
+        return f"{content_hash}-{pattern_version}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _scan(self):
+        """Yield (path, size, last access) for every entry on disk"""
+        for item in os.scandir(self.directory):
+            if item.name.endswith('.json'):
+                try:
+                    stat = item.stat()
+                except FileNotFoundError:
+                    continue
+                yield item.path, stat.st_size, stat.st_mtime
+
+    def _remember(self, key: str, data: str):
+        self._memory[key] = data
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Return the cached value for key, or None on a miss"""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self._stats['memory_hits'] += 1
+        if data is not None:
+            return json.loads(data)
+
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                data = f.read()
+            value = json.loads(data)
+            # Touch the file so disk eviction sees it as recently used
+            os.utime(path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            with self._lock:
+                self._stats['misses'] += 1
+            return None
+
+        with self._lock:
+            self._stats['disk_hits'] += 1
+            self._remember(key, data)
+        return value
+
+    def put(self, key: str, value: Dict):
+        """Store value in both tiers"""
+        data = json.dumps(value)
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+        with self._lock:
+            self._remember(key, data)
+            self._disk_bytes += len(data)
+            if self._disk_bytes > self.max_bytes:
+                self._evict()
+
+    def put_pages(self, key: str, pages: Iterable[Dict]):
+        """
+        Store {'pages': [...]} on disk from a lazy page iterable
+
+        The JSON is written page by page and the entry skips the memory tier,
+        so caching a huge document never holds all of its pages at once.
+        """
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w') as f:
+            f.write('{"pages": [')
+            for index, page in enumerate(pages):
+                if index:
+                    f.write(', ')
+                f.write(json.dumps(page))
+            f.write(']}')
+            size = f.tell()
+        os.replace(temp_path, path)
+
+        with self._lock:
+            self._disk_bytes += size
+            if self._disk_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Drop the least recently used disk entries until under max_bytes"""
+        entries = sorted(self._scan(), key=lambda item: item[2])
+        total = sum(size for _, size, _ in entries)
+        # Trim to 90% so a full cache doesn't evict on every put
+        target = self.max_bytes * 0.9
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self._stats['evictions'] += 1
+            self._memory.pop(os.path.basename(path)[:-len('.json')], None)
+        self._disk_bytes = total
+
+    def purge(self, content_hash: Optional[str] = None) -> int:
+        """
+        Remove cached entries
+
+        Args:
+            content_hash: Only remove entries for this upload; all entries if omitted
+
+        Returns:
+            Number of disk entries removed
+        """
+        removed = 0
+        with self._lock:
+            for key in list(self._memory):
+                if content_hash is None or key.startswith(f"{content_hash}-"):
+                    del self._memory[key]
+            for path, _, _ in list(self._scan()):
+                if content_hash is None or os.path.basename(path).startswith(f"{content_hash}-"):
+                    try:
+                        os.remove(path)
+                        removed += 1
+                    except FileNotFoundError:
+                        pass
+            self._disk_bytes = sum(size for _, size, _ in self._scan())
+        return removed
+
+    def stats(self) -> Dict:
+        with self._lock:
+            hits = self._stats['memory_hits'] + self._stats['disk_hits']
+            lookups = hits + self._stats['misses']
+            return {
+                **self._stats,
+                'hits': hits,
+                'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'memory_capacity': self.memory_items,
+                'disk_entries': sum(1 for _ in self._scan()),
+                'disk_bytes': self._disk_bytes,
+                'disk_capacity_bytes': self.max_bytes,
+            }
+
+def get_extraction_cache():
+    """
+    Singleton pattern to get the extraction cache
+
+    Returns None when EXTRACT_CACHE_ENABLED is set to false.
+    """
+    if not hasattr(get_extraction_cache, "instance"):
+        if os.getenv('EXTRACT_CACHE_ENABLED', 'true').lower() in ('0', 'false', 'no'):
+            get_extraction_cache.instance = None
+        else:
+            get_extraction_cache.instance = ExtractionCache(
+                directory=os.getenv('EXTRACT_CACHE_DIR', CACHE_DIR),
+                memory_items=int(os.getenv('EXTRACT_CACHE_MEMORY_ITEMS', 128)),
+                max_bytes=int(os.getenv('EXTRACT_CACHE_MAX_BYTES', 256 * 1024 * 1024)),
+            )
+    return get_extraction_cache.instance
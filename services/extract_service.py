@@ -1,169 +1,542 @@
+import json
+import multiprocessing
 import os
-import fitz  # PyMuPDF
-from PIL import Image
-import pytesseract
+import queue
+import subprocess
+import sys
+import tempfile
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
-import re
+from io import BytesIO
 from flask import current_app
 
-# Set Tesseract path for Windows
-tesseract_path = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
-pytesseract.pytesseract.tesseract_cmd = tesseract_path
+# Default Tesseract install path on Windows; override with TESSERACT_CMD
+WINDOWS_TESSERACT_PATH = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+tesseract_path = os.getenv('TESSERACT_CMD') or (
+    WINDOWS_TESSERACT_PATH if os.path.exists(WINDOWS_TESSERACT_PATH) else 'tesseract'
+)
 
 from utils.field_guesser import get_field_guesser
+from utils.field_resolver import RESOLVER_VERSION, resolve_fields
+from utils.layout_fields import LAYOUT_VERSION, get_layout_extractor
+from services.cache_service import get_extraction_cache
+from services.history_service import merge_fields, save_history_streamed
+from services.upload_service import as_buffer, open_upload, save_upload_copy
+from utils import tesseract_worker
+from utils.metrics import get_metrics
 
-def extract_fields(text):
-    """Extract fields using AI-based heuristics"""
-    # Get the field guesser instance
-    field_guesser = get_field_guesser()
-    
-    # Get all possible field matches
-    matches = field_guesser.guess_fields(text)
-    
-    # Process matches to get the most likely values
-    fields = {}
-    
-    # Process each field type
-    for field_name, values in matches.items():
-        if not values:
-            continue
-            
-        # Choose the most likely value
-        # For numbers/amounts, choose the largest value
-        if field_name in ['amount', 'total', 'invoice_number']:
-            try:
-                # Try to convert to float and get the largest
-                numeric_values = [float(re.sub(r'[^0-9.]', '', v)) for v in values if v]
-                if numeric_values:
-                    fields[field_name] = str(max(numeric_values))
-            except:
-                # If conversion fails, use the first value
-                fields[field_name] = values[0]
-                
-        # For dates, choose the most recent date
-        elif field_name == 'date':
+IMAGE_EXTENSIONS = ['png', 'jpg', 'jpeg', 'tiff']
+SUPPORTED_EXTENSIONS = ['pdf'] + IMAGE_EXTENSIONS
+
+# Page-parallel PDF extraction: worker processes, and the page count from
+# which spreading pages over them beats the cost of starting the pool
+PDF_WORKERS = int(os.getenv('PDF_WORKERS', os.cpu_count() or 1))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv('PDF_PARALLEL_MIN_PAGES', 40))
+
+# Pages of a streamed extraction are spooled in memory up to this size, then to disk
+STREAM_SPOOL_BYTES = int(os.getenv('STREAM_SPOOL_BYTES', 4 * 1024 * 1024))
+
+# OCR of PDF pages without a text layer: on/off, rasterization resolution
+# and how many pages are OCR'd at once
+PDF_OCR_ENABLED = os.getenv('PDF_OCR_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+OCR_DPI = int(os.getenv('OCR_DPI', 300))
+OCR_WORKERS = int(os.getenv('OCR_WORKERS', os.cpu_count() or 1))
+
+def get_ocr_pool():
+    """Singleton pattern to get the thread pool OCR'ing scanned pages"""
+    if not hasattr(get_ocr_pool, "instance"):
+        get_ocr_pool.instance = ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix='ocr')
+    return get_ocr_pool.instance
+
+def get_pdf_pool():
+    """
+    Singleton pattern to get the process pool for page-parallel PDF extraction
+
+    Workers are started once, on first use, and kept. They are started from
+    a forkserver (or spawned where there is none) rather than forked from
+    the serving process, whose handler, OCR, job and prewarm threads may
+    hold locks at the time of a fork.
+    """
+    if not hasattr(get_pdf_pool, "instance"):
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        get_pdf_pool.instance = ProcessPoolExecutor(max_workers=PDF_WORKERS,
+                                                    mp_context=multiprocessing.get_context(method))
+    return get_pdf_pool.instance
+
+class OCRBackend:
+    """Turns a PIL image into text"""
+
+    name = 'base'
+
+    def __init__(self, lang='eng'):
+        self.lang = lang
+
+    def image_to_string(self, img):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class PytesseractBackend(OCRBackend):
+    """
+    pytesseract: one tesseract process and a temp file round-trip per image
+
+    Always available, so it is the fallback for the other backends.
+    """
+
+    name = 'pytesseract'
+
+    def __init__(self, lang='eng'):
+        super().__init__(lang)
+        # Imported on first use, so processes that never OCR don't load it
+        import pytesseract
+        pytesseract.pytesseract.tesseract_cmd = tesseract_path
+        self._pytesseract = pytesseract
+
+    def image_to_string(self, img):
+        return self._pytesseract.image_to_string(img, lang=self.lang)
+
+class TesseractCLIBackend(OCRBackend):
+    """
+    Pipes the image to `tesseract stdin stdout`
+
+    Still one process per image, but the image goes over a pipe as
+    uncompressed PNM instead of being written to and read back from a temp file.
+    """
+
+    name = 'cli'
+
+    def __init__(self, lang='eng', cmd=None):
+        super().__init__(lang)
+        self.cmd = cmd or tesseract_path
+
+    def image_to_string(self, img):
+        if img.mode not in ('L', 'RGB'):
+            img = img.convert('RGB')
+        buffer = BytesIO()
+        img.save(buffer, format='PPM')
+        completed = subprocess.run(
+            [self.cmd, 'stdin', 'stdout', '-l', self.lang],
+            input=buffer.getvalue(), stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False
+        )
+        if completed.returncode != 0:
+            raise RuntimeError(completed.stderr.decode(errors='replace').strip() or 'tesseract failed')
+        return completed.stdout.decode('utf-8', errors='replace')
+
+class TesserocrBackend(OCRBackend):
+    """
+    Warm in-process Tesseract engines via the tesserocr bindings
+
+    Engines are created on demand up to pool_size and reused, so the model
+    is loaded once per engine and images are handed over in memory. tesserocr
+    releases the GIL while recognising, so pool threads run in parallel.
+    """
+
+    name = 'tesserocr'
+
+    def __init__(self, lang='eng', pool_size=1):
+        super().__init__(lang)
+        import tesserocr
+        self._tesserocr = tesserocr
+        self.pool_size = pool_size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.pool_size:
+                self._created += 1
+                return self._tesserocr.PyTessBaseAPI(lang=self.lang)
+        return self._idle.get()
+
+    def image_to_string(self, img):
+        api = self._acquire()
+        try:
+            api.SetImage(img)
+            return api.GetUTF8Text()
+        finally:
+            self._idle.put(api)
+
+    def close(self):
+        while True:
             try:
-                # Try to parse dates and get the most recent
-                from dateutil import parser
-                dates = []
-                for v in values:
-                    try:
-                        date = parser.parse(v)
-                        dates.append((date, v))
-                    except:
-                        continue
-                if dates:
-                    fields[field_name] = max(dates)[1]
-            except:
-                # If parsing fails, use the first value
-                fields[field_name] = values[0]
-                
-        # For other fields, use the first value
-        else:
-            fields[field_name] = values[0]
-            
-    return fields
+                self._idle.get_nowait().End()
+            except queue.Empty:
+                break
 
-def process_file(file):
+class TesseractWorkerBackend(OCRBackend):
     """
-    Processes an uploaded file (PDF or image):
-    - Saves it to disk
-    - Extracts text using appropriate method (PyMuPDF for PDF, Tesseract for images)
-    - Extracts common fields using regex patterns
-    - Returns structured output
+    Long-lived worker processes, each with a warm Tesseract engine
+
+    Every worker (utils/tesseract_worker.py) loads libtesseract through
+    ctypes once; images are then sent to it as raw pixels over its stdin
+    pipe and the text read back from its stdout, so no process is started
+    and no model loaded per image, and no bindings need to be installed.
+    Workers are started on demand up to pool_size; one that dies is
+    replaced on a later image.
     """
-    # Make sure upload folder exists
-    upload_folder = current_app.config['UPLOAD_FOLDER']
-    os.makedirs(upload_folder, exist_ok=True)
-
-    # Save uploaded file to UPLOAD_FOLDER
-    # Use absolute path to ensure proper file access
-    upload_folder = os.path.abspath(upload_folder)
-    os.makedirs(upload_folder, exist_ok=True)
-    
-    # Use secure filename to prevent path traversal attacks
-    from werkzeug.utils import secure_filename
-    safe_filename = secure_filename(file.filename)
-    
-    # Save file with a temporary name first
-    temp_file_path = os.path.join(upload_folder, f"temp_{safe_filename}")
-    file.save(temp_file_path)
-    
-    # Move the file to its final location
-    file_path = os.path.join(upload_folder, safe_filename)
-    try:
-        os.replace(temp_file_path, file_path)
-    except Exception as e:
-        # If replace fails, try renaming
+
+    name = 'workers'
+
+    def __init__(self, lang='eng', pool_size=1, library=None):
+        super().__init__(lang)
+        self.pool_size = max(1, pool_size)
+        self.library = library or os.getenv('TESSERACT_LIBRARY', '')
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        # Fails here, not on the first image, when libtesseract can't be used
+        self._idle.put(self._start())
+        self._created = 1
+
+    def _start(self):
+        process = subprocess.Popen(
+            [sys.executable, os.path.abspath(tesseract_worker.__file__), self.lang, self.library],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            # The Tesseract API refuses to run under a non-C numeric locale
+            env=dict(os.environ, LC_ALL='C')
+        )
         try:
-            os.rename(temp_file_path, file_path)
-        except Exception as e:
-            raise Exception(f"Failed to move file: {str(e)}")
+            status, message = self._receive(process)
+        except Exception:
+            process.kill()
+            process.wait()
+            raise
+        if status != 0:
+            process.wait()
+            raise RuntimeError(f"Tesseract worker failed to start: {message}")
+        return process
 
-    try:
-        # Determine file type
-        file_extension = file.filename.lower().split('.')[-1]
-        
-        # Process PDF
-        if file_extension == 'pdf':
-            # Try to open the file with different methods
+    @staticmethod
+    def _receive(process):
+        header = tesseract_worker.read_exactly(process.stdout, tesseract_worker.RESPONSE.size)
+        if header is None:
+            raise RuntimeError("Tesseract worker exited")
+        status, length = tesseract_worker.RESPONSE.unpack(header)
+        payload = tesseract_worker.read_exactly(process.stdout, length) if length else b''
+        if payload is None:
+            raise RuntimeError("Tesseract worker exited")
+        return status, payload.decode('utf-8', errors='replace')
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.pool_size:
+                self._created += 1
+                start = True
+            else:
+                start = False
+        if not start:
+            return self._idle.get()
+        try:
+            return self._start()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def image_to_string(self, img):
+        if img.mode not in ('L', 'RGB'):
+            img = img.convert('RGB')
+        pixels = img.tobytes()
+        dpi = img.info.get('dpi')
+        header = tesseract_worker.REQUEST.pack(img.width, img.height, 1 if img.mode == 'L' else 3,
+                                               int(dpi[0]) if dpi else 0, len(pixels))
+        for attempt in range(2):
+            process = self._acquire()
             try:
-                # First try direct file path
-                doc = fitz.open(file_path)
+                process.stdin.write(header)
+                process.stdin.write(pixels)
+                process.stdin.flush()
+                status, text = self._receive(process)
+                break
             except Exception as e:
-                # If that fails, try reading file content directly
-                try:
-                    with open(file_path, 'rb') as f:
-                        pdf_content = f.read()
-                    doc = fitz.open(stream=pdf_content, filetype="pdf")
-                except Exception as e:
-                    raise Exception(f"Failed to read PDF file: {str(e)}")
-            
-            pages = []
-            
-            for page_num, page in enumerate(doc):
-                text = page.get_text()
-                fields = extract_fields(text)
-                pages.append({
-                    'page': page_num + 1,
-                    'text': text,
-                    'fields': fields
-                })
-            
-            doc.close()
-            
-        # Process image
-        elif file_extension in ['png', 'jpg', 'jpeg', 'tiff']:
+                # The worker is gone or out of step; replace it, and retry
+                # once in case it had died while idle
+                process.kill()
+                process.wait()
+                with self._lock:
+                    self._created -= 1
+                if attempt:
+                    raise RuntimeError(f"Tesseract worker failed: {str(e)}")
+        self._idle.put(process)
+        if status != 0:
+            raise RuntimeError(text)
+        return text
+
+    def close(self):
+        while True:
             try:
-                # First try direct file path
-                img = Image.open(file_path)
-            except Exception as e:
-                # If that fails, try reading file content directly
-                try:
-                    with open(file_path, 'rb') as f:
-                        img = Image.open(f)
-                except Exception as e:
-                    raise Exception(f"Failed to read image file: {str(e)}")
-            
-            text = pytesseract.image_to_string(img)
-            fields = extract_fields(text)
-            pages = [{
-                'page': 1,
-                'text': text,
-                'fields': fields
-            }]
-        
+                process = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            process.stdin.close()
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+OCR_BACKENDS = {
+    'pytesseract': PytesseractBackend,
+    'cli': TesseractCLIBackend,
+    'tesserocr': TesserocrBackend,
+    'workers': TesseractWorkerBackend,
+}
+
+def create_ocr_backend(name='auto', lang='eng', pool_size=1):
+    """
+    Build an OCR backend by name
+
+    'auto' prefers warm tesserocr engines, then warm worker processes
+    using libtesseract directly, and falls back to pytesseract when
+    neither the bindings nor the library are available.
+    """
+    if name == 'auto':
+        try:
+            return TesserocrBackend(lang=lang, pool_size=pool_size)
+        except ImportError:
+            pass
+        try:
+            return TesseractWorkerBackend(lang=lang, pool_size=pool_size)
+        except (OSError, RuntimeError):
+            return PytesseractBackend(lang=lang)
+    if name not in OCR_BACKENDS:
+        raise ValueError(f"Unknown OCR backend: {name}")
+    if name in ('tesserocr', 'workers'):
+        return OCR_BACKENDS[name](lang=lang, pool_size=pool_size)
+    return OCR_BACKENDS[name](lang=lang)
+
+def get_ocr_backend():
+    """
+    Singleton pattern to get the configured OCR backend
+
+    OCR_BACKEND selects it (auto, tesserocr, workers, cli or pytesseract),
+    OCR_LANG the Tesseract language(s) and OCR_POOL_SIZE the number of warm
+    engines or worker processes.
+    """
+    if not hasattr(get_ocr_backend, "instance"):
+        get_ocr_backend.instance = create_ocr_backend(
+            os.getenv('OCR_BACKEND', 'auto').lower(),
+            lang=os.getenv('OCR_LANG', 'eng'),
+            pool_size=int(os.getenv('OCR_POOL_SIZE', OCR_WORKERS)),
+        )
+    return get_ocr_backend.instance
+
+def ocr_image(img):
+    """Run OCR on a PIL image"""
+    return get_ocr_backend().image_to_string(img)
+
+def extract_fields(text, confidence=None):
+    """
+    Extract fields using AI-based heuristics
+
+    Candidates come from the field guesser's patterns; amounts, invoice
+    numbers and dates are then chosen by the resolver from the keywords and
+    symbols around each match. Pass a dictionary as confidence to learn
+    which values a keyword voted for.
+    """
+    matches = get_field_guesser().guess_field_matches(text)
+    return resolve_fields(matches, text, confidence)
+
+def extraction_version(pattern_version=None):
+    """Version of the field extraction rules; cached results are keyed by it"""
+    layout_version = LAYOUT_VERSION if get_layout_extractor() is not None else '0'
+    return f"{pattern_version or get_field_guesser().version}.{RESOLVER_VERSION}.{layout_version}"
+
+def extract_pages(file_content, file_extension, progress=None, policy=None):
+    """
+    Extract text and fields from in-memory file content
+
+    Args:
+        file_content: File bytes or an Upload
+        file_extension: Lower-case extension selecting the extraction method
+        progress: Optional callback(pages_done, total_pages)
+        policy: Optional ExtractionPolicy (pages searched for fields, OCR budget)
+
+    Returns:
+        List of {'page', 'text', 'fields', 'source', 'elapsed_ms'} dictionaries
+    """
+    from services.pipeline import get_pipeline
+    return list(get_pipeline().run(file_content, file_extension, progress, policy))
+
+def _policy_version(version, policy):
+    return version + (policy.cache_tag() if policy is not None else '')
+
+def _over_budget(page):
+    # Which scans the OCR budget left out depends on timing; such results aren't cached
+    return 'ocr_budget' in page.get('skipped', ())
+
+def _count_document(file_extension, status):
+    metrics = get_metrics()
+    metrics.get('extract_documents_total').inc(file_type=file_extension, cache=status)
+    if status != 'disabled':
+        metrics.get('extract_cache_lookups_total').inc(result=status)
+
+def extract_document(file_content, filename, progress=None, timer=None, policy=None):
+    """
+    Extract a document, reusing the cached result for identical uploads
+
+    The cache key covers the uploaded bytes, the active pattern set and the
+    extraction policy, so a hit returns exactly what a fresh extraction
+    would. The result is stamped with the pattern_version it was extracted
+    with, and with the policy's settings when one was given.
+
+    Args:
+        file_content: File bytes or an Upload
+        filename: Original filename, used to pick the extraction method
+        progress: Optional callback(pages_done, total_pages)
+        timer: Optional StageTimer collecting cache and per-stage extraction times
+        policy: Optional ExtractionPolicy (pages searched for fields, OCR budget)
+
+    Returns:
+        Result dictionary; result['cache'] is 'hit', 'miss' or 'disabled'
+    """
+    file_extension = filename.lower().split('.')[-1]
+    cache = get_extraction_cache()
+    pattern_version = get_field_guesser().version
+    content_hash = None
+    cached = None
+
+    if cache is not None:
+        with timer.stage('cache') if timer else nullcontext():
+            content_hash = cache.content_hash(as_buffer(file_content))
+            key = cache.make_key(content_hash, _policy_version(extraction_version(pattern_version), policy))
+            cached = cache.get(key)
+
+    if cached is not None:
+        pages = cached['pages']
+        status = 'hit'
+        if progress:
+            progress(len(pages), len(pages))
+    else:
+        pages = extract_pages(file_content, file_extension, progress, policy)
+        if timer:
+            timer.add_page_timings(pages)
+        status = 'disabled'
+        if cache is not None:
+            # Patterns reloaded mid-document leave pages from both sets; don't cache those
+            if get_field_guesser().version == pattern_version and not any(map(_over_budget, pages)):
+                with timer.stage('cache') if timer else nullcontext():
+                    cache.put(key, {'pages': pages})
+            status = 'miss'
+    _count_document(file_extension, status)
+
+    result = {
+        'file': filename,
+        'pages': pages,
+        'processed_at': datetime.now().isoformat(),
+        'content_hash': content_hash,
+        'pattern_version': pattern_version,
+        'cache': status
+    }
+    if policy is not None:
+        result['policy'] = policy.as_dict()
+    return result
+
+def _read_spool(spool):
+    spool.seek(0)
+    for line in spool:
+        yield json.loads(line)
+
+def stream_document(file_content, filename, save_to_history=True, policy=None):
+    """
+    Extract a document page by page, for streaming responses
+
+    Yields every page as soon as it is extracted, then a final
+    {'summary': {...}} record. Pages are not accumulated: they are spooled
+    (in memory up to STREAM_SPOOL_BYTES, then to a temp file) and read back
+    once at the end to fill the cache and the history, so memory stays
+    around one page whatever the document size. An ExtractionPolicy limits
+    field extraction and OCR as in extract_document.
+
+    Raises:
+        ValueError: If the file type is not supported
+    """
+    file_extension = filename.lower().split('.')[-1]
+    if file_extension not in SUPPORTED_EXTENSIONS:
+        raise ValueError("Unsupported file type")
+
+    cache = get_extraction_cache()
+    summary = {
+        'file': filename,
+        'processed_at': datetime.now().isoformat(),
+        'content_hash': None,
+        'pattern_version': get_field_guesser().version,
+        'cache': 'disabled',
+        'page_count': 0,
+        'text_length': 0
+    }
+    if policy is not None:
+        summary['policy'] = policy.as_dict()
+    key = None
+    pages = None
+    if cache is not None:
+        summary['content_hash'] = cache.content_hash(as_buffer(file_content))
+        key = cache.make_key(summary['content_hash'],
+                             _policy_version(extraction_version(summary['pattern_version']), policy))
+        cached = cache.get(key)
+        if cached is not None:
+            pages = cached['pages']
+            summary['cache'] = 'hit'
         else:
-            raise ValueError("Unsupported file type")
+            summary['cache'] = 'miss'
+    if pages is None:
+        from services.pipeline import get_pipeline
+        pages = get_pipeline().run(file_content, file_extension, policy=policy)
+
+    fields = {}
+    over_budget = False
+    with tempfile.SpooledTemporaryFile(max_size=STREAM_SPOOL_BYTES, mode='w+') as spool:
+        for page in pages:
+            summary['page_count'] += 1
+            summary['text_length'] += len(page.get('text', ''))
+            merge_fields(fields, page.get('fields', {}))
+            over_budget = over_budget or _over_budget(page)
+            spool.write(json.dumps(page) + '\n')
+            yield page
 
-        result = {
+        if (summary['cache'] == 'miss' and get_field_guesser().version == summary['pattern_version']
+                and not over_budget):
+            cache.put_pages(key, _read_spool(spool))
+        if save_to_history:
+            result = {key: summary[key] for key in ('file', 'processed_at', 'content_hash', 'pattern_version', 'cache')}
+            if policy is not None:
+                result['policy'] = summary['policy']
+            result['pages'] = None
+            save_history_streamed(filename, result, _read_spool(spool),
+                                  summary['page_count'], summary['text_length'], fields)
+    _count_document(file_extension, summary['cache'])
+    yield {'summary': summary}
+
+def process_file(file):
+    """
+    Processes an uploaded file (PDF or image):
+    - Saves a copy to the upload folder, subject to the upload retention policy
+    - Extracts text and fields through the extraction pipeline, without
+      reading spooled uploads into memory
+    - Returns structured output
+    """
+    upload_folder = os.path.abspath(current_app.config['UPLOAD_FOLDER'])
+    upload = open_upload(file)
+    file_path = None
+    try:
+        file_path = save_upload_copy(upload, upload_folder)
+        return {
             'file': file.filename,
-            'pages': pages,
+            'pages': extract_pages(upload, upload.extension),
             'processed_at': datetime.now().isoformat()
         }
-        
-        return result
-        
+
     except Exception as e:
         # Return error as a dictionary instead of tuple
         error_result = {
@@ -171,13 +544,14 @@ def process_file(file):
             'file': file.filename,
             'processed_at': datetime.now().isoformat()
         }
-        
-        # Try to clean up any temporary files
+
+        # Try to clean up the saved upload
         try:
-            if os.path.exists(file_path):
+            if file_path and os.path.exists(file_path):
                 os.remove(file_path)
         except:
             pass
-        
+
         return error_result
-    return {"filename": file.filename, "extracted_text": text}
+    finally:
+        upload.close()
@@ -0,0 +1,810 @@
+import base64
+import html
+import json
+import os
+import sqlite3
+import threading
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from services.history_stats import NUMERIC_FIELDS, STATS_COLUMNS, bucket_row, day_bounds, merge_row
+from utils.search_query import to_match_expression
+
+# Scalar fields promoted from page 1 into every history entry
+EXTRACTED_FIELDS = ['invoice_number', 'date', 'total', 'amount', 'vendor', 'description']
+
+# Keys of a history entry, in output order
+ENTRY_FIELDS = ['id', 'filename', 'processed_at', 'file_type', 'page_count', 'text_length',
+                'extracted_fields', 'pages', 'result']
+
+# 'pages.text' is a pseudo-key selecting the page text inside 'pages'
+FULL_PROJECTION = frozenset(ENTRY_FIELDS) | {'pages.text'}
+
+# Page text and the result payload (which repeats the pages) are opt-in
+DEFAULT_PROJECTION = frozenset(ENTRY_FIELDS) - {'result'}
+
+# Supported filters: processed_at bounds, file type and exact extracted field values
+FILTER_KEYS = ['since', 'until', 'file_type'] + EXTRACTED_FIELDS
+
+
+def normalize_entry(entry: Dict) -> Dict:
+    """
+    Fill in the metadata older history entries were saved without
+
+    Entries written before the metadata columns existed only carry
+    filename/processed_at/result/extracted_fields, so derive the rest.
+    Pages may be a lazy iterable when page_count and text_length are given.
+    """
+    result = entry.get('result') or {}
+    pages = entry.get('pages')
+    if pages is None:
+        pages = result.get('pages', []) or []
+    filename = entry.get('filename') or result.get('file') or ''
+
+    normalized = dict(entry)
+    normalized['filename'] = filename
+    normalized['processed_at'] = entry.get('processed_at') or result.get('processed_at') or ''
+    normalized['result'] = result
+    normalized['pages'] = pages
+    normalized['extracted_fields'] = entry.get('extracted_fields') or {}
+    if 'file_type' not in normalized:
+        normalized['file_type'] = filename.split('.')[-1].lower() if '.' in filename else 'unknown'
+    if 'page_count' not in normalized:
+        normalized['page_count'] = len(pages)
+    if 'text_length' not in normalized:
+        normalized['text_length'] = sum(len(page.get('text', '') or '') for page in pages)
+    return normalized
+
+
+def parse_projection(fields: Optional[str]) -> frozenset:
+    """
+    Turn a comma-separated fields parameter into a projection
+
+    Raises:
+        ValueError: If an unknown key is requested
+    """
+    if not fields:
+        return DEFAULT_PROJECTION
+    requested = {name.strip() for name in fields.split(',') if name.strip()}
+    if '*' in requested:
+        return FULL_PROJECTION
+    unknown = requested - FULL_PROJECTION
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    if 'pages.text' in requested:
+        requested.add('pages')
+    return frozenset(requested)
+
+
+def project_entry(entry: Dict, projection: frozenset) -> Dict:
+    """Keep only the keys selected by projection"""
+    projected = {key: entry[key] for key in ENTRY_FIELDS if key in projection and key in entry}
+    if 'pages' in projected and 'pages.text' not in projection:
+        projected['pages'] = [
+            {k: v for k, v in page.items() if k != 'text'}
+            for page in projected['pages']
+        ]
+    return projected
+
+
+def match_entry(entry: Dict, filters: Optional[Dict]) -> bool:
+    """Check a normalized entry against filters (see FILTER_KEYS)"""
+    if not filters:
+        return True
+    if 'since' in filters and not entry['processed_at'] > filters['since']:
+        return False
+    if 'until' in filters and not entry['processed_at'] < filters['until']:
+        return False
+    if 'file_type' in filters and entry['file_type'] != filters['file_type']:
+        return False
+    fields = entry['extracted_fields']
+    for name in EXTRACTED_FIELDS:
+        if name in filters and _scalar(fields.get(name)) != filters[name]:
+            return False
+    return True
+
+
+def encode_cursor(entry: Dict) -> str:
+    """Opaque cursor pointing just past entry in newest-first order"""
+    raw = json.dumps([entry['processed_at'], entry['id']]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """
+    Decode a cursor produced by encode_cursor
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        processed_at, entry_id = json.loads(raw)
+        return str(processed_at), int(entry_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+class HistoryBackend:
+    """Interface every history store implements"""
+
+    def append(self, entry: Dict) -> int:
+        """Append a single entry and return its id"""
+        return self.append_many([entry])[0]
+
+    def append_many(self, entries: Iterable[Dict], marker: Optional[str] = None) -> List[int]:
+        """
+        Append several entries in one write
+
+        Args:
+            entries: Entries to store
+            marker: Optional metadata key; if already set nothing is written,
+                otherwise it is set in the same write as the entries
+        """
+        raise NotImplementedError
+
+    def iter_entries(self, filters: Optional[Dict] = None, after: Optional[Tuple[str, int]] = None,
+                     projection: frozenset = FULL_PROJECTION) -> Iterator[Dict]:
+        """
+        Yield entries newest first
+
+        Args:
+            filters: Optional filters (see FILTER_KEYS)
+            after: Decoded cursor; only entries older than it are returned
+            projection: Keys the caller needs. Backends may skip loading the
+                rest but can return more; use project_entry to trim.
+        """
+        raise NotImplementedError
+
+    def query(self, limit: int, filters: Optional[Dict] = None, after: Optional[Tuple[str, int]] = None,
+              projection: frozenset = DEFAULT_PROJECTION) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Fetch one page of entries
+
+        Returns:
+            Projected entries and the cursor for the next page (None on the last page)
+        """
+        entries = list(islice(self.iter_entries(filters, after, projection), limit + 1))
+        next_cursor = encode_cursor(entries[limit - 1]) if len(entries) > limit else None
+        return [project_entry(entry, projection) for entry in entries[:limit]], next_cursor
+
+    def count(self) -> int:
+        """Number of stored entries"""
+        return sum(1 for _ in self.iter_entries())
+
+    def field_names(self, filters: Optional[Dict] = None) -> set:
+        """Names of all extracted and per-page fields among matching entries"""
+        names = set()
+        projection = frozenset({'extracted_fields', 'pages'})
+        for entry in self.iter_entries(filters, projection=projection):
+            names.update(entry['extracted_fields'].keys())
+            for page in entry['pages']:
+                names.update(page.get('fields', {}).keys())
+        return names
+
+    def search(self, query: str, limit: int, offset: int = 0,
+               filters: Optional[Dict] = None) -> Tuple[List[Dict], bool]:
+        """
+        Full-text search over the pages of all entries, best match first
+
+        Args:
+            query: Search query (see utils.search_query.to_match_expression)
+            limit: Hits to return
+            offset: Hits to skip
+            filters: Optional filters (see FILTER_KEYS)
+
+        Returns:
+            Hits and whether more follow
+
+        Raises:
+            ValueError: If the query is invalid
+        """
+        raise NotImplementedError("Search requires the sqlite history backend")
+
+    def stats_rows(self, filters: Optional[Dict] = None) -> Iterator[Dict]:
+        """
+        Per-day, per-file-type aggregates (see STATS_COLUMNS)
+
+        Args:
+            filters: Only since, until (whole days) and file_type apply
+        """
+        first, last = day_bounds(filters)
+        type_filter = {'file_type': filters['file_type']} if filters and 'file_type' in filters else None
+        buckets = {}
+        for entry in self.iter_entries(type_filter, projection=frozenset({'extracted_fields'})):
+            row = dict(zip(STATS_COLUMNS, bucket_row(entry['processed_at'], entry['file_type'],
+                                                     entry['page_count'], entry['text_length'],
+                                                     entry['extracted_fields'])))
+            if (first and row['day'] < first) or (last and row['day'] > last):
+                continue
+            bucket = buckets.setdefault((row['day'], row['file_type']),
+                                        {'day': row['day'], 'file_type': row['file_type']})
+            merge_row(bucket, row)
+        return iter(buckets.values())
+
+    def get_meta(self, key: str) -> Optional[str]:
+        return None
+
+    def set_meta(self, key: str, value: str):
+        pass
+
+    def close(self):
+        pass
+
+
+class JSONHistoryBackend(HistoryBackend):
+    """
+    Legacy single-file JSON store
+
+    Every append rewrites the whole file, so this is only kept for
+    deployments that explicitly opt into HISTORY_BACKEND=json.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read(self) -> List[Dict]:
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'r') as f:
+            try:
+                history = json.load(f)
+            except json.JSONDecodeError:
+                return []
+        if not isinstance(history, list):
+            raise ValueError("Invalid history file format")
+        return history
+
+    def append_many(self, entries: Iterable[Dict], marker: Optional[str] = None) -> List[int]:
+        entries = [self._materialize(entry) for entry in entries]
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            history = self._read()
+            first_id = len(history) + 1
+            history.extend(entries)
+            # Write to a temp file and swap it in so readers never see a partial file
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(history, f, indent=4)
+            os.replace(temp_path, self.path)
+        return list(range(first_id, first_id + len(entries)))
+
+    @staticmethod
+    def _materialize(entry: Dict) -> Dict:
+        """Turn lazily produced pages into a list the JSON file can hold"""
+        if isinstance(entry.get('pages'), list):
+            return entry
+        entry = dict(entry, pages=list(entry.get('pages') or []))
+        if entry.get('result', {}).get('pages', []) is None:
+            entry['result'] = dict(entry['result'], pages=entry['pages'])
+        return entry
+
+    def iter_entries(self, filters: Optional[Dict] = None, after: Optional[Tuple[str, int]] = None,
+                     projection: frozenset = FULL_PROJECTION) -> Iterator[Dict]:
+        history = []
+        for index, entry in enumerate(self._read()):
+            if not isinstance(entry, dict):
+                continue
+            entry = normalize_entry(entry)
+            entry.setdefault('id', index + 1)
+            if not match_entry(entry, filters):
+                continue
+            if after is not None and (entry['processed_at'], entry['id']) >= after:
+                continue
+            history.append(entry)
+        history.sort(key=lambda x: (x['processed_at'], x['id']), reverse=True)
+        yield from history
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    filename TEXT NOT NULL,
+    processed_at TEXT NOT NULL,
+    file_type TEXT,
+    page_count INTEGER NOT NULL DEFAULT 0,
+    text_length INTEGER NOT NULL DEFAULT 0,
+    invoice_number TEXT,
+    date TEXT,
+    total TEXT,
+    amount TEXT,
+    vendor TEXT,
+    description TEXT,
+    extracted_fields TEXT NOT NULL DEFAULT '{}',
+    result TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS history_pages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    entry_id INTEGER NOT NULL REFERENCES history(id) ON DELETE CASCADE,
+    page INTEGER,
+    text TEXT NOT NULL DEFAULT '',
+    data TEXT NOT NULL DEFAULT '{}',
+    field_values TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS history_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_history_processed_at ON history (processed_at, id);
+CREATE INDEX IF NOT EXISTS idx_history_file_type ON history (file_type, processed_at);
+CREATE INDEX IF NOT EXISTS idx_history_pages_entry ON history_pages (entry_id, page);
+""" + ''.join(
+    f"CREATE INDEX IF NOT EXISTS idx_history_{name} ON history ({name});\n"
+    for name in EXTRACTED_FIELDS
+)
+
+# Per-day, per-file-type counters, updated with every insert so stats cost O(buckets)
+STATS_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS history_stats (
+    day TEXT NOT NULL,
+    file_type TEXT NOT NULL,
+    documents INTEGER NOT NULL DEFAULT 0,
+    pages INTEGER NOT NULL DEFAULT 0,
+    text_length INTEGER NOT NULL DEFAULT 0,
+    {''.join(f"{name}_count INTEGER NOT NULL DEFAULT 0, {name}_sum REAL NOT NULL DEFAULT 0, "
+             f"{name}_min REAL, {name}_max REAL, " for name in NUMERIC_FIELDS)}
+    PRIMARY KEY (day, file_type)
+);
+"""
+
+STATS_UPSERT = (
+    f"INSERT INTO history_stats ({', '.join(STATS_COLUMNS)}) "
+    f"VALUES ({', '.join('?' for _ in STATS_COLUMNS)}) "
+    "ON CONFLICT(day, file_type) DO UPDATE SET " + ', '.join(
+        [f"{name} = {name} + excluded.{name}" for name in STATS_COLUMNS
+         if name.endswith(('_count', '_sum')) or name in ('documents', 'pages', 'text_length')]
+        # min()/max() of SQLite return NULL if either side is NULL
+        + [f"{name} = {func}(coalesce({name}, excluded.{name}), coalesce(excluded.{name}, {name}))"
+           for name in STATS_COLUMNS for func in ('min', 'max') if name.endswith(f"_{func}")]
+    )
+)
+
+# Bump when the search index definition changes; existing databases are re-indexed on open
+SEARCH_INDEX_VERSION = '1'
+
+# Columns of the full-text index: one row per page, with the page's own field
+# values (all of them in 'fields', the promoted ones also in their own column)
+SEARCH_COLUMNS = ['filename', 'text', 'fields'] + EXTRACTED_FIELDS
+
+# bm25 weight per column: a hit in a field value counts more than one in the body text
+SEARCH_WEIGHTS = {'filename': 2.0, 'text': 1.0, 'fields': 3.0, **{name: 5.0 for name in EXTRACTED_FIELDS}}
+
+SNIPPET_MARKERS = ('<mark>', '</mark>')
+SNIPPET_TOKENS = 16
+# FTS5 marks matches with these private-use characters; the snippet text is
+# then HTML-escaped and they are swapped for SNIPPET_MARKERS, so markup in
+# a document never reaches clients as HTML
+_SNIPPET_SENTINELS = ('\ue000', '\ue001')
+
+def _highlight(snippet: Optional[str]) -> Optional[str]:
+    """HTML-escape an FTS5 snippet and turn its match sentinels into SNIPPET_MARKERS"""
+    if snippet is None:
+        return None
+    escaped = html.escape(snippet, quote=False)
+    for sentinel, marker in zip(_SNIPPET_SENTINELS, SNIPPET_MARKERS):
+        escaped = escaped.replace(sentinel, marker)
+    return escaped
+
+# The index is an external-content FTS5 table over this view, so page text is
+# stored once; snippets read it back from history_pages. (FTS5 can't run
+# json_each while indexing, hence the field_values column.)
+SEARCH_SCHEMA = [
+    f"""CREATE VIEW history_search_source AS
+        SELECT p.id AS id, p.entry_id AS entry_id, h.filename AS filename, p.text AS text,
+               p.field_values AS fields,
+               {', '.join(f"json_extract(p.data, '$.fields.{name}') AS {name}" for name in EXTRACTED_FIELDS)}
+        FROM history_pages p JOIN history h ON h.id = p.entry_id""",
+    f"""CREATE VIRTUAL TABLE history_fts USING fts5(
+            {', '.join(SEARCH_COLUMNS)},
+            content='history_search_source', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )""",
+    "INSERT INTO history_fts (history_fts, rank) VALUES "
+    f"('rank', 'bm25({', '.join(str(SEARCH_WEIGHTS[name]) for name in SEARCH_COLUMNS)})')",
+]
+
+
+class SQLiteHistoryBackend(HistoryBackend):
+    """
+    Append-only history store on SQLite in WAL mode
+
+    Each append is a single INSERT transaction, so the cost no longer grows
+    with the size of the history. WAL lets readers run alongside the writer
+    and BEGIN IMMEDIATE plus busy_timeout serialises writers across worker
+    processes instead of losing updates.
+    """
+
+    # Number of entries whose pages are fetched per query while iterating
+    BATCH_SIZE = 200
+
+    def __init__(self, path: str, timeout: float = 30.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._init_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                               check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA foreign_keys=ON')
+        conn.execute(f'PRAGMA busy_timeout={int(self.timeout * 1000)}')
+        return conn
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Connection for the current thread, reopened after a fork"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _init_schema(self):
+        self.conn.executescript(SCHEMA + STATS_SCHEMA)
+        if self.get_meta('stats') is None:
+            self._write(self._build_stats)
+        if self.get_meta('search_index') != SEARCH_INDEX_VERSION:
+            self._write(self._build_search_index)
+
+    @staticmethod
+    def _build_stats(conn: sqlite3.Connection):
+        """Fill the aggregates from the entries stored before they existed"""
+        if conn.execute("SELECT 1 FROM history_meta WHERE key = 'stats'").fetchone():
+            return
+        conn.execute("DELETE FROM history_stats")
+        rows = conn.execute(
+            "SELECT processed_at, file_type, page_count, text_length, extracted_fields FROM history"
+        ).fetchall()
+        conn.executemany(STATS_UPSERT, (
+            bucket_row(row['processed_at'], row['file_type'], row['page_count'], row['text_length'],
+                       json.loads(row['extracted_fields']))
+            for row in rows
+        ))
+        conn.execute("INSERT INTO history_meta (key, value) VALUES ('stats', ?)", (str(len(rows)),))
+
+    @staticmethod
+    def _build_search_index(conn: sqlite3.Connection):
+        """(Re)create the full-text index and index every stored page"""
+        # Checked under the write lock so concurrent workers build it only once
+        row = conn.execute("SELECT value FROM history_meta WHERE key = 'search_index'").fetchone()
+        if row and row['value'] == SEARCH_INDEX_VERSION:
+            return
+        columns = {column['name'] for column in conn.execute("PRAGMA table_info(history_pages)")}
+        if 'field_values' not in columns:
+            # Databases created before search existed
+            conn.execute("ALTER TABLE history_pages ADD COLUMN field_values TEXT NOT NULL DEFAULT ''")
+            conn.executemany(
+                "UPDATE history_pages SET field_values = ? WHERE id = ?",
+                ((_field_values(json.loads(row['data']).get('fields')), row['id'])
+                 for row in conn.execute("SELECT id, data FROM history_pages").fetchall())
+            )
+        conn.execute("DROP TABLE IF EXISTS history_fts")
+        conn.execute("DROP VIEW IF EXISTS history_search_source")
+        for statement in SEARCH_SCHEMA:
+            conn.execute(statement)
+        conn.execute("INSERT INTO history_fts (history_fts) VALUES ('rebuild')")
+        conn.execute(
+            "INSERT INTO history_meta (key, value) VALUES ('search_index', ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (SEARCH_INDEX_VERSION,)
+        )
+
+    def _write(self, callback):
+        """Run callback inside an immediate (write-locked) transaction"""
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            value = callback(conn)
+            conn.execute('COMMIT')
+            return value
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _insert(self, conn: sqlite3.Connection, entry: Dict) -> int:
+        entry = normalize_entry(entry)
+        fields = entry['extracted_fields']
+        # The result payload repeats the pages; keep a placeholder and re-attach on read
+        result = dict(entry['result'])
+        if 'pages' in result:
+            result['pages'] = None
+
+        cursor = conn.execute(
+            f"""INSERT INTO history (filename, processed_at, file_type, page_count, text_length,
+                                     {', '.join(EXTRACTED_FIELDS)}, extracted_fields, result)
+                VALUES (?, ?, ?, ?, ?, {', '.join('?' for _ in EXTRACTED_FIELDS)}, ?, ?)""",
+            (
+                entry['filename'], entry['processed_at'], entry['file_type'],
+                entry['page_count'], entry['text_length'],
+                *[_scalar(fields.get(name)) for name in EXTRACTED_FIELDS],
+                json.dumps(fields), json.dumps(result),
+            )
+        )
+        entry_id = cursor.lastrowid
+        # A generator keeps lazily produced pages from being held all at once
+        conn.executemany(
+            "INSERT INTO history_pages (entry_id, page, text, data, field_values) VALUES (?, ?, ?, ?, ?)",
+            (
+                (entry_id, page.get('page'), page.get('text', '') or '',
+                 json.dumps({k: (None if k == 'text' else v) for k, v in page.items()}),
+                 _field_values(page.get('fields')))
+                for page in entry['pages']
+            )
+        )
+        conn.execute(STATS_UPSERT, bucket_row(entry['processed_at'], entry['file_type'], entry['page_count'],
+                                              entry['text_length'], fields))
+        # Index the pages in the same transaction, so search never misses a saved entry
+        conn.execute(
+            f"INSERT INTO history_fts (rowid, {', '.join(SEARCH_COLUMNS)}) "
+            f"SELECT id, {', '.join(SEARCH_COLUMNS)} FROM history_search_source WHERE entry_id = ?",
+            (entry_id,)
+        )
+        return entry_id
+
+    def append_many(self, entries: Iterable[Dict], marker: Optional[str] = None) -> List[int]:
+        entries = list(entries)
+        if not entries and marker is None:
+            return []
+
+        def insert(conn):
+            if marker is not None:
+                # Checked under the write lock so concurrent workers import only once
+                if conn.execute("SELECT 1 FROM history_meta WHERE key = ?", (marker,)).fetchone():
+                    return []
+                conn.execute("INSERT INTO history_meta (key, value) VALUES (?, ?)",
+                             (marker, str(len(entries))))
+            return [self._insert(conn, entry) for entry in entries]
+
+        return self._write(insert)
+
+    def _fetch_pages(self, entry_ids: List[int], include_text: bool = True) -> Dict[int, List[Dict]]:
+        pages = {entry_id: [] for entry_id in entry_ids}
+        if not entry_ids:
+            return pages
+        # Leaving the text column out of the select avoids reading it at all
+        rows = self.conn.execute(
+            f"SELECT entry_id, {'text, ' if include_text else ''}data FROM history_pages "
+            f"WHERE entry_id IN ({', '.join('?' for _ in entry_ids)}) ORDER BY entry_id, id",
+            entry_ids
+        )
+        for row in rows:
+            page = json.loads(row['data'])
+            if 'text' in page:
+                if include_text:
+                    page['text'] = row['text']
+                else:
+                    del page['text']
+            pages[row['entry_id']].append(page)
+        return pages
+
+    def _row_to_entry(self, row: sqlite3.Row, pages: List[Dict]) -> Dict:
+        result = json.loads(row['result'])
+        if 'pages' in result:
+            result['pages'] = pages
+        return {
+            'id': row['id'],
+            'filename': row['filename'],
+            'processed_at': row['processed_at'],
+            'result': result,
+            'pages': pages,
+            'extracted_fields': json.loads(row['extracted_fields']),
+            'file_type': row['file_type'],
+            'page_count': row['page_count'],
+            'text_length': row['text_length'],
+        }
+
+    @staticmethod
+    def _where(filters: Optional[Dict]) -> Tuple[List[str], List]:
+        """Translate filters into indexed WHERE clauses"""
+        clauses, params = [], []
+        filters = filters or {}
+        if 'since' in filters:
+            clauses.append("processed_at > ?")
+            params.append(filters['since'])
+        if 'until' in filters:
+            clauses.append("processed_at < ?")
+            params.append(filters['until'])
+        for name in ['file_type'] + EXTRACTED_FIELDS:
+            if name in filters:
+                clauses.append(f"{name} = ?")
+                params.append(filters[name])
+        return clauses, params
+
+    def iter_entries(self, filters: Optional[Dict] = None, after: Optional[Tuple[str, int]] = None,
+                     projection: frozenset = FULL_PROJECTION) -> Iterator[Dict]:
+        where, params = self._where(filters)
+        with_result = 'result' in projection
+        with_pages = with_result or 'pages' in projection
+        with_text = with_result or 'pages.text' in projection
+
+        # Keyset pagination keeps memory bounded to one batch at a time
+        last = after
+        while True:
+            clauses = list(where)
+            if last is not None:
+                clauses.append("(processed_at, id) < (?, ?)")
+            sql = "SELECT * FROM history"
+            if clauses:
+                sql += " WHERE " + " AND ".join(clauses)
+            sql += " ORDER BY processed_at DESC, id DESC LIMIT ?"
+            rows = self.conn.execute(
+                sql, (*params, *(last or ()), self.BATCH_SIZE)
+            ).fetchall()
+            if not rows:
+                return
+            ids = [row['id'] for row in rows]
+            pages = self._fetch_pages(ids, include_text=with_text) if with_pages else {}
+            for row in rows:
+                yield self._row_to_entry(row, pages.get(row['id'], []))
+            last = (rows[-1]['processed_at'], rows[-1]['id'])
+
+    def count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+
+    def field_names(self, filters: Optional[Dict] = None) -> set:
+        # Let SQLite walk the JSON keys so no entry or page text is materialised
+        where, params = self._where(filters)
+        condition = " WHERE " + " AND ".join(where) if where else ""
+        rows = self.conn.execute(
+            f"""SELECT DISTINCT key FROM history, json_each(history.extracted_fields){condition}
+                UNION
+                SELECT DISTINCT key FROM history_pages, json_each(history_pages.data, '$.fields')
+                WHERE entry_id IN (SELECT id FROM history{condition})""",
+            (*params, *params)
+        )
+        return {row['key'] for row in rows}
+
+    def search(self, query: str, limit: int, offset: int = 0,
+               filters: Optional[Dict] = None) -> Tuple[List[Dict], bool]:
+        expression = to_match_expression(query, SEARCH_COLUMNS)
+        where, params = self._where(filters)
+        condition = ""
+        if where:
+            condition = f" AND p.entry_id IN (SELECT id FROM history WHERE {' AND '.join(where)})"
+            ranked_sql = (
+                "SELECT history_fts.rowid AS id, history_fts.rank AS score FROM history_fts "
+                "JOIN history_pages p ON p.id = history_fts.rowid "
+                f"WHERE history_fts MATCH ?{condition} ORDER BY history_fts.rank LIMIT ? OFFSET ?"
+            )
+        else:
+            # Without filters FTS5 ranks and cuts the top hits on its own
+            ranked_sql = ("SELECT rowid AS id, rank AS score FROM history_fts "
+                          "WHERE history_fts MATCH ? ORDER BY rank LIMIT ? OFFSET ?")
+        ranked = self.conn.execute(ranked_sql, (expression, *params, limit + 1, offset)).fetchall()
+        has_more = len(ranked) > limit
+        ranked = ranked[:limit]
+        if not ranked:
+            return [], False
+
+        # Snippets only for the hits returned, not for every match
+        scores = {row['id']: row['score'] for row in ranked}
+        rows = self.conn.execute(
+            f"""SELECT history_fts.rowid AS id, p.entry_id, p.page, h.filename, h.processed_at, h.file_type,
+                       snippet(history_fts, -1, ?, ?, '…', ?) AS snippet
+                FROM history_fts
+                JOIN history_pages p ON p.id = history_fts.rowid
+                JOIN history h ON h.id = p.entry_id
+                WHERE history_fts MATCH ? AND history_fts.rowid IN ({', '.join('?' for _ in scores)})""",
+            (*_SNIPPET_SENTINELS, SNIPPET_TOKENS, expression, *scores)
+        ).fetchall()
+        hits = {
+            row['id']: {
+                'id': row['entry_id'],
+                'filename': row['filename'],
+                'processed_at': row['processed_at'],
+                'file_type': row['file_type'],
+                'page': row['page'],
+                # bm25 is lower for better matches; report it the other way round
+                'score': round(-scores[row['id']], 4),
+                'snippet': _highlight(row['snippet']),
+            }
+            for row in rows
+        }
+        return [hits[row['id']] for row in ranked if row['id'] in hits], has_more
+
+    def stats_rows(self, filters: Optional[Dict] = None) -> Iterator[Dict]:
+        first, last = day_bounds(filters)
+        clauses, params = [], []
+        if first:
+            clauses.append("day >= ?")
+            params.append(first)
+        if last:
+            clauses.append("day <= ?")
+            params.append(last)
+        if filters and 'file_type' in filters:
+            clauses.append("file_type = ?")
+            params.append(filters['file_type'])
+        sql = f"SELECT {', '.join(STATS_COLUMNS)} FROM history_stats"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        for row in self.conn.execute(sql, params):
+            yield dict(row)
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM history_meta WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row else None
+
+    def set_meta(self, key: str, value: str):
+        self.conn.execute(
+            "INSERT INTO history_meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value)
+        )
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def _field_values(fields: Optional[Dict]) -> str:
+    """All values of a page's fields as one string, for the search index"""
+    return ' '.join(value if isinstance(value, str) else json.dumps(value)
+                    for value in (fields or {}).values() if value is not None)
+
+
+def _scalar(value):
+    """Coerce a field value into something SQLite can index"""
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    return json.dumps(value)
+
+
+def migrate_json_history(json_path: str, backend: HistoryBackend) -> int:
+    """
+    Import a legacy history.json into backend once
+
+    The import and its completion marker are written in a single transaction,
+    so calling this again for the same file (or from several workers at once)
+    is a no-op.
+
+    Returns:
+        Number of entries imported
+    """
+    if isinstance(backend, JSONHistoryBackend) or not os.path.exists(json_path):
+        return 0
+
+    marker = f"migrated:{os.path.abspath(json_path)}"
+    if backend.get_meta(marker):
+        return 0
+
+    legacy = JSONHistoryBackend(json_path)
+    entries = [
+        {k: v for k, v in entry.items() if k != 'id'}
+        for entry in legacy.iter_entries()
+    ]
+    # Insert oldest first so ids follow the original processing order
+    entries.reverse()
+    return len(backend.append_many(entries, marker=marker))
+
+
+def create_backend(kind: str, path: str) -> HistoryBackend:
+    """Build a history backend by name"""
+    if kind == 'sqlite':
+        return SQLiteHistoryBackend(path)
+    if kind == 'json':
+        return JSONHistoryBackend(path)
+    raise ValueError(f"Unknown history backend: {kind}")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Import a legacy history.json into the SQLite history store")
+    parser.add_argument('json_path', nargs='?', default=os.path.join('storage', 'history.json'))
+    parser.add_argument('--db', default=os.getenv('HISTORY_DB_PATH', os.path.join('storage', 'history.db')))
+    args = parser.parse_args()
+
+    imported = migrate_json_history(args.json_path, SQLiteHistoryBackend(args.db))
+    print(f"Imported {imported} entries from {args.json_path} into {args.db}")
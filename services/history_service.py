@@ -1,90 +1,258 @@
-import json
 import os
 from datetime import datetime
+from itertools import chain
+
+from services.history_backends import (
+    EXTRACTED_FIELDS, FILTER_KEYS, create_backend, decode_cursor, migrate_json_history, parse_projection,
+    project_entry
+)
+from services.history_stats import parse_group_by, summarize
+from utils.metrics import get_metrics
 
 HISTORY_FILE = os.path.join('storage', 'history.json')
+HISTORY_DB = os.path.join('storage', 'history.db')
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+def get_history_backend():
+    """
+    Singleton pattern to get the configured history backend
+
+    HISTORY_BACKEND selects the store ('sqlite' by default, 'json' for the
+    legacy single-file store). On first use the SQLite store imports any
+    existing storage/history.json.
+    """
+    if not hasattr(get_history_backend, "instance"):
+        kind = os.getenv('HISTORY_BACKEND', 'sqlite').lower()
+        if kind == 'json':
+            backend = create_backend('json', os.getenv('HISTORY_FILE_PATH', HISTORY_FILE))
+        else:
+            backend = create_backend(kind, os.getenv('HISTORY_DB_PATH', HISTORY_DB))
+            try:
+                migrate_json_history(HISTORY_FILE, backend)
+            except Exception as e:
+                print(f"Warning: Failed to import {HISTORY_FILE}: {str(e)}")
+        get_history_backend.instance = backend
+    return get_history_backend.instance
+
+def merge_fields(fields, page_fields):
+    """
+    Fill the EXTRACTED_FIELDS still missing from fields with a page's values
+
+    Merging pages in order gives each field its value from the first page
+    that has it, so page 1 wins and e.g. a total found only on the last
+    page is kept too.
+    """
+    for name in EXTRACTED_FIELDS:
+        if fields.get(name) is None and page_fields.get(name) is not None:
+            fields[name] = page_fields[name]
+    return fields
+
+def build_history_entry(filename, result):
+    """Create history entry with metadata"""
+    pages = result.get('pages', [])
+    fields = {name: None for name in EXTRACTED_FIELDS}
+    for page in pages:
+        merge_fields(fields, page.get('fields', {}))
+    return {
+        'filename': filename,
+        'processed_at': datetime.now().isoformat(),
+        'result': result,
+        'pages': pages,
+        'extracted_fields': fields,
+        'file_type': filename.split('.')[-1].lower(),
+        'page_count': len(pages),
+        'text_length': sum(len(page.get('text', '')) for page in pages)
+    }
 
 def save_history(filename, result):
     """
     Save file processing history with additional metadata
     """
-    if not os.path.exists('storage'):
-        os.makedirs('storage')
+    try:
+        entry = build_history_entry(filename, result)
+        with get_metrics().get('history_write_seconds').time(operation='append'):
+            get_history_backend().append(entry)
+    except Exception as e:
+        raise Exception(f"Failed to save history: {str(e)}")
 
+def save_history_streamed(filename, result, pages, page_count, text_length, fields=None):
+    """
+    Save a result whose pages are produced lazily, e.g. read back from a spool file
+
+    Args:
+        filename: Original filename
+        result: Result payload without the pages ('pages' set to None)
+        pages: Iterable of pages, consumed once while writing
+        page_count: Number of pages
+        text_length: Total text length of all pages
+        fields: Fields merged over all pages with merge_fields; page 1's when omitted
+    """
+    pages = iter(pages)
+    first_page = next(pages, None)
+    if fields is None:
+        fields = merge_fields({}, (first_page or {}).get('fields', {}))
+    entry = {
+        'filename': filename,
+        'processed_at': datetime.now().isoformat(),
+        'result': result,
+        'pages': chain([first_page], pages) if first_page is not None else [],
+        'extracted_fields': {name: fields.get(name) for name in EXTRACTED_FIELDS},
+        'file_type': filename.split('.')[-1].lower(),
+        'page_count': page_count,
+        'text_length': text_length
+    }
     try:
-        history = []
-        if os.path.exists(HISTORY_FILE):
-            with open(HISTORY_FILE, 'r') as f:
-                try:
-                    history = json.load(f)
-                except json.JSONDecodeError:
-                    history = []
-
-        # Create history entry with metadata
-        entry = {
-            'filename': filename,
-            'processed_at': datetime.now().isoformat(),
-            'result': result,
-            'pages': result.get('pages', []),
-            'extracted_fields': {
-                'invoice_number': result.get('pages', [{}])[0].get('fields', {}).get('invoice_number'),
-                'date': result.get('pages', [{}])[0].get('fields', {}).get('date'),
-                'total': result.get('pages', [{}])[0].get('fields', {}).get('total'),
-                'amount': result.get('pages', [{}])[0].get('fields', {}).get('amount'),
-                'vendor': result.get('pages', [{}])[0].get('fields', {}).get('vendor'),
-                'description': result.get('pages', [{}])[0].get('fields', {}).get('description')
-            },
-            'file_type': filename.split('.')[-1].lower(),
-            'page_count': len(result.get('pages', [])),
-            'text_length': sum(len(page.get('text', '')) for page in result.get('pages', []))
-        }
-
-        history.append(entry)
-
-        with open(HISTORY_FILE, 'w') as f:
-            json.dump(history, f, indent=4)
+        with get_metrics().get('history_write_seconds').time(operation='append_streamed'):
+            get_history_backend().append(entry)
+    except Exception as e:
+        raise Exception(f"Failed to save history: {str(e)}")
+
+def save_history_many(items):
+    """
+    Save several processing results in one bulk write
 
+    Args:
+        items: Iterable of (filename, result) tuples
+    """
+    try:
+        entries = [build_history_entry(filename, result) for filename, result in items]
+        with get_metrics().get('history_write_seconds').time(operation='append_many'):
+            get_history_backend().append_many(entries)
     except Exception as e:
         raise Exception(f"Failed to save history: {str(e)}")
 
 def load_history():
     """
-    Load file processing history with additional filtering capabilities
+    Load file processing history, newest first
     """
     try:
-        if not os.path.exists(HISTORY_FILE):
-            return []
-
-        with open(HISTORY_FILE, 'r') as f:
-            history = json.load(f)
-            
-        # Validate the history structure
-        if not isinstance(history, list):
-            raise ValueError("Invalid history file format")
-            
-        # Clean up any invalid entries
-        cleaned_history = []
-        for entry in history:
-            try:
-                # Validate required fields
-                if not isinstance(entry, dict):
-                    continue
-                
-                # Add default values for missing fields
-                entry.setdefault('file_type', 'unknown')
-                entry.setdefault('page_count', 0)
-                entry.setdefault('text_length', 0)
-                entry.setdefault('extracted_fields', {})
-                entry.setdefault('pages', [])
-                
-                cleaned_history.append(entry)
-            except Exception as e:
-                print(f"Warning: Skipping invalid history entry: {str(e)}")
-                continue
-                
-        # Sort by processed_at in descending order
-        cleaned_history.sort(key=lambda x: x['processed_at'], reverse=True)
-        return cleaned_history
+        return list(get_history_backend().iter_entries())
     except Exception as e:
         print(f"Error loading history: {str(e)}")
         return []
+
+def parse_history_filters(args):
+    """
+    Read history filters from request query parameters
+
+    Raises:
+        ValueError: If a date bound is not an ISO timestamp
+    """
+    filters = {}
+    for key in FILTER_KEYS:
+        value = args.get(key)
+        if value in (None, ''):
+            continue
+        if key in ('since', 'until'):
+            try:
+                datetime.fromisoformat(value)
+            except ValueError:
+                raise ValueError(f"{key} must be an ISO timestamp")
+        filters[key] = value.lower() if key == 'file_type' else value
+    return filters
+
+def parse_history_query(args):
+    """
+    Read pagination, filters and projection from request query parameters
+
+    Returns:
+        Tuple of (limit, after, filters, projection)
+
+    Raises:
+        ValueError: If any parameter is invalid
+    """
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+    after = decode_cursor(args['after']) if args.get('after') else None
+    return limit, after, parse_history_filters(args), parse_projection(args.get('fields'))
+
+def iter_history(filters=None, projection=None):
+    """Lazily iterate history entries, newest first"""
+    if projection is None:
+        projection = parse_projection('*')
+    backend = get_history_backend()
+    for entry in backend.iter_entries(filters, projection=projection):
+        yield project_entry(entry, projection)
+
+def history_field_names(filters=None):
+    """Names of all fields extracted in matching history entries"""
+    return get_history_backend().field_names(filters)
+
+def query_history(limit=DEFAULT_PAGE_SIZE, after=None, filters=None, projection=None):
+    """
+    Fetch one page of history, newest first
+
+    Returns:
+        Tuple of (entries, next_cursor)
+    """
+    if projection is None:
+        projection = parse_projection(None)
+    return get_history_backend().query(limit, filters=filters, after=after, projection=projection)
+
+def parse_search_params(args):
+    """
+    Read the query, paging and filters of a search from request query parameters
+
+    Returns:
+        Tuple of (query, limit, offset, filters)
+
+    Raises:
+        ValueError: If any parameter is invalid
+    """
+    query = (args.get('q') or '').strip()
+    if not query:
+        raise ValueError("q is required")
+    try:
+        limit = int(args.get('limit', DEFAULT_SEARCH_LIMIT))
+        offset = int(args.get('offset', 0))
+    except ValueError:
+        raise ValueError("limit and offset must be integers")
+    if not 1 <= limit <= MAX_SEARCH_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_SEARCH_LIMIT}")
+    if offset < 0:
+        raise ValueError("offset must not be negative")
+    return query, limit, offset, parse_history_filters(args)
+
+def search_history(query, limit=DEFAULT_SEARCH_LIMIT, offset=0, filters=None):
+    """
+    Full-text search over the pages of the history, best match first
+
+    Returns:
+        Tuple of (hits, has_more)
+    """
+    return get_history_backend().search(query, limit, offset=offset, filters=filters)
+
+def parse_stats_params(args):
+    """
+    Read grouping and filters of a stats request from request query parameters
+
+    Returns:
+        Tuple of (group_by, filters)
+
+    Raises:
+        ValueError: If any parameter is invalid, or a filter the aggregates can't answer is used
+    """
+    filters = parse_history_filters(args)
+    unsupported = sorted(set(filters) - {'since', 'until', 'file_type'})
+    if unsupported:
+        raise ValueError(f"Stats can't be filtered by {', '.join(unsupported)}")
+    return parse_group_by(args.get('group_by')), filters
+
+def history_stats(group_by, filters=None):
+    """
+    Counts, page and text totals and numeric field sums/min/max per group
+
+    Read from per-day aggregates kept up to date by every save, so the cost
+    depends on the number of days covered, not on the number of entries.
+    """
+    return summarize(get_history_backend().stats_rows(filters), group_by)
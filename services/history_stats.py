@@ -0,0 +1,132 @@
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from utils.field_resolver import parse_number
+
+# Extracted fields summed up per bucket
+NUMERIC_FIELDS = ['total', 'amount']
+
+PERIODS = ['day', 'week', 'month']
+GROUP_KEYS = PERIODS + ['file_type']
+
+# Columns of a day bucket, in storage order
+COUNTERS = ['documents', 'pages', 'text_length']
+STATS_COLUMNS = ['day', 'file_type'] + COUNTERS + [
+    f"{name}_{part}" for name in NUMERIC_FIELDS for part in ('count', 'sum', 'min', 'max')
+]
+
+
+def _number(value) -> Optional[float]:
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    return parse_number(str(value)) if isinstance(value, str) else None
+
+
+def bucket_row(processed_at: str, file_type: Optional[str], page_count: int, text_length: int,
+               fields: Dict) -> Tuple:
+    """
+    The contribution of one history entry to its day bucket, as STATS_COLUMNS values
+
+    Numeric fields that are missing or don't parse as a number are not counted.
+    """
+    row = [(processed_at or '')[:10], file_type or 'unknown', 1, page_count or 0, text_length or 0]
+    for name in NUMERIC_FIELDS:
+        value = _number(fields.get(name))
+        row += [0, 0.0, None, None] if value is None else [1, value, value, value]
+    return tuple(row)
+
+
+def merge_row(target: Dict, row: Dict):
+    """Add the counters of a bucket row into target"""
+    for name in COUNTERS:
+        target[name] = target.get(name, 0) + row[name]
+    for name in NUMERIC_FIELDS:
+        target[f"{name}_count"] = target.get(f"{name}_count", 0) + row[f"{name}_count"]
+        target[f"{name}_sum"] = target.get(f"{name}_sum", 0.0) + row[f"{name}_sum"]
+        for part, pick in (('min', min), ('max', max)):
+            values = [value for value in (target.get(f"{name}_{part}"), row[f"{name}_{part}"]) if value is not None]
+            target[f"{name}_{part}"] = pick(values) if values else None
+
+
+def period_key(day: str, period: str) -> str:
+    """The day, ISO week (its Monday) or month a day bucket falls into"""
+    if period == 'month':
+        return day[:7]
+    if period == 'week':
+        try:
+            start = date.fromisoformat(day)
+        except ValueError:
+            return day
+        return (start - timedelta(days=start.weekday())).isoformat()
+    return day
+
+
+def parse_group_by(value: Optional[str]) -> List[str]:
+    """
+    Read a comma-separated group_by parameter, e.g. 'month,file_type'
+
+    Raises:
+        ValueError: For unknown keys or more than one period
+    """
+    keys = [key.strip() for key in (value or 'day').split(',') if key.strip()]
+    unknown = [key for key in keys if key not in GROUP_KEYS]
+    if unknown:
+        raise ValueError(f"group_by must be made of: {', '.join(GROUP_KEYS)}")
+    if sum(key in PERIODS for key in keys) > 1:
+        raise ValueError("group_by can hold only one of: " + ', '.join(PERIODS))
+    return list(dict.fromkeys(keys))
+
+
+def _describe(bucket: Dict) -> Dict:
+    described = {name: bucket.get(name, 0) for name in COUNTERS}
+    for name in NUMERIC_FIELDS:
+        count = bucket.get(f"{name}_count", 0)
+        described[name] = {
+            'count': count,
+            'sum': round(bucket.get(f"{name}_sum", 0.0), 2),
+            'min': bucket.get(f"{name}_min"),
+            'max': bucket.get(f"{name}_max"),
+            'avg': round(bucket[f"{name}_sum"] / count, 2) if count else None,
+        }
+    return described
+
+
+def summarize(rows: Iterable[Dict], group_by: List[str]) -> Dict:
+    """
+    Roll day buckets up into the requested groups
+
+    Args:
+        rows: Day buckets (dicts keyed by STATS_COLUMNS)
+        group_by: Output of parse_group_by
+
+    Returns:
+        {'group_by': [...], 'buckets': [{'period'?, 'file_type'?, counters...}], 'totals': {...}}
+    """
+    period = next((key for key in group_by if key in PERIODS), None)
+    buckets: Dict[Tuple, Dict] = {}
+    totals: Dict = {}
+    for row in rows:
+        key = (period_key(row['day'], period) if period else None,
+               row['file_type'] if 'file_type' in group_by else None)
+        merge_row(buckets.setdefault(key, {}), row)
+        merge_row(totals, row)
+
+    items = []
+    for (period_value, file_type), bucket in sorted(buckets.items(), key=lambda item: (item[0][0] or '', item[0][1] or '')):
+        item = {}
+        if period:
+            item['period'] = period_value
+        if 'file_type' in group_by:
+            item['file_type'] = file_type
+        item.update(_describe(bucket))
+        items.append(item)
+    return {'group_by': group_by, 'buckets': items, 'totals': _describe(totals)}
+
+
+def day_bounds(filters: Optional[Dict]) -> Tuple[Optional[str], Optional[str]]:
+    """The first and last day covered by since/until filters (whole days)"""
+    filters = filters or {}
+    since, until = filters.get('since'), filters.get('until')
+    return (since[:10] if since else None), (until[:10] if until else None)
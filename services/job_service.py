@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Optional
+
+from services.extract_service import extract_document
+from services.history_service import save_history
+from services.upload_service import Upload
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity"""
+
+class JobManager:
+    """
+    Runs extraction jobs on a local worker pool
+
+    At most `workers` jobs run at once and at most `queue_size` more wait for
+    a worker; submitting beyond that raises QueueFullError so callers can
+    push back instead of piling OCR work onto the host. Finished jobs are
+    kept for `retention` seconds so clients can collect their results.
+    """
+
+    def __init__(self, workers: int = 2, queue_size: int = 16, retention: int = 3600):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='extract-job')
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, file_content, filename: str, policy=None) -> Dict:
+        """
+        Queue a document for extraction
+
+        Args:
+            file_content: File bytes, or an Upload; spooled uploads are kept
+                on disk (detached from the request) until the job has run
+            filename: Original filename
+            policy: Optional ExtractionPolicy the job extracts with
+
+        Raises:
+            QueueFullError: If workers and queue are all taken
+        """
+        if not self._slots.acquire(blocking=False):
+            raise QueueFullError("Extraction queue is full, retry later")
+        if isinstance(file_content, Upload):
+            file_content = file_content.detach()
+
+        job = {
+            'id': uuid.uuid4().hex,
+            'status': 'queued',
+            'file': filename,
+            'progress': {'pages_done': 0, 'pages_total': None},
+            'created_at': datetime.now().isoformat(),
+            'started_at': None,
+            'finished_at': None,
+            'result': None,
+            'error': None,
+            '_expires': None,
+        }
+        with self._lock:
+            self._purge_expired()
+            self._jobs[job['id']] = job
+        try:
+            self._executor.submit(self._run, job, file_content, policy)
+        except Exception:
+            if isinstance(file_content, Upload):
+                file_content.close()
+            self._slots.release()
+            with self._lock:
+                del self._jobs[job['id']]
+            raise
+        return self._public(job)
+
+    def _run(self, job: Dict, file_content, policy=None):
+        def progress(done, total):
+            job['progress'] = {'pages_done': done, 'pages_total': total}
+
+        job['status'] = 'running'
+        job['started_at'] = datetime.now().isoformat()
+        try:
+            result = extract_document(file_content, job['file'], progress=progress, policy=policy)
+            save_history(job['file'], result)
+            job['result'] = result
+            job['status'] = 'completed'
+        except Exception as e:
+            job['error'] = str(e)
+            job['status'] = 'failed'
+        finally:
+            job['finished_at'] = datetime.now().isoformat()
+            job['_expires'] = time.monotonic() + self.retention
+            if isinstance(file_content, Upload):
+                file_content.close()
+            self._slots.release()
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job['_expires'] is not None and job['_expires'] < now]:
+            del self._jobs[job_id]
+
+    @staticmethod
+    def _public(job: Dict) -> Dict:
+        return {key: value for key, value in job.items() if not key.startswith('_')}
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Current state of a job, or None if unknown or expired"""
+        with self._lock:
+            self._purge_expired()
+            job = self._jobs.get(job_id)
+        return self._public(job) if job else None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+        return {'workers': self.workers, 'queue_size': self.queue_size, 'jobs': counts}
+
+    def shutdown(self, wait: bool = True):
+        """Stop accepting jobs and, if wait, let queued and running ones finish"""
+        self._executor.shutdown(wait=wait)
+
+def get_job_manager():
+    """Singleton pattern to get the JobManager instance"""
+    if not hasattr(get_job_manager, "instance"):
+        get_job_manager.instance = JobManager(
+            workers=int(os.getenv('EXTRACT_JOB_WORKERS', 2)),
+            queue_size=int(os.getenv('EXTRACT_JOB_QUEUE_SIZE', 16)),
+            retention=int(os.getenv('EXTRACT_JOB_RETENTION', 3600)),
+        )
+    return get_job_manager.instance
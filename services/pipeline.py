@@ -0,0 +1,374 @@
+import os
+import tempfile
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+from services.extract_service import (
+    IMAGE_EXTENSIONS, OCR_DPI, OCR_WORKERS, PDF_OCR_ENABLED, PDF_PARALLEL_MIN_PAGES, PDF_WORKERS,
+    extract_fields, get_ocr_pool, get_pdf_pool, ocr_image
+)
+from services.upload_service import UPLOAD_TMP_DIR, open_image, open_pdf, pdf_source
+from utils.extraction_policy import ExtractionPolicy
+from utils.image_preprocess import get_image_preprocessor
+from utils.layout_fields import get_layout_extractor
+from utils.metrics import get_metrics
+
+# A page stage takes the page being built and the document context and
+# returns the (usually same, updated) page. document['policy'] is the
+# PolicyRun of the request's extraction policy, or None.
+Stage = Callable[[Dict, Dict], Dict]
+
+def _skip(page: Dict, what: str):
+    """Note on a page what the extraction policy left out"""
+    page.setdefault('skipped', []).append(what)
+
+def preprocess_stage(page: Dict, document: Dict) -> Dict:
+    """Grayscale, downscale and optionally deskew/binarize/crop images before OCR"""
+    preprocessor = get_image_preprocessor()
+    if preprocessor is not None and page.get('image') is not None:
+        # Scans were rendered at OCR_DPI on purpose; only uploaded images are scaled down
+        page['image'] = preprocessor.process(page['image'], downscale=document['extension'] != 'pdf')
+    return page
+
+def ocr_stage(page: Dict, document: Dict) -> Dict:
+    """Recognise text on pages that were loaded as images"""
+    img = page.pop('image', None)
+    if img is not None:
+        run = document.get('policy')
+        # Decided again here: the page may have waited while the budget ran out
+        reason = run.ocr_skip_reason(page['page']) if run is not None else None
+        if reason:
+            _skip(page, reason)
+            return page
+        started = time.perf_counter()
+        try:
+            page['text'] = ocr_image(img)
+        except Exception as e:
+            if document['extension'] != 'pdf':
+                raise
+            # Keep the rest of the document; the page just comes back empty
+            page['text'] = ''
+            page['error'] = f"OCR failed: {str(e)}"
+        finally:
+            if run is not None:
+                run.add_ocr_time(time.perf_counter() - started)
+    return page
+
+def fields_stage(page: Dict, document: Dict) -> Dict:
+    """Guess fields from the page text, on the pages the extraction policy searches"""
+    run = document.get('policy')
+    if run is None:
+        page['fields'] = extract_fields(page['text'])
+    elif run.wants_fields(page['page']):
+        page['_confidence'] = {}
+        page['fields'] = extract_fields(page['text'], page['_confidence'])
+    else:
+        page['fields'] = {}
+        _skip(page, 'fields')
+    return page
+
+def layout_stage(page: Dict, document: Dict) -> Dict:
+    """
+    Read labelled fields from word positions, on pages with a text layer
+
+    Values found next to (or under) their label replace the regex guesses and
+    are reported with bounding boxes in 'layout_fields'.
+    """
+    words = page.pop('words', None)
+    extractor = get_layout_extractor()
+    if words and extractor is not None and 'fields' not in page.get('skipped', ()):
+        layout = extractor.extract(words)
+        if layout:
+            page['fields'] = {**page.get('fields', {}), **{name: entry['value'] for name, entry in layout.items()}}
+            page['layout_fields'] = layout
+            if '_confidence' in page:
+                page['_confidence'].update(dict.fromkeys(layout, 'label'))
+    return page
+
+def _elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 2)
+
+DEFAULT_STAGES = [('preprocess', preprocess_stage), ('ocr', ocr_stage), ('fields', fields_stage),
+                  ('layout', layout_stage)]
+
+def _needs_ocr(pdf_page, text):
+    """A page with images but no text layer is a scan"""
+    return PDF_OCR_ENABLED and not text.strip() and bool(pdf_page.get_images())
+
+def _rasterize(pdf_page, dpi):
+    """Render a PDF page to a grayscale PIL image, tagged with its resolution for OCR"""
+    pix = pdf_page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+    img = Image.frombytes('L', (pix.width, pix.height), pix.samples)
+    img.info['dpi'] = (dpi, dpi)
+    return img
+
+def load_pdf_pages(doc, start: int, stop: int, run=None) -> Iterator[Dict]:
+    """
+    Load stage for PDFs: yield pages [start, stop) of an open document
+
+    Pages with a text layer carry their text, and their words with positions
+    for the layout stage; scans are rendered at OCR_DPI and carry the image
+    for the OCR stage. Pages are loaded lazily, so only the pages currently
+    in the pipeline are held in memory, and the PolicyRun run (if any) is
+    asked about each page when it is reached: deferred pages are not parsed,
+    scans it won't OCR are not rendered.
+    """
+    with_words = get_layout_extractor() is not None
+    for page_num in range(start, stop):
+        started = time.perf_counter()
+        if run is not None and not run.wants_text(page_num + 1):
+            yield {'page': page_num + 1, 'text': '', 'source': 'deferred', 'skipped': ['text'],
+                   '_started': started, 'timings': {'load_ms': _elapsed_ms(started)}}
+            continue
+        pdf_page = doc[page_num]
+        # Text and words come from one parse of the page
+        textpage = pdf_page.get_textpage()
+        text = pdf_page.get_text(textpage=textpage)
+        page = {'page': page_num + 1, 'text': text, 'source': 'text', '_started': started}
+        if _needs_ocr(pdf_page, text):
+            reason = run.ocr_skip_reason(page_num + 1) if run is not None else None
+            page.update(text='', source='ocr')
+            if reason:
+                _skip(page, reason)
+            else:
+                page['image'] = _rasterize(pdf_page, OCR_DPI)
+        elif with_words and text.strip() and (run is None or run.wants_fields(page_num + 1)):
+            page['words'] = pdf_page.get_text('words', textpage=textpage)
+        page['timings'] = {'load_ms': _elapsed_ms(started)}
+        yield page
+
+def load_image_pages(file_content) -> Iterator[Dict]:
+    """Load stage for images: a single page carrying the decoded image"""
+    started = time.perf_counter()
+    img = open_image(file_content)
+    yield {'page': 1, 'text': '', 'source': 'ocr', 'image': img, '_started': started,
+           'timings': {'load_ms': _elapsed_ms(started)}}
+
+class ExtractionPipeline:
+    """
+    Staged, streaming extraction of a document from in-memory bytes
+
+    load -> preprocess -> ocr -> fields -> layout -> custom stages
+
+    The load stage opens the document and yields pages one by one; every
+    page then runs through the page stages in order and is emitted as soon
+    as it is done, in page order. Pages that need OCR run their stages on
+    the OCR thread pool while later pages keep loading, with a bounded number
+    in flight. Large PDFs are split into page ranges that run the same
+    stages in worker processes.
+    """
+
+    def __init__(self, stages: Optional[List[Tuple[str, Stage]]] = None):
+        self.stages = list(DEFAULT_STAGES if stages is None else stages)
+
+    def add_stage(self, name: str, stage: Stage, before: Optional[str] = None, after: Optional[str] = None):
+        """
+        Add a page stage, at the end unless before/after name an existing stage
+
+        Raises:
+            ValueError: If the name is taken or the anchor stage does not exist
+        """
+        names = [existing for existing, _ in self.stages]
+        if name in names:
+            raise ValueError(f"Stage already exists: {name}")
+        index = len(self.stages)
+        anchor = before or after
+        if anchor is not None:
+            if anchor not in names:
+                raise ValueError(f"Unknown stage: {anchor}")
+            index = names.index(anchor) + (1 if after else 0)
+        self.stages.insert(index, (name, stage))
+
+    def remove_stage(self, name: str):
+        self.stages = [(existing, stage) for existing, stage in self.stages if existing != name]
+
+    def process_page(self, page: Dict, document: Dict) -> Dict:
+        """Run every page stage on a loaded page, timing each, and shape the output"""
+        timings = page.pop('timings', {})
+        for name, stage in self.stages:
+            started = time.perf_counter()
+            page = stage(page, document)
+            timings[f'{name}_ms'] = _elapsed_ms(started)
+
+        confidence = page.pop('_confidence', None)
+        if confidence is not None:
+            document['policy'].record(page.get('fields', {}), confidence)
+        started = page.pop('_started')
+        page.pop('image', None)
+        page.pop('words', None)
+        output = {key: page.pop(key) for key in ('page', 'text', 'fields', 'source') if key in page}
+        output['elapsed_ms'] = _elapsed_ms(started)
+        output.update(page)
+        output['timings'] = timings
+        return output
+
+    def run_pages(self, pages: Iterable[Dict], document: Dict, pool=None) -> Iterator[Dict]:
+        """
+        Push loaded pages through the stages, yielding results in page order
+
+        Pages carrying an image are processed on pool when one is given;
+        everything else is processed inline.
+        """
+        pending = deque()
+
+        def in_flight():
+            return sum(isinstance(item, Future) for item in pending)
+
+        for page in pages:
+            if pool is not None and 'image' in page:
+                # Cap rendered pages waiting for OCR to bound memory
+                while in_flight() >= OCR_WORKERS * 2:
+                    yield _resolve(pending.popleft())
+                pending.append(pool.submit(self.process_page, page, document))
+            else:
+                pending.append(self.process_page(page, document))
+            while pending and not (isinstance(pending[0], Future) and not pending[0].done()):
+                yield _resolve(pending.popleft())
+
+        while pending:
+            yield _resolve(pending.popleft())
+
+    def run(self, file_content, file_extension: str,
+            progress: Optional[Callable[[int, int], None]] = None,
+            policy: Optional[ExtractionPolicy] = None) -> Iterator[Dict]:
+        """
+        Extract a document, yielding finished pages in order
+
+        Args:
+            file_content: File bytes, or an Upload (spooled uploads are read from disk)
+            file_extension: Lower-case extension selecting the loader
+            progress: Optional callback(pages_done, total_pages)
+            policy: Optional ExtractionPolicy limiting field extraction and OCR;
+                what it skipped is listed in each page's 'skipped'
+
+        Raises:
+            ValueError: If the file type is not supported
+        """
+        if file_extension == 'pdf':
+            pages = self._run_pdf(file_content, policy)
+            page_count = next(pages)
+        elif file_extension in IMAGE_EXTENSIONS:
+            document = {'extension': file_extension, 'page_count': 1,
+                        'policy': policy.start(1) if policy is not None else None}
+            pages, page_count = self.run_pages(load_image_pages(file_content), document), 1
+        else:
+            raise ValueError("Unsupported file type")
+
+        metrics = get_metrics()
+        for done, page in enumerate(pages, 1):
+            _observe(metrics, page)
+            if progress:
+                progress(done, page_count)
+            yield page
+
+    def _run_pdf(self, file_content, policy=None):
+        """
+        Yield the page count of a PDF, then its finished pages
+
+        The document is opened on the first next() and closed when the
+        generator finishes or is closed, so a run that is never iterated
+        (or abandoned) doesn't leave it open.
+        """
+        doc = open_pdf(file_content)
+        try:
+            page_count = doc.page_count
+            # A policy's early exit and OCR budget are shared by all pages, so
+            # those documents stay in this process; its page window leaves
+            # little work to spread anyway
+            if policy is None and PDF_WORKERS > 1 and page_count >= PDF_PARALLEL_MIN_PAGES:
+                doc.close()
+                yield page_count
+                yield from _run_pdf_parallel(pdf_source(file_content), page_count, self.stages)
+                return
+
+            yield page_count
+            run = policy.start(page_count) if policy is not None else None
+            document = {'extension': 'pdf', 'page_count': page_count, 'policy': run}
+            yield from self.run_pages(load_pdf_pages(doc, 0, page_count, run), document, get_ocr_pool())
+        finally:
+            if not doc.is_closed:
+                doc.close()
+
+def _observe(metrics, page: Dict):
+    """Record a finished page in the metrics; pages from worker processes are counted here too"""
+    metrics.get('extract_pages_total').inc(source=page.get('source', ''))
+    for key, ms in page.get('timings', {}).items():
+        metrics.get('extract_stage_seconds').observe(ms / 1000.0, stage=key[:-len('_ms')],
+                                                     source=page.get('source', ''))
+    if page.get('source') == 'ocr':
+        metrics.get('extract_ocr_seconds_total').inc(page['timings'].get('ocr_ms', 0) / 1000.0)
+
+def _resolve(item):
+    return item.result() if isinstance(item, Future) else item
+
+# The document a pool worker last opened, as (key, document), kept open for
+# the following ranges of the same document
+_worker_doc = None
+
+def _worker_document(key: str, source):
+    global _worker_doc
+    if _worker_doc is None or _worker_doc[0] != key:
+        if _worker_doc is not None:
+            _worker_doc[1].close()
+        _worker_doc = None
+        _worker_doc = (key, open_pdf(source))
+    return _worker_doc[1]
+
+def _run_pdf_range_in_worker(key: str, source, stages: List[Tuple[str, Stage]], page_range: Tuple[int, int]):
+    doc = _worker_document(key, source)
+    document = {'extension': 'pdf', 'page_count': doc.page_count}
+    return list(ExtractionPipeline(stages).run_pages(load_pdf_pages(doc, *page_range), document))
+
+def _run_pdf_parallel(source, page_count: int, stages: List[Tuple[str, Stage]]) -> Iterator[Dict]:
+    """
+    Spread page ranges of a large PDF over the shared PDF process pool
+
+    Every task carries the path of the document and the stages of the
+    calling pipeline, which must be module-level functions so they can be
+    sent to the workers. Documents given as bytes are written to one temp
+    file first, rather than pickled into every task, and it is removed once
+    all ranges are done. A worker keeps the document it opened for the next
+    range of it. Ranges come back, and are yielded, in page order.
+    """
+    # A few ranges per worker keeps them busy when some pages are much heavier
+    chunk_size = max(1, -(-page_count // (PDF_WORKERS * 4)))
+    key = uuid.uuid4().hex
+    pool = get_pdf_pool()
+    spilled = None
+    futures = []
+    try:
+        if not isinstance(source, str):
+            with tempfile.NamedTemporaryFile('wb', suffix='.pdf', dir=UPLOAD_TMP_DIR, delete=False) as f:
+                spilled = f.name
+                f.write(source)
+            source = spilled
+        for start in range(0, page_count, chunk_size):
+            futures.append(pool.submit(_run_pdf_range_in_worker, key, source, stages,
+                                       (start, min(start + chunk_size, page_count))))
+        for future in futures:
+            yield from future.result()
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); start a new pool next time
+        if getattr(get_pdf_pool, "instance", None) is pool:
+            del get_pdf_pool.instance
+        raise
+    finally:
+        for future in futures:
+            future.cancel()
+        if spilled:
+            # Ranges already running may still be opening the file
+            wait(futures)
+            os.remove(spilled)
+
+def get_pipeline():
+    """Singleton pattern to get the shared ExtractionPipeline; add stages to it to extend extraction"""
+    if not hasattr(get_pipeline, "instance"):
+        get_pipeline.instance = ExtractionPipeline()
+    return get_pipeline.instance
@@ -0,0 +1,258 @@
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from io import BytesIO
+from typing import Dict, Optional, Union
+
+from flask import Request
+from werkzeug.utils import secure_filename
+
+# Uploads up to this size stay in memory; larger ones are written straight to a temp file
+UPLOAD_SPOOL_BYTES = int(os.getenv('UPLOAD_SPOOL_BYTES', 8 * 1024 * 1024))
+UPLOAD_TMP_DIR = os.getenv('UPLOAD_TMP_DIR') or None
+# Largest accepted request body (Flask's MAX_CONTENT_LENGTH)
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', 100 * 1024 * 1024))
+
+# Copies of uploads kept in the upload folder: on/off and retention limits (0 = no limit)
+UPLOAD_KEEP_COPIES = os.getenv('UPLOAD_KEEP_COPIES', 'false').lower() in ('1', 'true', 'yes')
+UPLOAD_RETENTION_SECONDS = int(os.getenv('UPLOAD_RETENTION_SECONDS', 7 * 24 * 3600))
+UPLOAD_MAX_FILES = int(os.getenv('UPLOAD_MAX_FILES', 1000))
+UPLOAD_MAX_TOTAL_BYTES = int(os.getenv('UPLOAD_MAX_TOTAL_BYTES', 1024 * 1024 * 1024))
+UPLOAD_CLEANUP_INTERVAL = int(os.getenv('UPLOAD_CLEANUP_INTERVAL', 60))
+
+# Files in the upload folder that retention applies to: copies saved by
+# save_upload_copy, and temp_* leftovers of the old save-then-rename flow.
+# Anything else there (e.g. the bundled samples) is never touched.
+MANAGED_UPLOAD = re.compile(r'^(?:\d{10}-[0-9a-f]{8}-.+|temp_.+)$')
+
+class Upload:
+    """
+    An uploaded document: bytes in memory, or a file on disk
+
+    Large uploads are never read into memory as a whole: PDFs are opened by
+    path (MuPDF reads the pages it needs from the file) and everything else
+    (hashing, Pillow) goes through a read-only memory map of the file.
+    Upload is accepted wherever extraction takes the file content; len() is
+    its size in bytes.
+    """
+
+    def __init__(self, filename: str, content: Optional[bytes] = None, path: Optional[str] = None,
+                 owned: bool = False):
+        """
+        Args:
+            filename: Original filename
+            content: File bytes, for in-memory uploads
+            path: File holding the upload, for spooled ones
+            owned: Delete the file on close (otherwise its creator does)
+        """
+        self.filename = filename
+        self.content = content
+        self.path = path
+        self.owned = owned
+        self.size = len(content) if content is not None else os.path.getsize(path)
+        self._file = None
+        self._map = None
+
+    @classmethod
+    def from_path(cls, path: str, filename: Optional[str] = None):
+        return cls(filename or os.path.basename(path), path=path)
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def extension(self) -> str:
+        return self.filename.lower().split('.')[-1]
+
+    def buffer(self) -> Union[bytes, mmap.mmap]:
+        """The content as a bytes-like object, memory-mapped for spooled uploads"""
+        if self.content is not None:
+            return self.content
+        if self._map is None:
+            if self.size == 0:
+                return b''
+            self._file = open(self.path, 'rb')
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def read(self) -> bytes:
+        """A copy of the whole content; only for callers that need real bytes"""
+        return self.content if self.content is not None else bytes(self.buffer())
+
+    def detach(self) -> 'Upload':
+        """
+        An Upload that outlives the request the upload came in
+
+        Spooled files belong to the request and are deleted with it; the
+        detached copy is a hard link to the same data where the filesystem
+        allows it (a real copy otherwise) and is deleted when closed.
+        """
+        if self.path is None or self.owned:
+            return self
+        path = os.path.join(os.path.dirname(self.path), f"upload-{uuid.uuid4().hex}")
+        try:
+            os.link(self.path, path)
+        except OSError:
+            shutil.copyfile(self.path, path)
+        return Upload(self.filename, path=path, owned=True)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = self._file = None
+        if self.owned and self.path:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def open_upload(file) -> Upload:
+    """
+    Wrap a werkzeug FileStorage without copying spooled uploads
+
+    Uploads that UploadRequest spooled to disk are used from their temp file;
+    small ones are taken from memory.
+    """
+    stream = file.stream
+    path = getattr(stream, 'name', None)
+    if isinstance(path, str) and os.path.isfile(path):
+        stream.flush()
+        return Upload(file.filename, path=path)
+    stream.seek(0)
+    return Upload(file.filename, content=stream.read())
+
+def as_buffer(source) -> Union[bytes, mmap.mmap]:
+    """Bytes-like view of file content given as bytes or an Upload"""
+    return source.buffer() if isinstance(source, Upload) else source
+
+def pdf_source(source) -> Union[bytes, str]:
+    """What to hand to another process to open the PDF: its path when spooled, else its bytes"""
+    if isinstance(source, Upload):
+        return source.path or source.content
+    return source
+
+def open_pdf(source) -> 'fitz.Document':
+    """Open a PDF from bytes, an Upload or a path (see pdf_source)"""
+    # PyMuPDF and Pillow are imported on first use, so serving other endpoints never loads them
+    import fitz  # PyMuPDF
+
+    source = pdf_source(source)
+    if isinstance(source, str):
+        return fitz.open(source, filetype='pdf')
+    return fitz.open(stream=source, filetype='pdf')
+
+def open_image(source) -> 'Image.Image':
+    """Open an image from bytes or an Upload, from its memory map when spooled"""
+    from PIL import Image
+
+    if isinstance(source, Upload) and source.content is None:
+        return Image.open(source.buffer())
+    return Image.open(BytesIO(as_buffer(source)))
+
+class UploadRequest(Request):
+    """
+    Request that writes large file uploads straight to named temp files
+
+    Werkzeug's default keeps parts in an anonymous spooled file that then
+    has to be read back into memory. Here bodies up to UPLOAD_SPOOL_BYTES
+    stay in memory and larger ones go to a named temp file (deleted with
+    the request), which open_upload hands on by path. The body size limit
+    is Flask's MAX_CONTENT_LENGTH, set to MAX_UPLOAD_BYTES by the app.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if os.name == 'nt':
+            # Windows can't reopen a NamedTemporaryFile by name while it is open
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        if total_content_length is not None and total_content_length <= UPLOAD_SPOOL_BYTES:
+            return BytesIO()
+        return tempfile.NamedTemporaryFile('w+b', prefix='upload-', dir=UPLOAD_TMP_DIR)
+
+_last_cleanup = {'at': 0.0}
+_cleanup_lock = threading.Lock()
+
+def cleanup_uploads(folder: str, max_age: int = UPLOAD_RETENTION_SECONDS, max_files: int = UPLOAD_MAX_FILES,
+                    max_bytes: int = UPLOAD_MAX_TOTAL_BYTES) -> Dict:
+    """
+    Apply the retention policy to saved upload copies
+
+    Copies older than max_age seconds are removed, then the oldest ones
+    until at most max_files copies totalling max_bytes remain. Only files
+    matching MANAGED_UPLOAD are considered. A limit of 0 disables it.
+
+    Returns:
+        {'removed': count, 'freed_bytes': bytes, 'kept': count}
+    """
+    entries = []
+    if os.path.isdir(folder):
+        with os.scandir(folder) as scan:
+            for entry in scan:
+                if entry.is_file() and MANAGED_UPLOAD.match(entry.name):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+    entries.sort()
+
+    now = time.time()
+    total = sum(size for _, size, _ in entries)
+    removed = freed = 0
+    for index, (mtime, size, path) in enumerate(entries):
+        remaining = len(entries) - index
+        expired = max_age and now - mtime > max_age
+        if not (expired or (max_files and remaining > max_files) or (max_bytes and total > max_bytes)):
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+        freed += size
+    return {'removed': removed, 'freed_bytes': freed, 'kept': len(entries) - removed}
+
+def maybe_cleanup_uploads(folder: str):
+    """Run cleanup_uploads at most every UPLOAD_CLEANUP_INTERVAL seconds"""
+    with _cleanup_lock:
+        if time.monotonic() - _last_cleanup['at'] < UPLOAD_CLEANUP_INTERVAL:
+            return
+        _last_cleanup['at'] = time.monotonic()
+    try:
+        cleanup_uploads(folder)
+    except OSError as e:
+        print(f"Warning: Failed to clean up uploads: {str(e)}")
+
+def save_upload_copy(upload: Upload, folder: str) -> str:
+    """
+    Keep a copy of an upload in folder, subject to the retention policy
+
+    Spooled uploads are hard-linked (or copied file to file), never read
+    into memory.
+
+    Returns:
+        Path of the saved copy
+    """
+    os.makedirs(folder, exist_ok=True)
+    name = f"{int(time.time())}-{uuid.uuid4().hex[:8]}-{secure_filename(upload.filename) or 'upload'}"
+    path = os.path.join(folder, name)
+    if upload.content is not None:
+        with open(path, 'wb') as f:
+            f.write(upload.content)
+    else:
+        try:
+            os.link(upload.path, path)
+        except OSError:
+            shutil.copyfile(upload.path, path)
+    maybe_cleanup_uploads(folder)
+    return path
@@ -1,6 +1,9 @@
 from functools import wraps
 from flask import request, jsonify
 import os
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 import jwt
 from dotenv import load_dotenv
@@ -8,28 +11,153 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
+ALGORITHM = 'HS256'
+DEFAULT_KID = 'default'
+
+class AuthConfig:
+    """
+    Signing keys and token settings, read from the environment once
+
+    JWT_KEYS holds every key that is still accepted, as comma-separated
+    kid:secret pairs; JWT_ACTIVE_KID picks the one new tokens are signed
+    with (the first one by default). A lone JWT_SECRET is the key 'default'.
+    Rotating keys is: add the new key, make it active, and drop the old one
+    once its tokens have expired.
+    """
+
+    def __init__(self, keys, active_kid, token_ttl=86400, cache_size=1024, cache_ttl=300):
+        self.keys = dict(keys)
+        self.active_kid = active_kid
+        self.token_ttl = token_ttl
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+
+    @classmethod
+    def from_env(cls):
+        keys = {}
+        for pair in os.getenv('JWT_KEYS', '').split(','):
+            kid, _, secret = pair.strip().partition(':')
+            if kid and secret:
+                keys[kid] = secret
+        if os.getenv('JWT_SECRET'):
+            keys.setdefault(DEFAULT_KID, os.getenv('JWT_SECRET'))
+
+        active_kid = os.getenv('JWT_ACTIVE_KID') or next(iter(keys), None)
+        if active_kid is not None and active_kid not in keys:
+            raise ValueError(f"JWT_ACTIVE_KID {active_kid} is not in JWT_KEYS")
+        return cls(
+            keys,
+            active_kid,
+            token_ttl=int(os.getenv('JWT_TOKEN_TTL', 86400)),
+            cache_size=int(os.getenv('JWT_CACHE_SIZE', 1024)),
+            cache_ttl=int(os.getenv('JWT_CACHE_TTL', 300)),
+        )
+
+    def require_keys(self):
+        if not self.keys:
+            raise ValueError("JWT_SECRET not found in environment variables")
+
+class TokenCache:
+    """
+    Bounded LRU of recently verified tokens
+
+    An entry is trusted until the earlier of its token's exp and ttl seconds
+    after it was verified, so an expired token is never accepted from cache.
+    """
+
+    def __init__(self, max_items=1024, ttl=300):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> bool:
+        now = time.time()
+        with self._lock:
+            deadline = self._entries.get(token)
+            if deadline is None:
+                return False
+            if deadline <= now:
+                del self._entries[token]
+                return False
+            self._entries.move_to_end(token)
+            return True
+
+    def put(self, token: str, exp=None):
+        if self.max_items <= 0:
+            return
+        deadline = time.time() + self.ttl
+        if exp is not None:
+            deadline = min(deadline, float(exp))
+        with self._lock:
+            self._entries[token] = deadline
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+
+def get_auth_config():
+    """Singleton pattern to get the AuthConfig loaded at startup"""
+    if not hasattr(get_auth_config, "instance"):
+        get_auth_config.instance = AuthConfig.from_env()
+    return get_auth_config.instance
+
+def get_token_cache():
+    """Singleton pattern to get the verified-token cache"""
+    if not hasattr(get_token_cache, "instance"):
+        config = get_auth_config()
+        get_token_cache.instance = TokenCache(config.cache_size, config.cache_ttl)
+    return get_token_cache.instance
+
+def reload_auth_config():
+    """
+    Re-read keys and settings from the environment (and .env) and drop cached tokens
+
+    Call after rotating keys; tokens signed with a removed key stop being
+    accepted immediately.
+    """
+    load_dotenv(override=True)
+    config = AuthConfig.from_env()
+    get_auth_config.instance = config
+    get_token_cache.instance = TokenCache(config.cache_size, config.cache_ttl)
+    return config
+
 def generate_token():
-    """Generate a JWT token with expiration"""
-    secret_key = os.getenv('JWT_SECRET')
-    if not secret_key:
-        raise ValueError("JWT_SECRET not found in environment variables")
-        
+    """Generate a JWT token with expiration, signed with the active key"""
+    config = get_auth_config()
+    config.require_keys()
+
     payload = {
-        'exp': datetime.utcnow() + timedelta(days=1),  # Token expires in 1 day
+        'exp': datetime.utcnow() + timedelta(seconds=config.token_ttl),
         'iat': datetime.utcnow(),
         'sub': 'user'
     }
-    return jwt.encode(payload, secret_key, algorithm='HS256')
+    return jwt.encode(payload, config.keys[config.active_kid], algorithm=ALGORITHM,
+                      headers={'kid': config.active_kid})
 
 def verify_token(token: str) -> bool:
-    """Verify JWT token"""
-    secret_key = os.getenv('JWT_SECRET')
-    if not secret_key:
-        raise ValueError("JWT_SECRET not found in environment variables")
-        
-    try:
-        jwt.decode(token, secret_key, algorithms=['HS256'])
+    """Verify JWT token, answering from the cache of recently verified tokens when possible"""
+    config = get_auth_config()
+    config.require_keys()
+
+    cache = get_token_cache()
+    if cache.get(token):
         return True
+
+    try:
+        kid = jwt.get_unverified_header(token).get('kid')
+        if kid is not None:
+            candidates = [config.keys[kid]] if kid in config.keys else []
+        else:
+            # Tokens issued before keys had ids
+            candidates = list(config.keys.values())
+        for secret in candidates:
+            try:
+                claims = jwt.decode(token, secret, algorithms=[ALGORITHM])
+            except jwt.InvalidSignatureError:
+                continue
+            cache.put(token, claims.get('exp'))
+            return True
+        return False
     except jwt.ExpiredSignatureError:
         return False
     except jwt.InvalidTokenError:
@@ -1,93 +1,102 @@
 import csv
 from datetime import datetime
+from io import StringIO
 import os
-from typing import List, Dict, Union
+from typing import Dict, Iterable, Iterator, List, Union
+
+# Columns every export has, whatever fields were extracted
+BASE_COLUMNS = [
+    'filename', 'processed_at', 'file_type', 'page_count', 'text_length',
+    'invoice_number', 'date', 'total', 'amount', 'vendor', 'description',
+    'page', 'text'
+]
+
+# Flush the streaming buffer once it grows past this many characters
+CHUNK_SIZE = 64 * 1024
+
+def get_field_names(data: Iterable[Dict]) -> List[str]:
+    """Get all unique column names for the given history entries"""
+    field_names = set(BASE_COLUMNS)
+    for item in data:
+        field_names.update(item.get('extracted_fields', {}).keys())
+        for page in item.get('pages', []):
+            field_names.update(page.get('fields', {}).keys())
+    return sorted(field_names)
+
+def iter_rows(item: Dict) -> Iterator[Dict]:
+    """Yield one CSV row per page of a history entry"""
+    # Create base row with file-level information
+    base_row = {
+        'filename': item.get('filename'),
+        'processed_at': item.get('processed_at'),
+        'file_type': item.get('file_type'),
+        'page_count': item.get('page_count'),
+        'text_length': item.get('text_length'),
+        **item.get('extracted_fields', {})
+    }
+
+    # Write a row for each page
+    for page in item.get('pages', []):
+        row = base_row.copy()
+        row.update({
+            'page': page.get('page'),
+            'text': page.get('text', '')[:1000],  # Limit text length to 1000 chars
+            **page.get('fields', {})
+        })
+        yield row
+
+def stream_csv(data: Iterable[Dict], field_names: List[str]) -> Iterator[str]:
+    """
+    Generate CSV output in chunks
+
+    Args:
+        data: History entries, consumed lazily
+        field_names: Header columns (see get_field_names)
+
+    Yields:
+        Chunks of CSV text of roughly CHUNK_SIZE characters
+    """
+    output = StringIO()
+    writer = csv.DictWriter(output, fieldnames=field_names, extrasaction='ignore')
+    writer.writeheader()
+
+    for item in data:
+        for row in iter_rows(item):
+            writer.writerow(row)
+        if output.tell() >= CHUNK_SIZE:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+
+    if output.tell():
+        yield output.getvalue()
 
 def export_to_csv(data: List[Dict], filename: str = None, write_to_file: bool = True) -> Union[str, List[str]]:
     """
     Export extracted data to CSV format
-    
+
     Args:
         data: List of dictionaries containing extracted data
         filename: Optional output filename
-    
+        write_to_file: If False, only compute and return the column names
+
     Returns:
-        Path to the created CSV file
+        Path to the created CSV file, or the column names when write_to_file is False
     """
-    # Get all unique field names from the data
-    field_names = set()
-    # Add all possible fields
-    field_names.update([
-        'filename', 'processed_at', 'file_type', 'page_count', 'text_length',
-        'invoice_number', 'date', 'total', 'amount', 'vendor', 'description',
-        'page', 'text'
-    ])
-    
-    # Add any additional field names from the data
-    for item in data:
-        field_names.update(item.get('extracted_fields', {}).keys())
-        for page in item.get('pages', []):
-            field_names.update(page.get('fields', {}).keys())
-    
-    # Sort field names
-    field_names = sorted(list(field_names))
-    
-    if write_to_file:
-        if not filename:
-            filename = f"extracted_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        
-        # Create exports directory if it doesn't exist
-        os.makedirs('exports', exist_ok=True)
-        
-        # Create CSV file
-        csv_path = os.path.join('exports', filename)
-        with open(csv_path, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=field_names)
-            writer.writeheader()
-            
-            for item in data:
-                # Create base row with file-level information
-                base_row = {
-                    'filename': item.get('filename'),
-                    'processed_at': item.get('processed_at'),
-                    'file_type': item.get('file_type'),
-                    'page_count': item.get('page_count'),
-                    'text_length': item.get('text_length'),
-                    **item.get('extracted_fields', {})
-                }
-                
-                # Write a row for each page
-                for page in item.get('pages', []):
-                    row = base_row.copy()
-                    row.update({
-                        'page': page.get('page'),
-                        'text': page.get('text', '')[:1000],  # Limit text length to 1000 chars
-                        **page.get('fields', {})
-                    })
-                    writer.writerow(row)
-        
-        return csv_path
-    else:
-        output = []
-        for item in data:
-            # Create base row with file-level information
-            base_row = {
-                'filename': item.get('filename'),
-                'processed_at': item.get('processed_at'),
-                'file_type': item.get('file_type'),
-                'page_count': item.get('page_count'),
-                'text_length': item.get('text_length'),
-                **item.get('extracted_fields', {})
-            }
-            
-            # Write a row for each page
-            for page in item.get('pages', []):
-                row = base_row.copy()
-                row.update({
-                    'page': page.get('page'),
-                    'text': page.get('text', '')[:1000],  # Limit text length to 1000 chars
-                    **page.get('fields', {})
-                })
-                writer.writerow(row)
-    
+    field_names = get_field_names(data)
+    if not write_to_file:
+        return field_names
+
+    if not filename:
+        filename = f"extracted_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+
+    # Create exports directory if it doesn't exist
+    os.makedirs('exports', exist_ok=True)
+
+    # Create CSV file
+    csv_path = os.path.join('exports', filename)
+    with open(csv_path, 'w', newline='', encoding='utf-8') as csvfile:
+        for chunk in stream_csv(data, field_names):
+            csvfile.write(chunk)
+
     return csv_path
@@ -0,0 +1,202 @@
+import json
+import math
+import os
+import threading
+from typing import Dict, List, Optional
+
+# How sure the extraction is of a field value, weakest first
+CONFIDENCE_LEVELS = ['pattern', 'keyword', 'label']
+
+# What happens to pages outside the field window (or after an early stop):
+# full text including OCR, text layer only, or nothing until asked for
+SKIPPED_TEXT_MODES = ['full', 'native', 'defer']
+
+POLICY_SETTINGS = ['first_pages', 'last_pages', 'required_fields', 'min_confidence', 'ocr_budget',
+                   'skipped_text']
+
+# Built-in profiles; EXTRACTION_PROFILES_FILE can add to or override them
+DEFAULT_PROFILES = {
+    'default': {},
+    # Invoice fields sit on the first page(s) or in the totals on the last one
+    'invoice': {
+        'first_pages': 2,
+        'last_pages': 1,
+        'required_fields': ['invoice_number', 'date', 'total'],
+        'skipped_text': 'native',
+    },
+}
+
+def _count(value, name: str) -> int:
+    try:
+        count = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a whole number")
+    if count < 0:
+        raise ValueError(f"{name} must not be negative")
+    return count
+
+class ExtractionPolicy:
+    """
+    Which pages of a document are searched for fields, and how much OCR it may use
+
+    With first_pages/last_pages set, only those pages go through the field
+    stages (0 and 0 means every page). With required_fields set, field
+    extraction stops as soon as each of them was found with at least
+    min_confidence. ocr_budget caps the seconds of OCR per document; scans
+    left when it runs out come back without text. skipped_text says what
+    pages not searched for fields still get: 'full' text, 'native' text
+    layer only (no OCR), or nothing at all ('defer').
+
+    The default policy searches every page and changes nothing.
+    """
+
+    def __init__(self, first_pages: int = 0, last_pages: int = 0, required_fields: Optional[List[str]] = None,
+                 min_confidence: str = 'keyword', ocr_budget: float = 0.0, skipped_text: str = 'full',
+                 profile: Optional[str] = None):
+        self.first_pages = _count(first_pages, 'first_pages')
+        self.last_pages = _count(last_pages, 'last_pages')
+        if isinstance(required_fields, str):
+            required_fields = required_fields.split(',')
+        self.required_fields = sorted({field.strip() for field in required_fields or [] if field.strip()})
+        if min_confidence not in CONFIDENCE_LEVELS:
+            raise ValueError(f"min_confidence must be one of: {', '.join(CONFIDENCE_LEVELS)}")
+        self.min_confidence = min_confidence
+        try:
+            self.ocr_budget = float(ocr_budget or 0)
+        except (TypeError, ValueError):
+            raise ValueError("ocr_budget must be a number of seconds")
+        if not math.isfinite(self.ocr_budget):
+            raise ValueError("ocr_budget must be a number of seconds")
+        if self.ocr_budget < 0:
+            raise ValueError("ocr_budget must not be negative")
+        if skipped_text not in SKIPPED_TEXT_MODES:
+            raise ValueError(f"skipped_text must be one of: {', '.join(SKIPPED_TEXT_MODES)}")
+        self.skipped_text = skipped_text
+        self.profile = profile
+
+    @property
+    def is_default(self) -> bool:
+        return not (self.first_pages or self.last_pages or self.required_fields or self.ocr_budget)
+
+    def as_dict(self) -> Dict:
+        settings = {name: getattr(self, name) for name in POLICY_SETTINGS}
+        return {'profile': self.profile, **settings}
+
+    def cache_tag(self) -> str:
+        """Suffix of the extraction version for results of this policy ('' for the default)"""
+        if self.is_default:
+            return ''
+        return '.p' + json.dumps([getattr(self, name) for name in POLICY_SETTINGS], separators=(',', ':'))
+
+    def in_window(self, page_num: int, page_count: int) -> bool:
+        """Whether a page (1-based) is among the first/last pages searched for fields"""
+        if not (self.first_pages or self.last_pages):
+            return True
+        return page_num <= self.first_pages or page_num > page_count - self.last_pages
+
+    def start(self, page_count: int) -> 'PolicyRun':
+        return PolicyRun(self, page_count)
+
+class PolicyRun:
+    """
+    State of a policy over one document: fields found so far and OCR time spent
+
+    Pages are decided on as they are loaded and processed, possibly on
+    several OCR threads at once, so pages already in flight when the
+    required fields turn up or the budget runs out still finish.
+    """
+
+    def __init__(self, policy: ExtractionPolicy, page_count: int):
+        self.policy = policy
+        self.page_count = page_count
+        self.found: Dict[str, str] = {}
+        self.ocr_seconds = 0.0
+        self._min_rank = CONFIDENCE_LEVELS.index(policy.min_confidence)
+        self._lock = threading.Lock()
+
+    @property
+    def fields_done(self) -> bool:
+        return bool(self.policy.required_fields) and all(
+            field in self.found for field in self.policy.required_fields)
+
+    @property
+    def budget_exhausted(self) -> bool:
+        return bool(self.policy.ocr_budget) and self.ocr_seconds >= self.policy.ocr_budget
+
+    def wants_fields(self, page_num: int) -> bool:
+        return self.policy.in_window(page_num, self.page_count) and not self.fields_done
+
+    def wants_text(self, page_num: int) -> bool:
+        return self.policy.skipped_text != 'defer' or self.wants_fields(page_num)
+
+    def ocr_skip_reason(self, page_num: int) -> Optional[str]:
+        """Why a scanned page is not OCR'd ('ocr' by policy, 'ocr_budget'), or None to OCR it"""
+        if not (self.policy.skipped_text == 'full' or self.wants_fields(page_num)):
+            return 'ocr'
+        return 'ocr_budget' if self.budget_exhausted else None
+
+    def add_ocr_time(self, seconds: float):
+        with self._lock:
+            self.ocr_seconds += seconds
+
+    def record(self, fields: Dict, confidence: Dict[str, str]):
+        """Count the fields of a processed page that are as sure as the policy asks"""
+        with self._lock:
+            for field in self.policy.required_fields:
+                level = confidence.get(field, 'pattern')
+                if fields.get(field) and CONFIDENCE_LEVELS.index(level) >= self._min_rank:
+                    self.found.setdefault(field, fields[field])
+
+def load_profiles(path: Optional[str] = None) -> Dict[str, ExtractionPolicy]:
+    """
+    DEFAULT_PROFILES plus those of a JSON file of {name: {setting: value}}
+
+    Raises:
+        ValueError: If a profile has unknown or invalid settings
+    """
+    profiles = dict(DEFAULT_PROFILES)
+    if path:
+        with open(path, 'r') as f:
+            profiles.update(json.load(f))
+    policies = {}
+    for name, settings in profiles.items():
+        unknown = [key for key in settings if key not in POLICY_SETTINGS]
+        if unknown:
+            raise ValueError(f"Unknown setting(s) in extraction profile {name}: {', '.join(unknown)}")
+        policies[name] = ExtractionPolicy(profile=name, **settings)
+    return policies
+
+def get_extraction_profiles() -> Dict[str, ExtractionPolicy]:
+    """Singleton pattern to get the extraction profiles, read from EXTRACTION_PROFILES_FILE"""
+    if not hasattr(get_extraction_profiles, "instance"):
+        path = os.getenv('EXTRACTION_PROFILES_FILE')
+        try:
+            get_extraction_profiles.instance = load_profiles(path)
+        except (OSError, ValueError) as e:
+            print(f"Warning: Failed to load extraction profiles from {path}: {str(e)}")
+            get_extraction_profiles.instance = load_profiles()
+    return get_extraction_profiles.instance
+
+def parse_policy_params(args) -> Optional[ExtractionPolicy]:
+    """
+    Read the extraction policy of a request
+
+    ?profile= picks a profile (EXTRACTION_PROFILE when absent); first_pages,
+    last_pages, required_fields (comma-separated), min_confidence,
+    ocr_budget and skipped_text override its settings.
+
+    Returns:
+        The policy, or None when it is the default one
+
+    Raises:
+        ValueError: For an unknown profile or invalid settings
+    """
+    profiles = get_extraction_profiles()
+    name = args.get('profile') or os.getenv('EXTRACTION_PROFILE', 'default')
+    if name not in profiles:
+        raise ValueError(f"Unknown extraction profile: {name}. Available: {', '.join(sorted(profiles))}")
+    policy = profiles[name]
+    overrides = {key: args.get(key) for key in POLICY_SETTINGS if args.get(key) not in (None, '')}
+    if overrides:
+        policy = ExtractionPolicy(**{**policy.as_dict(), **overrides})
+    return None if policy.is_default else policy
@@ -1,69 +1,97 @@
 import re
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
+import hashlib
 import json
-from pathlib import Path
+import threading
+from utils.pattern_registry import get_pattern_registry
+
+# Built-in patterns; fields customized in the pattern registry replace these
+DEFAULT_PATTERNS = {
+    'invoice_number': [
+        r'invoice\s*#?\s*(\d+)',
+        r'inv\.?\s*#?\s*(\d+)',
+        r'bill\s*#?\s*(\d+)',
+        r'\b\d{4,}\b'  # Generic number pattern
+    ],
+    'date': [
+        r'\b\d{1,2}/\d{1,2}/\d{2,4}\b',
+        r'\b\d{1,2}-\d{1,2}-\d{2,4}\b',
+        r'\b\d{4}-\d{1,2}-\d{1,2}\b',
+        r'\b\d{1,2}\s+[a-z]{3}\s+\d{4}\b',  # e.g., 15 Aug 2025
+        r'\b[a-z]{3}\s+\d{1,2},\s+\d{4}\b'  # e.g., Aug 15, 2025
+    ],
+    'amount': [
+        r'\$?\s*(\d+(?:,\d{3})*(?:\.\d{2})?)',
+        r'PKR\s*(\d+(?:,\d{3})*(?:\.\d{2})?)',
+        r'\b\d+(?:\.\d{2})?\b'  # Generic number pattern
+    ],
+    'email': [
+        r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'
+    ],
+    'phone': [
+        r'\+?\d{1,3}[-.\s]?\(?\d{3}\)?[-.\s]?\d{3}[-.\s]?\d{4}',
+        r'\d{10}'  # Generic 10-digit phone number
+    ]
+}
 
 class FieldGuesser:
     """Class to guess field types using pattern matching"""
     
-    def __init__(self):
-        """Initialize with default patterns"""
-        self.patterns = {
-            'invoice_number': [
-                r'invoice\s*#?\s*(\d+)',
-                r'inv\.?\s*#?\s*(\d+)',
-                r'bill\s*#?\s*(\d+)',
-                r'\b\d{4,}\b'  # Generic number pattern
-            ],
-            'date': [
-                r'\b\d{1,2}/\d{1,2}/\d{2,4}\b',
-                r'\b\d{1,2}-\d{1,2}-\d{2,4}\b',
-                r'\b\d{4}-\d{1,2}-\d{1,2}\b',
-                r'\b\d{1,2}\s+[a-z]{3}\s+\d{4}\b',  # e.g., 15 Aug 2025
-                r'\b[a-z]{3}\s+\d{1,2},\s+\d{4}\b'  # e.g., Aug 15, 2025
-            ],
-            'amount': [
-                r'\$?\s*(\d+(?:,\d{3})*(?:\.\d{2})?)',
-                r'PKR\s*(\d+(?:,\d{3})*(?:\.\d{2})?)',
-                r'\b\d+(?:\.\d{2})?\b'  # Generic number pattern
-            ],
-            'email': [
-                r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'
-            ],
-            'phone': [
-                r'\+?\d{1,3}[-.\s]?\(?\d{3}\)?[-.\s]?\d{3}[-.\s]?\d{4}',
-                r'\d{10}'  # Generic 10-digit phone number
-            ]
-        }
-        
-        # Load custom patterns from file if available
-        self.load_custom_patterns()
+    def __init__(self, custom_patterns: Optional[Dict[str, List[str]]] = None):
+        """
+        Initialize with default patterns
+
+        Args:
+            custom_patterns: Per-field pattern lists replacing the defaults of
+                those fields; read from the pattern registry when omitted
+        """
+        # Registry generation and revision the patterns were taken from
+        self.generation = None
+        self.revision = 0
+        if custom_patterns is None:
+            registry = get_pattern_registry()
+            # Generation first: if the registry changes in between, the
+            # guesser just looks stale and is rebuilt on the next call
+            self.generation, self.revision = registry.generation, registry.revision
+            custom_patterns = registry.patterns
+        self._set_patterns(custom_patterns)
+
+    def _set_patterns(self, custom_patterns: Dict[str, List[str]]):
+        self.patterns = {field_name: list(patterns) for field_name, patterns in DEFAULT_PATTERNS.items()}
+        self.patterns.update(custom_patterns)
+        self.compile_patterns()
+
+    def _update_version(self):
+        """Fingerprint the active pattern set so results can be tied to it"""
+        encoded = json.dumps(self.patterns, sort_keys=True).encode()
+        self.version = hashlib.sha256(encoded).hexdigest()[:12]
+
+    def compile_patterns(self):
+        """
+        Compile every pattern once so matching never goes through the re cache
+
+        Patterns of the same field are deliberately not merged into a single
+        alternation: they overlap by design (e.g. 'invoice 12345' and the
+        generic number pattern both match), and an alternation would only
+        report the first alternative at each position.
+        """
+        self._compiled = [
+            (field_name, [re.compile(pattern, re.IGNORECASE) for pattern in patterns])
+            for field_name, patterns in self.patterns.items()
+        ]
+        self._update_version()
         
-    def load_custom_patterns(self):
-        """Load custom patterns from JSON file"""
-        try:
-            pattern_file = Path('patterns.json')
-            if pattern_file.exists():
-                with open(pattern_file, 'r') as f:
-                    custom_patterns = json.load(f)
-                    self.patterns.update(custom_patterns)
-        except Exception as e:
-            print(f"Warning: Failed to load custom patterns: {str(e)}")
-            
-    def save_custom_patterns(self):
-        """Save custom patterns to JSON file"""
-        try:
-            with open('patterns.json', 'w') as f:
-                json.dump(self.patterns, f, indent=4)
-        except Exception as e:
-            print(f"Warning: Failed to save patterns: {str(e)}")
-            
     def add_custom_pattern(self, field_name: str, pattern: str):
-        """Add a custom pattern for a field"""
-        if field_name not in self.patterns:
-            self.patterns[field_name] = []
-        self.patterns[field_name].append(pattern)
-        self.save_custom_patterns()
+        """
+        Add a custom pattern for a field, through the shared pattern registry
+
+        Raises:
+            ValueError: If the field name or pattern is invalid
+        """
+        registry = get_pattern_registry()
+        registry.add_pattern(field_name, pattern, defaults=DEFAULT_PATTERNS.get(field_name))
+        self.generation, self.revision = registry.generation, registry.revision
+        self._set_patterns(registry.patterns)
         
     def guess_fields(self, text: str) -> Dict[str, List[str]]:
         """
@@ -78,24 +106,63 @@ class FieldGuesser:
         results = {}
         
         # Try each pattern for each field
-        for field_name, patterns in self.patterns.items():
-            matches = []
+        for field_name, patterns in self._compiled:
+            # A dict keeps first-seen order and makes the duplicate check O(1)
+            matches = {}
             for pattern in patterns:
-                # Find all matches in text
-                for match in re.finditer(pattern, text, re.IGNORECASE):
-                    value = match.group(0).strip()
-                    # Clean up the value
-                    value = re.sub(r'[\s,]+', '', value)  # Remove spaces and commas
-                    if value not in matches:
-                        matches.append(value)
+                # Find all matches in text; findall returns whole matches
+                # directly when the pattern has no groups
+                if pattern.groups:
+                    found = [match.group(0) for match in pattern.finditer(text)]
+                else:
+                    found = pattern.findall(text)
+                matches.update(dict.fromkeys(found))
             
             if matches:
-                results[field_name] = matches
+                # Clean up the values: remove whitespace and commas
+                cleaned = dict.fromkeys(''.join(value.split()).replace(',', '') for value in matches)
+                results[field_name] = list(cleaned)
                 
         return results
 
+    def guess_field_matches(self, text: str) -> Dict[str, List[Tuple[str, int, int]]]:
+        """
+        Like guess_fields, but keeping every occurrence with its position
+
+        Args:
+            text: Text to analyze
+
+        Returns:
+            Dictionary of field names and their (cleaned value, start, end)
+            matches, in pattern order; start/end are offsets into text
+        """
+        results = {}
+        for field_name, patterns in self._compiled:
+            found = [
+                (''.join(match.group(0).split()).replace(',', ''), match.start(), match.end())
+                for pattern in patterns
+                for match in pattern.finditer(text)
+            ]
+            if found:
+                results[field_name] = found
+        return results
+
+_rebuild_lock = threading.Lock()
+
 def get_field_guesser():
-    """Singleton pattern to get FieldGuesser instance"""
-    if not hasattr(get_field_guesser, "instance"):
-        get_field_guesser.instance = FieldGuesser()
-    return get_field_guesser.instance
+    """
+    Singleton pattern to get FieldGuesser instance
+
+    The instance is rebuilt when the pattern registry reports a change (made
+    here or by another worker); between registry checks this costs nothing
+    more than a clock read.
+    """
+    registry = get_pattern_registry()
+    registry.refresh()
+    guesser = getattr(get_field_guesser, "instance", None)
+    if guesser is None or guesser.generation != registry.generation:
+        with _rebuild_lock:
+            guesser = getattr(get_field_guesser, "instance", None)
+            if guesser is None or guesser.generation != registry.generation:
+                guesser = get_field_guesser.instance = FieldGuesser()
+    return guesser
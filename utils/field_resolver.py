@@ -0,0 +1,255 @@
+import re
+from bisect import bisect_right
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+# Bump when resolution rules change, so cached results are recomputed
+RESOLVER_VERSION = '1'
+
+AMOUNT_FIELDS = ('amount', 'total')
+NUMERIC_FIELDS = AMOUNT_FIELDS + ('invoice_number',)
+
+# How strongly the nearest keyword before a candidate votes for (or against) it
+FIELD_KEYWORDS = {
+    'amount': {
+        'grand total': 6, 'total due': 6, 'amount due': 6, 'balance due': 6, 'total payment': 6,
+        'total amount': 6, 'amount payable': 6, 'total': 5, 'amount': 3, 'balance': 3, 'due': 2,
+        'sub total': -3, 'subtotal': -3, 'tax': -3, 'vat': -3, 'discount': -3, 'qty': -3,
+        'quantity': -3, 'invoice': -4, 'inv': -4, 'receipt no': -4, 'account': -4, 'phone': -5,
+        'tel': -5, 'fax': -5, 'zip': -4, 'id': -4,
+    },
+    'invoice_number': {
+        'invoice number': 6, 'invoice no': 6, 'invoice id': 6, 'invoice': 5, 'inv': 5,
+        'bill': 3, 'receipt': 3, 'number': 2, 'no': 2, '#': 2,
+        'phone': -5, 'tel': -5, 'fax': -5, 'account': -4, 'zip': -4, 'date': -3, 'total': -3,
+    },
+    'date': {
+        'invoice date': 4, 'issue date': 4, 'date of issue': 4, 'payment date': 4, 'date': 2,
+        'issued': 2, 'due date': -2, 'due': -2, 'birth': -3, 'expiry': -3, 'expires': -3,
+    },
+}
+FIELD_KEYWORDS['total'] = FIELD_KEYWORDS['amount']
+
+CURRENCY_CODES = ('$', '€', '£', '¥', '₹', 'rs', 'rp', 'pkr', 'usd', 'eur', 'gbp', 'inr')
+
+# Characters of context searched for keywords before a candidate
+KEYWORD_WINDOW = 48
+
+def _keyword_regex(keywords) -> re.Pattern:
+    # Longest first so 'grand total' wins over 'total' at the same position
+    alternatives = sorted(keywords, key=len, reverse=True)
+    parts = [re.escape(keyword).replace(r'\ ', r'\s*') for keyword in alternatives]
+    # The lookahead lets the engine skip most positions before trying the
+    # case-insensitive alternation, which is several times faster
+    return re.compile(r'(?<![a-z])(?=[a-z#])(?:' + '|'.join(parts) + r')(?![a-z])', re.IGNORECASE)
+
+KEYWORD_PATTERNS = {field: _keyword_regex(keywords) for field, keywords in FIELD_KEYWORDS.items()}
+_CURRENCY_BEFORE = re.compile(r'(?<![a-z])(?:' + '|'.join(map(re.escape, CURRENCY_CODES)) + r')\s*$', re.IGNORECASE)
+_CURRENCY_AFTER = re.compile(r'^\s*(?:' + '|'.join(map(re.escape, CURRENCY_CODES)) + r')(?![a-z])', re.IGNORECASE)
+
+MONTHS = {name: number for number, names in enumerate([
+    ('jan', 'january'), ('feb', 'february'), ('mar', 'march'), ('apr', 'april'), ('may',),
+    ('jun', 'june'), ('jul', 'july'), ('aug', 'august'), ('sep', 'sept', 'september'),
+    ('oct', 'october'), ('nov', 'november'), ('dec', 'december')
+], 1) for name in names}
+
+_ISO_DATE = re.compile(r'^(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})$')
+_NUMERIC_DATE = re.compile(r'^(\d{1,2})([-/.])(\d{1,2})\2(\d{2}|\d{4})$')
+_DAY_MONTH_YEAR = re.compile(r'^(\d{1,2})\s*([a-z]+)\.?\s*(\d{4})$', re.IGNORECASE)
+_MONTH_DAY_YEAR = re.compile(r'^([a-z]+)\.?\s*(\d{1,2})(?:st|nd|rd|th)?\s*,?\s*(\d{4})$', re.IGNORECASE)
+
+def _full_year(year: int) -> int:
+    """Two-digit years are put within 50 years of today, as dateutil does"""
+    if year >= 100:
+        return year
+    now = datetime.now().year
+    year += now // 100 * 100
+    if year >= now + 50:
+        year -= 100
+    elif year < now - 50:
+        year += 100
+    return year
+
+def _numeric_date(first: int, second: int, year: int) -> Optional[datetime]:
+    # Month first like dateutil, day first when that is the only valid reading
+    for month, day in ((first, second), (second, first)):
+        try:
+            return datetime(year, month, day)
+        except ValueError:
+            continue
+    return None
+
+def _parse_known_format(value: str) -> Optional[datetime]:
+    match = _ISO_DATE.match(value)
+    if match:
+        try:
+            return datetime(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+        except ValueError:
+            return None
+    match = _NUMERIC_DATE.match(value)
+    if match:
+        return _numeric_date(int(match.group(1)), int(match.group(3)), _full_year(int(match.group(4))))
+    match = _DAY_MONTH_YEAR.match(value)
+    if match and match.group(2).lower() in MONTHS:
+        day, month, year = int(match.group(1)), MONTHS[match.group(2).lower()], int(match.group(3))
+    else:
+        match = _MONTH_DAY_YEAR.match(value)
+        if not match or match.group(1).lower() not in MONTHS:
+            return None
+        day, month, year = int(match.group(2)), MONTHS[match.group(1).lower()], int(match.group(3))
+    try:
+        return datetime(year, month, day)
+    except ValueError:
+        return None
+
+@lru_cache(maxsize=4096)
+def parse_date(value: str) -> Optional[datetime]:
+    """
+    Parse a date candidate, trying the formats the date patterns produce first
+
+    Values come cleaned by the field guesser (no whitespace or commas), e.g.
+    '12/08/2011', '2025-08-08', '15Aug2025' or 'Aug152025'. Anything else
+    falls back to dateutil. Results are memoized since the same dates recur
+    across pages and documents.
+
+    Returns:
+        The date, or None if the value is not a date
+    """
+    parsed = _parse_known_format(value)
+    if parsed is not None:
+        return parsed
+    try:
+        from dateutil import parser
+        return parser.parse(value)
+    except (ValueError, OverflowError):
+        return None
+
+def parse_number(value: str) -> Optional[float]:
+    digits = re.sub(r'[^0-9.]', '', value)
+    try:
+        return float(digits)
+    except ValueError:
+        return None
+
+def _value_span(text: str, start: int, end: int) -> Tuple[int, int]:
+    """Narrow a match to its digits, so '$ 12.50' is scored around '12.50'"""
+    while start < end and not text[start].isdigit():
+        start += 1
+    while end > start and not text[end - 1].isdigit():
+        end -= 1
+    return start, end
+
+def keyword_positions(field: str, text: str) -> Tuple[List[int], List[int]]:
+    """End offsets and weights of every keyword of a field in text, in order"""
+    ends, weights = [], []
+    keywords = FIELD_KEYWORDS[field]
+    for match in KEYWORD_PATTERNS[field].finditer(text):
+        keyword = ' '.join(match.group(0).lower().split())
+        ends.append(match.end())
+        weights.append(keywords.get(keyword, keywords.get(keyword.replace(' ', ''), 0)))
+    return ends, weights
+
+def keyword_score(text: str, start: int, positions: Tuple[List[int], List[int]]) -> float:
+    """
+    Vote of the nearest keyword before position start
+
+    The keyword is found by bisecting the keyword_positions of the text, so
+    scoring a candidate does not rescan its surroundings. Keywords on the
+    same line count fully, on the previous line (labels above values, as in
+    many PDF layouts) at 70%; further away not at all.
+    """
+    ends, weights = positions
+    index = bisect_right(ends, start) - 1
+    if index < 0 or start - ends[index] > KEYWORD_WINDOW:
+        return 0.0
+    newlines = text.count('\n', ends[index], start)
+    if newlines == 0:
+        return float(weights[index])
+    return weights[index] * 0.7 if newlines == 1 else 0.0
+
+def amount_shape_score(text: str, start: int, end: int) -> float:
+    """
+    Score how much the text around a number looks like a money amount
+
+    Currency symbols and cents count for it; numbers glued to letters,
+    hyphens, slashes, '+', '#' or '%' (IDs, phone numbers, dates, rates)
+    and fragments of longer numbers count against it.
+    """
+    score = 0.0
+    before = text[max(0, start - 5):start]
+    previous = text[start - 1] if start else ' '
+    glued_to = text[start - 2] if start > 1 else ' '
+    following = text[end] if end < len(text) else ' '
+    next_after = text[end + 1] if end + 1 < len(text) else ' '
+
+    if _CURRENCY_BEFORE.search(before) or _CURRENCY_AFTER.match(text[end:end + 4]):
+        score += 2
+    elif previous.isalpha():
+        score -= 4
+    if end - start > 3 and text[end - 3] == '.':
+        score += 1
+
+    if previous in '+#/' or (previous in '-.' and glued_to.isalnum()):
+        score -= 6
+    elif previous == '-':
+        # A leading minus: a discount or credit rather than the amount due
+        score -= 3
+    if following in '%/' or (following in '-.' and next_after.isdigit()):
+        score -= 6
+    return score
+
+def _best_candidate(field: str, candidates, text: str, value_of):
+    """Highest scoring candidate; ties go to the larger value, like the old max() rule"""
+    positions = keyword_positions(field, text)
+    best = None
+    seen = set()
+    for value, start, end in candidates:
+        span = _value_span(text, start, end)
+        # Overlapping patterns often find the same number; score it once
+        if span in seen:
+            continue
+        seen.add(span)
+        parsed = value_of(value)
+        if parsed is None:
+            continue
+        score = keyword_score(text, span[0], positions)
+        if field in AMOUNT_FIELDS:
+            score += amount_shape_score(text, *span)
+        ranked = (score, parsed, value)
+        if best is None or ranked > best:
+            best = ranked
+    return best
+
+def resolve_fields(matches: Dict[str, List[Tuple[str, int, int]]], text: str,
+                   confidence: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """
+    Pick the most likely value of every field from its candidate matches
+
+    Args:
+        matches: FieldGuesser.guess_field_matches output
+        text: The text the matches were found in
+        confidence: Optional dictionary filled with how each value was chosen:
+            'keyword' when a field keyword votes for it, else 'pattern'
+
+    Returns:
+        Dictionary of field names and chosen values. Numeric fields are
+        returned as float strings, dates as matched, others as their first match.
+    """
+    fields = {}
+    for field_name, candidates in matches.items():
+        if not candidates:
+            continue
+        best = None
+        if field_name in NUMERIC_FIELDS:
+            best = _best_candidate(field_name, candidates, text, parse_number)
+            fields[field_name] = str(best[1]) if best else candidates[0][0]
+        elif field_name == 'date':
+            best = _best_candidate(field_name, candidates, text, parse_date)
+            if best:
+                fields[field_name] = best[2]
+        else:
+            fields[field_name] = candidates[0][0]
+        if confidence is not None and field_name in fields:
+            confidence[field_name] = 'keyword' if best and best[0] > 0 else 'pattern'
+    return fields
@@ -1,14 +1,16 @@
-from PIL import Image
-import pytesseract
+from services.pipeline import ExtractionPipeline, ocr_stage, preprocess_stage
+from services.upload_service import Upload
 
 def extract_text_from_image(image_path):
+    """OCR text of an image, through the OCR stage of the extraction pipeline"""
     try:
-        img = Image.open(image_path)
-        text = pytesseract.image_to_string(img)
-        return [{
-            "page": 1,
-            "text": text.strip()
-        }]
+        pipeline = ExtractionPipeline(stages=[('preprocess', preprocess_stage), ('ocr', ocr_stage)])
+        # Read through a memory map rather than into memory
+        with Upload.from_path(image_path) as upload:
+            return [{
+                "page": page['page'],
+                "text": page['text'].strip()
+            } for page in pipeline.run(upload, upload.extension)]
     except Exception as e:
         print(f"[Image Parser] Error: {e}")
         return []
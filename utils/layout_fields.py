@@ -0,0 +1,269 @@
+import os
+import re
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from utils.field_resolver import parse_date, parse_number
+
+# Bump when the label tables or lookup rules change, so cached results are recomputed
+LAYOUT_VERSION = '1'
+
+# Labels per field, most specific first; the rank of the label that found a
+# value decides between several hits on a page
+FIELD_LABELS = {
+    'invoice_number': [
+        'invoice number', 'invoice no', 'invoice #', 'invoice id', 'receipt number', 'receipt no',
+        'bill number', 'bill no', 'inv no', 'inv #', 'invoice',
+    ],
+    'date': [
+        'invoice date', 'date of issue', 'issue date', 'payment date', 'receipt date', 'bill date', 'date',
+    ],
+    'total': [
+        'grand total', 'total due', 'amount due', 'balance due', 'total amount', 'amount payable',
+        'total payment', 'total',
+    ],
+}
+
+# Phrases that contain a label but mean something else; matching them first
+# keeps e.g. 'Sub Total' from being read as 'Total'
+IGNORED_LABELS = [
+    'sub total', 'subtotal', 'due date', 'date of birth', 'birth date', 'total qty', 'total quantity',
+    'total items', 'total tax', 'total discount',
+]
+
+# Fields filled from the layout value of another field
+FIELD_ALIASES = {'total': ['amount']}
+
+_CURRENCY = r'(?:[$€£¥₹]|rs\.?|rp\.?|pkr|usd|eur|gbp|inr)'
+VALUE_PATTERNS = {
+    'invoice_number': re.compile(r'#?\s*([a-z0-9][a-z0-9\-/_.]*\d[a-z0-9\-/_.]*)', re.IGNORECASE),
+    'date': re.compile(
+        r'(\d{4}[-/.]\d{1,2}[-/.]\d{1,2}|\d{1,2}[-/.]\d{1,2}[-/.]\d{2,4}'
+        r'|\d{1,2}\s+[a-z]{3,9}\.?,?\s+\d{4}|[a-z]{3,9}\.?\s+\d{1,2}(?:st|nd|rd|th)?,?\s+\d{4})',
+        re.IGNORECASE),
+    'total': re.compile(r'(' + _CURRENCY + r'?\s*-?\d[\d,]*(?:\.\d{1,2})?)(?![\d/%])', re.IGNORECASE),
+}
+
+# Words tried after a label when reading its value, e.g. 'Aug 15, 2025'
+MAX_VALUE_WORDS = 4
+
+def _normalize(word: str) -> str:
+    return word.lower().strip(':.')
+
+class Word:
+    """A word of a page and its box, in PDF points"""
+
+    __slots__ = ('x0', 'y0', 'x1', 'y1', 'text', 'cy')
+
+    def __init__(self, x0, y0, x1, y1, text):
+        self.x0, self.y0, self.x1, self.y1, self.text = x0, y0, x1, y1, text
+        self.cy = (y0 + y1) / 2
+
+    @property
+    def height(self) -> float:
+        return self.y1 - self.y0
+
+def _bbox(words: Sequence[Word]) -> List[float]:
+    return [round(min(word.x0 for word in words), 2), round(min(word.y0 for word in words), 2),
+            round(max(word.x1 for word in words), 2), round(max(word.y1 for word in words), 2)]
+
+class LayoutIndex:
+    """
+    Words of a page sorted by vertical centre
+
+    Words on a row, or in a band below a point, are found by bisecting the
+    sorted centres, so a lookup costs O(log n) plus the words it returns
+    instead of a scan of the page.
+    """
+
+    def __init__(self, words: Sequence[Word]):
+        self.words = sorted(words, key=lambda word: (word.cy, word.x0))
+        self.centers = [word.cy for word in self.words]
+
+    def band(self, top: float, bottom: float) -> List[Word]:
+        """Words whose centre lies in [top, bottom]"""
+        return self.words[bisect_left(self.centers, top):bisect_right(self.centers, bottom)]
+
+    def right_of(self, label: Sequence[Word]) -> List[Word]:
+        """Words on the label's row after it, left to right, up to the first wide gap"""
+        last = label[-1]
+        half = max(word.height for word in label) / 2
+        row = sorted((word for word in self.band(last.cy - half, last.cy + half) if word.x0 >= last.x1 - 1),
+                     key=lambda word: word.x0)
+        return _leading_run(row, half * 3)
+
+    def below(self, label: Sequence[Word]) -> List[Word]:
+        """Words of the nearest row under the label that starts within its columns"""
+        height = max(word.height for word in label)
+        left, right = label[0].x0 - height, label[-1].x1 + height
+        bottom = max(word.y1 for word in label)
+        candidates = [word for word in self.band(bottom, bottom + height * 2.5)
+                      if word.y0 >= bottom - height / 4 and left <= word.x0 <= right]
+        if not candidates:
+            return []
+        first = min(candidates, key=lambda word: (word.cy, word.x0))
+        row = sorted((word for word in self.band(first.cy - height / 2, first.cy + height / 2)
+                      if word.x0 >= first.x0), key=lambda word: word.x0)
+        return _leading_run(row, height * 1.5)
+
+def _leading_run(row: List[Word], max_gap: float) -> List[Word]:
+    """The first words of a row that are not separated by a column-sized gap"""
+    run = row[:1]
+    for word in row[1:MAX_VALUE_WORDS]:
+        if word.x0 - run[-1].x1 > max_gap:
+            break
+        run.append(word)
+    return run
+
+class LayoutExtractor:
+    """
+    Finds label -> value pairs from word positions of native-text PDF pages
+
+    Labels ('Invoice No:', 'Total Payment', ...) are located by scanning each
+    text line once; the value of a label is then read from the words to its
+    right on the same row or, failing that, from the row just below it (as
+    in many form-style layouts), and checked against the field's value
+    pattern. Every value comes back with its own and its label's bounding box.
+    """
+
+    def __init__(self, labels: Optional[Dict[str, List[str]]] = None, ignored: Optional[List[str]] = None):
+        labels = FIELD_LABELS if labels is None else labels
+        ignored = IGNORED_LABELS if ignored is None else ignored
+        # First token -> [(tokens, field or None, rank)], longest phrase first
+        self._labels: Dict[str, List[Tuple[Tuple[str, ...], Optional[str], int]]] = {}
+        phrases = [(label, field, rank) for field, field_labels in labels.items()
+                   for rank, label in enumerate(field_labels)]
+        phrases += [(label, None, 0) for label in ignored]
+        for label, field, rank in phrases:
+            tokens = tuple(label.split())
+            self._labels.setdefault(tokens[0], []).append((tokens, field, rank))
+        for entries in self._labels.values():
+            entries.sort(key=lambda entry: len(entry[0]), reverse=True)
+
+    def find_labels(self, lines: Sequence[Sequence[Tuple]]) -> List[Tuple[str, int, List[Word]]]:
+        """
+        (field, rank, label words) of every label, in reading order
+
+        Args:
+            lines: Text lines, as lists of PyMuPDF word tuples
+        """
+        found = []
+        labels = self._labels
+        for line in lines:
+            tokens = [_normalize(word[4]) for word in line]
+            index = 0
+            while index < len(tokens):
+                token = tokens[index]
+                # Most words start no label; skip them without a call
+                matched = (self._match_label(tokens, index)
+                           if token in labels or token.endswith('#') else None)
+                if matched is None:
+                    index += 1
+                    continue
+                length, field, rank = matched
+                if field is not None:
+                    found.append((field, rank, [Word(*word[:5]) for word in line[index:index + length]]))
+                index += length
+        return found
+
+    def _match_label(self, tokens: List[str], index: int):
+        for phrase, field, rank in self._labels.get(tokens[index], ()):
+            if tuple(tokens[index:index + len(phrase)]) == phrase:
+                return len(phrase), field, rank
+        # 'No.:' and '#' are often glued to the previous word: 'Invoice#'
+        if tokens[index].endswith('#') and len(tokens[index]) > 1:
+            for phrase, field, rank in self._labels.get(tokens[index][:-1], ()):
+                if len(phrase) == 2 and phrase[1] == '#':
+                    return 1, field, rank
+        return None
+
+    @staticmethod
+    def read_value(field: str, words: List[Word]) -> Optional[Tuple[str, List[Word]]]:
+        """The field value at the start of words, and the words it spans"""
+        if not words:
+            return None
+        text = ' '.join(word.text for word in words)
+        match = VALUE_PATTERNS[field].match(text)
+        if not match:
+            return None
+        value = match.group(1).strip().rstrip('.,')
+        if field == 'date' and parse_date(''.join(value.split()).replace(',', '')) is None:
+            return None
+        if field == 'total' and parse_number(value) is None:
+            return None
+        # Words overlapping the matched characters
+        used, position = [], 0
+        for word in words:
+            if position >= match.end(1):
+                break
+            used.append(word)
+            position += len(word.text) + 1
+        return value, used
+
+    def extract(self, words: Sequence[Tuple]) -> Dict[str, Dict]:
+        """
+        Extract labelled fields from a page's words
+
+        Args:
+            words: PyMuPDF page.get_text("words") tuples
+                (x0, y0, x1, y1, text, block_no, line_no, word_no)
+
+        Returns:
+            {field: {'value', 'label', 'bbox', 'label_bbox'}}, boxes as
+            [x0, y0, x1, y1] in PDF points. Numeric values are normalised
+            like the regex fields: amounts to float strings, dates without
+            spaces or commas.
+        """
+        lines, current, key = [], [], None
+        for word in words:
+            if word[5:7] != key and current:
+                lines.append(current)
+                current = []
+            key = word[5:7]
+            current.append(word)
+        if current:
+            lines.append(current)
+
+        # Most pages of a long document have no labels; don't index those
+        labels = self.find_labels(lines)
+        if not labels:
+            return {}
+        index = LayoutIndex([Word(*word[:5]) for word in words])
+        best = {}
+        for field, rank, label in labels:
+            # Better label wins; among equals the first, except totals, which come last
+            order = (rank, -label[0].cy if field == 'total' else label[0].cy)
+            if field in best and best[field][0] <= order:
+                continue
+            found = self.read_value(field, index.right_of(label)) or self.read_value(field, index.below(label))
+            if found is not None:
+                best[field] = (order, label, *found)
+
+        results = {}
+        for field, (_, label, value, value_words) in best.items():
+            if field == 'total':
+                value = str(parse_number(value))
+            elif field == 'date':
+                value = ''.join(value.split()).replace(',', '')
+            entry = {
+                'value': value,
+                'label': ' '.join(word.text for word in label).rstrip(':'),
+                'bbox': _bbox(value_words),
+                'label_bbox': _bbox(label),
+            }
+            for name in [field] + FIELD_ALIASES.get(field, []):
+                results[name] = entry
+        return results
+
+def get_layout_extractor():
+    """
+    Singleton pattern to get the LayoutExtractor
+
+    Returns None when LAYOUT_FIELDS is set to false.
+    """
+    if not hasattr(get_layout_extractor, "instance"):
+        if os.getenv('LAYOUT_FIELDS', 'true').lower() in ('0', 'false', 'no'):
+            get_layout_extractor.instance = None
+        else:
+            get_layout_extractor.instance = LayoutExtractor()
+    return get_layout_extractor.instance
@@ -0,0 +1,209 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Tuple
+
+# Prometheus' default buckets, extended for multi-second OCR work
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonically increasing value, one series per label combination"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+class Gauge(Counter):
+    """Value that can go up and down, e.g. a duration measured once"""
+
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram:
+    """Observations counted into cumulative buckets, plus their sum and count"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][index] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, {'buckets': list(series['buckets']), 'sum': series['sum'],
+                                  'count': series['count']})
+                           for key, series in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series['buckets']):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(series['sum'])}"
+            yield f"{self.name}_count{_format_labels(self.labels, key)} {series['count']}"
+
+class MetricsRegistry:
+    """
+    In-process metrics, rendered in the Prometheus text exposition format
+
+    Metrics live in the memory of the serving process, so no external
+    service is needed; with several worker processes each one reports its
+    own values.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def get(self, name: str):
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+def get_metrics():
+    """Singleton pattern to get the process-wide MetricsRegistry with the app's metrics registered"""
+    if not hasattr(get_metrics, "instance"):
+        registry = MetricsRegistry()
+        registry.counter('http_requests_total', 'HTTP requests handled', ['method', 'endpoint', 'status'])
+        registry.histogram('http_request_duration_seconds', 'Time to produce a response (streamed bodies excluded)',
+                           ['method', 'endpoint'])
+        registry.counter('extract_documents_total', 'Documents extracted', ['file_type', 'cache'])
+        registry.counter('extract_pages_total', 'Pages extracted (cache hits excluded)', ['source'])
+        registry.histogram('extract_stage_seconds', 'Per-page time spent in each extraction stage',
+                           ['stage', 'source'])
+        registry.counter('extract_ocr_seconds_total', 'Total time spent in OCR')
+        registry.counter('extract_cache_lookups_total', 'Extraction cache lookups', ['result'])
+        registry.histogram('history_write_seconds', 'Latency of history writes', ['operation'])
+        registry.gauge('app_startup_seconds', 'Time spent starting this process, per phase', ['phase'])
+        get_metrics.instance = registry
+    return get_metrics.instance
+
+class StageTimer:
+    """
+    Time spent in each stage of handling one request
+
+    Stage durations are summed; pages OCR'd in parallel add up, so stages
+    can exceed the total wall time.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add_page_timings(self, pages: Iterable[Dict]):
+        """Fold the per-page 'timings' ({'<stage>_ms': ms}) reported by the pipeline into the totals"""
+        for page in pages:
+            for key, ms in (page.get('timings') or {}).items():
+                self.add(key[:-len('_ms')] if key.endswith('_ms') else key, ms / 1000.0)
+
+    def as_dict(self, include_total: bool = True) -> Dict[str, float]:
+        timings = {f'{name}_ms': round(seconds * 1000, 2) for name, seconds in self.stages.items()}
+        if include_total:
+            timings['total_ms'] = round((time.perf_counter() - self.started) * 1000, 2)
+        return timings
+
+    def server_timing(self) -> str:
+        """Value for the Server-Timing response header"""
+        return ', '.join(f"{key[:-len('_ms')]};dur={ms}" for key, ms in self.as_dict().items())
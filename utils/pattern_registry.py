@@ -0,0 +1,234 @@
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: writes are only serialized within one process
+    fcntl = None
+
+PATTERNS_PATH = 'patterns.json'
+
+FIELD_NAME = re.compile(r'^[a-z][a-z0-9_]{0,63}$')
+MAX_PATTERN_LENGTH = 500
+MAX_PATTERNS_PER_FIELD = 50
+
+def validate_pattern(pattern) -> str:
+    """
+    Check that a pattern can be used by the field guesser
+
+    Raises:
+        ValueError: If the pattern is not a non-empty string that compiles
+    """
+    if not isinstance(pattern, str) or not pattern.strip():
+        raise ValueError("Pattern must be a non-empty string")
+    if len(pattern) > MAX_PATTERN_LENGTH:
+        raise ValueError(f"Pattern is longer than {MAX_PATTERN_LENGTH} characters")
+    try:
+        re.compile(pattern, re.IGNORECASE)
+    except re.error as e:
+        raise ValueError(f"Invalid pattern {pattern!r}: {e}")
+    return pattern
+
+def validate_field(field_name) -> str:
+    if not isinstance(field_name, str) or not FIELD_NAME.match(field_name):
+        raise ValueError("Field names must be lower-case letters, digits and underscores")
+    return field_name
+
+class PatternRegistry:
+    """
+    Custom field patterns shared by every worker through one JSON file
+
+    The file holds {"revision": n, "patterns": {field: [pattern, ...]}}; a
+    field listed there replaces the built-in patterns of that field. Writes
+    re-read the file under a lock, validate, and atomically replace it with
+    the revision bumped, so concurrent workers never lose each other's
+    changes. Readers call refresh(), which stats the file at most every
+    check_interval seconds and only re-reads it when its mtime or size
+    changed.
+
+    The legacy patterns.json layout (a bare {field: [pattern, ...]} object)
+    is read as revision 0.
+    """
+
+    def __init__(self, path: str = PATTERNS_PATH, check_interval: float = 2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.revision = 0
+        self.patterns: Dict[str, List[str]] = {}
+        # Bumped whenever the loaded patterns change, so users can tell when to rebuild
+        self.generation = 0
+        self._stamp = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.refresh(force=True)
+
+    def _file_stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _read(self):
+        """(revision, patterns) as stored in the file"""
+        if not os.path.exists(self.path):
+            return 0, {}
+        with open(self.path, 'r') as f:
+            data = json.load(f)
+        if isinstance(data.get('patterns'), dict):
+            return int(data.get('revision', 0)), data['patterns']
+        return 0, data
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        Reload the file if another process changed it
+
+        Returns:
+            True if the loaded patterns changed
+        """
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return False
+        with self._lock:
+            self._checked_at = now
+            stamp = self._file_stamp()
+            if not force and stamp == self._stamp:
+                return False
+            try:
+                revision, patterns = self._read()
+                patterns = {validate_field(field): [validate_pattern(p) for p in values]
+                            for field, values in patterns.items()}
+            except (OSError, ValueError, AttributeError, TypeError) as e:
+                # Keep serving the last good patterns rather than failing every extraction
+                print(f"Warning: Failed to load custom patterns: {str(e)}")
+                return False
+            self._stamp = stamp
+            if revision == self.revision and patterns == self.patterns:
+                return False
+            self.revision, self.patterns = revision, patterns
+            self.generation += 1
+            return True
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(f"{self.path}.lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _update(self, change) -> bool:
+        """
+        Apply change(patterns) to the latest file contents and write them back
+
+        change edits the dict in place and returns whether it changed anything;
+        the file (and its revision) is left alone when it did not.
+        """
+        with self._lock, self._file_lock():
+            revision, patterns = self._read()
+            patterns = {field: list(values) for field, values in patterns.items()}
+            if not change(patterns):
+                return False
+
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump({'revision': revision + 1, 'patterns': patterns}, f, indent=4)
+            os.replace(temp_path, self.path)
+
+            self.revision, self.patterns = revision + 1, patterns
+            self.generation += 1
+            self._stamp = self._file_stamp()
+            self._checked_at = time.monotonic()
+            return True
+
+    def set_field(self, field_name: str, patterns: List[str]):
+        """
+        Replace the patterns of a field
+
+        Raises:
+            ValueError: If the field name or any pattern is invalid
+        """
+        validate_field(field_name)
+        if not isinstance(patterns, list) or not patterns:
+            raise ValueError("patterns must be a non-empty list")
+        if len(patterns) > MAX_PATTERNS_PER_FIELD:
+            raise ValueError(f"A field can have at most {MAX_PATTERNS_PER_FIELD} patterns")
+        patterns = list(dict.fromkeys(validate_pattern(pattern) for pattern in patterns))
+
+        def change(current):
+            if current.get(field_name) == patterns:
+                return False
+            current[field_name] = patterns
+            return True
+        self._update(change)
+
+    def add_pattern(self, field_name: str, pattern: str, defaults: Optional[List[str]] = None):
+        """
+        Append a pattern to a field
+
+        Args:
+            field_name: Field to extend
+            pattern: Regular expression, matched case-insensitively
+            defaults: Built-in patterns of the field, kept when it is first customized
+
+        Raises:
+            ValueError: If the field name or pattern is invalid
+        """
+        validate_field(field_name)
+        validate_pattern(pattern)
+
+        def change(current):
+            values = current.setdefault(field_name, list(defaults or []))
+            if pattern in values:
+                return False
+            if len(values) >= MAX_PATTERNS_PER_FIELD:
+                raise ValueError(f"A field can have at most {MAX_PATTERNS_PER_FIELD} patterns")
+            values.append(pattern)
+            return True
+        self._update(change)
+
+    def remove(self, field_name: str, pattern: Optional[str] = None,
+               defaults: Optional[List[str]] = None) -> bool:
+        """
+        Remove one pattern of a field, or the field's customization entirely
+
+        Removing the customization restores the built-in patterns, if any.
+
+        Returns:
+            False if there was nothing to remove
+        """
+        def change(current):
+            if pattern is None:
+                return current.pop(field_name, None) is not None
+            values = current.get(field_name, list(defaults or []))
+            if pattern not in values:
+                return False
+            values.remove(pattern)
+            if values or defaults:
+                current[field_name] = values
+            else:
+                # Nothing left of a field that has no built-in patterns
+                current.pop(field_name, None)
+            return True
+        return self._update(change)
+
+def get_pattern_registry():
+    """Singleton pattern to get the PatternRegistry"""
+    if not hasattr(get_pattern_registry, "instance"):
+        get_pattern_registry.instance = PatternRegistry(
+            path=os.getenv('PATTERNS_PATH', PATTERNS_PATH),
+            check_interval=float(os.getenv('PATTERNS_CHECK_INTERVAL', 2.0)),
+        )
+    return get_pattern_registry.instance
@@ -1,14 +1,17 @@
-import pdfplumber
+from services.pipeline import ExtractionPipeline, ocr_stage, preprocess_stage
+from services.upload_service import Upload
 
 def extract_text_from_pdf(pdf_path):
+    """Text of every page of a PDF, through the text/OCR stages of the extraction pipeline"""
     pages_data = []
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            for i, page in enumerate(pdf.pages):
-                text = page.extract_text()
+        pipeline = ExtractionPipeline(stages=[('preprocess', preprocess_stage), ('ocr', ocr_stage)])
+        # Opened by path, so MuPDF reads pages from the file as needed
+        with Upload.from_path(pdf_path) as upload:
+            for page in pipeline.run(upload, 'pdf'):
                 pages_data.append({
-                    "page": i + 1,
-                    "text": text.strip() if text else ""
+                    "page": page['page'],
+                    "text": page['text'].strip()
                 })
     except Exception as e:
         print(f"[PDF Parser] Error: {e}")
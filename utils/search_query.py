@@ -0,0 +1,80 @@
+import re
+from typing import List, Sequence
+
+MAX_QUERY_LENGTH = 500
+MAX_QUERY_TERMS = 32
+
+# One term: optional '-', optional 'column:' scope, then a "quoted phrase" or a bare word
+_TERM = re.compile(r'\s*(-?)(?:([a-z][a-z0-9_]*):)?(?:"([^"]*)"?|(\S+))')
+_WORD = re.compile(r'\w')
+
+def _quote(text: str) -> str:
+    return '"' + text.replace('"', '""') + '"'
+
+def to_match_expression(query: str, columns: Sequence[str]) -> str:
+    """
+    Translate a user search query into an SQLite FTS5 MATCH expression
+
+    Supported syntax:
+    - words: all must match (``acme invoice``); ``inv*`` matches a prefix
+    - "quoted phrases": the words in this order (``"acme supplies"``)
+    - column:term or column:"phrase": only search that column (``invoice_number:123``)
+    - -term: exclude matches
+    - OR between groups of terms (``acme OR globex``)
+
+    Every term is quoted in the output, so FTS5 syntax in the input is
+    searched for literally and can never raise a syntax error.
+
+    Args:
+        query: The query as typed by the user
+        columns: Column names usable as scopes
+
+    Raises:
+        ValueError: If the query is empty, too long, only excludes terms or
+            scopes an unknown column
+    """
+    if len(query) > MAX_QUERY_LENGTH:
+        raise ValueError(f"Query is longer than {MAX_QUERY_LENGTH} characters")
+
+    groups: List[str] = []
+    included: List[str] = []
+    excluded: List[str] = []
+    terms = 0
+
+    def close_group():
+        if excluded and not included:
+            raise ValueError("A query must include at least one term besides excluded ones")
+        if included:
+            expression = ' AND '.join(included)
+            if excluded:
+                expression = f"({expression}) NOT ({' OR '.join(excluded)})"
+            groups.append(f"({expression})")
+        included.clear()
+        excluded.clear()
+
+    for match in _TERM.finditer(query):
+        negate, scope, phrase, word = match.groups()
+        if word == 'OR' and not negate and scope is None:
+            close_group()
+            continue
+        text = phrase if phrase is not None else word
+        prefix = phrase is None and text.endswith('*')
+        if prefix:
+            text = text.rstrip('*')
+        # Punctuation alone produces no tokens, so there is nothing to look up
+        if not _WORD.search(text):
+            continue
+        if scope is not None and scope not in columns:
+            raise ValueError(f"Unknown search field '{scope}'; use one of: {', '.join(columns)}")
+        terms += 1
+        if terms > MAX_QUERY_TERMS:
+            raise ValueError(f"A query can have at most {MAX_QUERY_TERMS} terms")
+        term = _quote(text) + (' *' if prefix else '')
+        if scope is not None:
+            term = f"{scope} : {term}"
+        (excluded if negate else included).append(term)
+    close_group()
+
+    if not groups:
+        raise ValueError("Search query has no terms")
+    return ' OR '.join(groups)
@@ -0,0 +1,85 @@
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+from utils.metrics import get_metrics
+
+# Startup timings of this process in ms, by phase; also exported as app_startup_seconds
+STARTUP_TIMINGS: Dict[str, float] = {}
+
+_prewarm_lock = threading.Lock()
+
+def record_timing(phase: str, seconds: float):
+    STARTUP_TIMINGS[phase] = round(seconds * 1000, 1)
+    get_metrics().get('app_startup_seconds').set(seconds, phase=phase)
+
+def _load_pymupdf():
+    import fitz  # noqa: F401
+
+def _load_pillow():
+    from PIL import Image
+    Image.init()
+
+def _load_pipeline():
+    from services.pipeline import get_pipeline
+    get_pipeline()
+
+def _load_ocr_backend():
+    from services.extract_service import get_ocr_backend
+    get_ocr_backend()
+
+def _load_field_patterns():
+    from utils.field_guesser import get_field_guesser
+    get_field_guesser()
+
+def _open_history():
+    from services.history_service import get_history_backend
+    get_history_backend()
+
+# What the first extraction would otherwise load, cheapest to most useful last
+PREWARM_STEPS: List[Tuple[str, Callable[[], None]]] = [
+    ('pymupdf', _load_pymupdf),
+    ('pillow', _load_pillow),
+    ('pipeline', _load_pipeline),
+    ('ocr_backend', _load_ocr_backend),
+    ('field_patterns', _load_field_patterns),
+    ('history', _open_history),
+]
+
+def prewarm() -> Dict[str, float]:
+    """
+    Load the extraction backends now instead of on the first request
+
+    Runs once per process; a failing step is reported and skipped, since the
+    request that needs it will load it (and report the error) again.
+
+    Returns:
+        Milliseconds per step
+    """
+    with _prewarm_lock:
+        if 'prewarm' in STARTUP_TIMINGS:
+            return {}
+        started = time.perf_counter()
+        timings = {}
+        for name, step in PREWARM_STEPS:
+            step_started = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                print(f"Warning: Prewarming {name} failed: {str(e)}")
+                continue
+            elapsed = time.perf_counter() - step_started
+            timings[name] = round(elapsed * 1000, 1)
+            record_timing(f"prewarm_{name}", elapsed)
+        record_timing('prewarm', time.perf_counter() - started)
+        return timings
+
+def prewarm_in_background() -> threading.Thread:
+    """Run prewarm() in a daemon thread, so startup doesn't wait for it"""
+    thread = threading.Thread(target=prewarm, name='prewarm', daemon=True)
+    thread.start()
+    return thread
+
+def format_timings() -> str:
+    """One-line summary of STARTUP_TIMINGS, e.g. for a startup log"""
+    return ', '.join(f"{phase} {ms} ms" for phase, ms in STARTUP_TIMINGS.items())
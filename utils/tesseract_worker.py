@@ -0,0 +1,127 @@
+"""
+Tesseract worker process for the 'workers' OCR backend
+
+    python utils/tesseract_worker.py <lang> [libtesseract path]
+
+Loads libtesseract through ctypes once, keeping its engine and language
+model warm, then recognises the images it is sent on stdin until stdin is
+closed. Only the standard library is imported, so the worker starts fast.
+
+Protocol, all integers big-endian:
+- on start the worker sends a RESPONSE frame: status 0 when the engine is
+  ready, else status 1 and the error message
+- request: REQUEST header (width, height, bytes per pixel, ppi, data
+  length) followed by the raw 8-bit grey (1) or RGB (3) pixels
+- response: RESPONSE header (status, payload length) followed by the
+  UTF-8 text (status 0) or error message (status 1)
+"""
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+
+REQUEST = struct.Struct('>IIIII')
+RESPONSE = struct.Struct('>BI')
+
+LIBRARY_NAMES = ['libtesseract.so.5', 'libtesseract.so.4', 'libtesseract.dylib', 'libtesseract-5.dll']
+
+def load_library(path=None):
+    """
+    Load libtesseract, from path or the usual names
+
+    Raises:
+        OSError: If it can't be found
+    """
+    candidates = [path] if path else [ctypes.util.find_library('tesseract')] + LIBRARY_NAMES
+    for candidate in candidates:
+        if not candidate:
+            continue
+        try:
+            return ctypes.CDLL(candidate)
+        except OSError:
+            continue
+    raise OSError(f"libtesseract not found (tried {', '.join(filter(None, candidates))})")
+
+class Engine:
+    """A Tesseract engine through the C API"""
+
+    def __init__(self, lang, library=None):
+        lib = load_library(library)
+        lib.TessBaseAPICreate.restype = ctypes.c_void_p
+        lib.TessBaseAPIInit3.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p]
+        lib.TessBaseAPIInit3.restype = ctypes.c_int
+        lib.TessBaseAPISetImage.argtypes = [ctypes.c_void_p, ctypes.c_char_p] + [ctypes.c_int] * 4
+        lib.TessBaseAPISetSourceResolution.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        lib.TessBaseAPIGetUTF8Text.argtypes = [ctypes.c_void_p]
+        # Kept as a raw pointer so it can be handed back to TessDeleteText
+        lib.TessBaseAPIGetUTF8Text.restype = ctypes.c_void_p
+        lib.TessDeleteText.argtypes = [ctypes.c_void_p]
+        lib.TessBaseAPIEnd.argtypes = [ctypes.c_void_p]
+        lib.TessBaseAPIDelete.argtypes = [ctypes.c_void_p]
+        self.lib = lib
+        self.api = lib.TessBaseAPICreate()
+        if lib.TessBaseAPIInit3(self.api, None, lang.encode()) != 0:
+            lib.TessBaseAPIDelete(self.api)
+            raise RuntimeError(f"Tesseract could not load language {lang}")
+
+    def recognise(self, pixels: bytes, width: int, height: int, bytes_per_pixel: int, ppi: int) -> bytes:
+        self.lib.TessBaseAPISetImage(self.api, pixels, width, height, bytes_per_pixel, width * bytes_per_pixel)
+        if ppi:
+            self.lib.TessBaseAPISetSourceResolution(self.api, ppi)
+        text = self.lib.TessBaseAPIGetUTF8Text(self.api)
+        if not text:
+            raise RuntimeError("Tesseract failed to recognise the image")
+        try:
+            return ctypes.string_at(text)
+        finally:
+            self.lib.TessDeleteText(text)
+
+    def close(self):
+        self.lib.TessBaseAPIEnd(self.api)
+        self.lib.TessBaseAPIDelete(self.api)
+
+def read_exactly(stream, size: int):
+    """size bytes from stream, or None at end of stream"""
+    data = b''
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+def main(argv):
+    # Frames go out on a copy of stdout; anything Tesseract prints goes to stderr
+    out = os.fdopen(os.dup(1), 'wb')
+    os.dup2(2, 1)
+    requests = sys.stdin.buffer
+
+    def send(status: int, payload: bytes):
+        out.write(RESPONSE.pack(status, len(payload)) + payload)
+        out.flush()
+
+    try:
+        engine = Engine(argv[1] if len(argv) > 1 else 'eng', argv[2] if len(argv) > 2 and argv[2] else None)
+    except Exception as e:
+        send(1, str(e).encode())
+        return 1
+    send(0, b'')
+    try:
+        while True:
+            header = read_exactly(requests, REQUEST.size)
+            if header is None:
+                return 0
+            width, height, bytes_per_pixel, ppi, length = REQUEST.unpack(header)
+            pixels = read_exactly(requests, length)
+            if pixels is None:
+                return 0
+            try:
+                send(0, engine.recognise(pixels, width, height, bytes_per_pixel, ppi))
+            except Exception as e:
+                send(1, str(e).encode())
+    finally:
+        engine.close()
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))